@@ -0,0 +1,51 @@
+"""Measure the memory held by loaded records, as dicts and compacted.
+
+    python benchmarks/bench_memory.py [lines]
+"""
+import os
+import sys
+import tracemalloc
+from tempfile import TemporaryDirectory
+
+# Run from a checkout without installing the package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nexus.db import NexusDB
+
+
+
+def writeRecords(path, count):
+    """One op per record, so memory is dominated by the records themselves."""
+    ts = 1_700_000_000_000_000_000
+    with open(path, "w") as f:
+        f.write("* format=nexus\n* encoding=utf8\n")
+        for n in range(count):
+            f.write(f'N {ts + n} todo-{n} task="Task {n % 1000}" done={n % 2} prio={n % 7}\n')
+
+
+def measure(dirname, compactRecords):
+    tracemalloc.start()
+    db = NexusDB(dirname, checkpointEvery=None, compactRecords=compactRecords)
+    db.readAll()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(db.records), current, peak
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "bench.nexus")
+        writeRecords(path, count)
+        size = os.path.getsize(path)
+        print(f"{count:,} lines, {size / 1e6:.1f} MB on disk")
+        for name, compactRecords in (("dict", False), ("compact", True)):
+            records, current, peak = measure(tempdir, compactRecords)
+            print(
+                f"{name:<8} {records:>8,} records {current / 1e6:>8.1f} MB held"
+                f" {current / records:>6.0f} B/record {peak / 1e6:>8.1f} MB peak"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Compare a serial NexusDB.readAll() with parsing in worker processes.
+
+    python benchmarks/bench_parallel.py [devices] [lines per device]
+"""
+import os
+import sys
+from tempfile import TemporaryDirectory
+
+# Run from a checkout without installing the package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nexus.db import NexusDB
+
+from bench_read import best, writeLog
+
+
+def load(dirname, workers):
+    db = NexusDB(dirname, checkpointEvery=None)
+    db.readAll(workers=workers)
+    return db.records
+
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200_000
+    with TemporaryDirectory() as tempdir:
+        for n in range(devices):
+            writeLog(os.path.join(tempdir, f"device{n}.nexus"), count)
+        for workers in (None, 2, 4, 0):
+            elapsed = best(lambda: load(tempdir, workers))
+            name = "serial" if workers is None else f"workers={workers or os.cpu_count()}"
+            print(f"{name:<12} {devices * count / elapsed:>12,.0f} ops/s {elapsed:>8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
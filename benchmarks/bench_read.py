@@ -0,0 +1,62 @@
+"""Compare NexusFile replay through readline() with the mmap reader.
+
+    python benchmarks/bench_read.py [lines]
+"""
+import os
+import random
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+# Run from a checkout without installing the package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nexus.file import NexusFile
+
+
+def writeLog(path, count):
+    rnd = random.Random(1)
+    ts = 1_700_000_000_000_000_000
+    with open(path, "w") as f:
+        f.write("* format=nexus\n* encoding=utf8\n")
+        for n in range(count):
+            ts += rnd.randint(1_000, 10_000_000)
+            recordId = f"todo-{rnd.randint(0, 5_000)}"
+            kind = rnd.random()
+            if kind < 0.5:
+                f.write(f'N {ts} {recordId} task="Write \\"thing\\" {n}" done=0 prio={n % 7}\n')
+            elif kind < 0.9:
+                f.write(f'I {ts} {recordId} count=1\n')
+            else:
+                f.write(f'X {ts} {recordId}\n')
+
+
+def replay(path, useMmap):
+    nf = NexusFile(path, "r", useMmap=useMmap)
+    count = sum(1 for _ in nf.iterOps())
+    nf.close()
+    return count
+
+
+def best(fn, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "bench.nexus")
+        writeLog(path, count)
+        size = os.path.getsize(path)
+        for name, useMmap in (("readline", False), ("mmap", True)):
+            elapsed = best(lambda: replay(path, useMmap))
+            print(f"{name:<10} {count / elapsed:>12,.0f} lines/s {size / elapsed / 1e6:>8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
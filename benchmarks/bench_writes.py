@@ -0,0 +1,48 @@
+"""Compare write throughput of NexusDB.set against batched write sessions.
+
+    python benchmarks/bench_writes.py [count]
+"""
+import os
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+# Run from a checkout without installing the package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nexus.db import NexusDB
+from nexus.file import Durability
+
+
+def perCall(db, count):
+    for n in range(count):
+        db.set(f"rec-{n}", {"n": n, "name": "benchmark"})
+
+
+def batched(durability):
+    def run(db, count):
+        with db.batch(durability=durability) as b:
+            for n in range(count):
+                b.set(f"rec-{n}", {"n": n, "name": "benchmark"})
+    return run
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    cases = [
+        ("NexusDB.set", perCall),
+        ("batch durability=NONE", batched(Durability.NONE)),
+        ("batch durability=BATCH", batched(Durability.BATCH)),
+        ("batch durability=OP", batched(Durability.OP)),
+    ]
+    for name, run in cases:
+        with TemporaryDirectory() as tempdir:
+            db = NexusDB(tempdir)
+            start = time.perf_counter()
+            run(db, count)
+            elapsed = time.perf_counter() - start
+        print(f"{name:<24} {count / elapsed:>12,.0f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
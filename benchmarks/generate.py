@@ -0,0 +1,171 @@
+"""Build synthetic multi-device databases for the benchmarks.
+
+    python benchmarks/generate.py DIRNAME [--devices 4] [--ops 100000] ...
+
+Every device file gets its share of the ops with increasing timestamps
+that interleave with the other devices, like a database synced between
+machines. The same arguments (and seed) always produce the same files.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+
+# Run from a checkout without installing the package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nexus.file import headerLines
+
+
+DEFAULT_MIX = "N=40,U=15,I=25,D=5,X=15"
+
+ESCAPES = {'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+
+def parseMix(mix):
+    """Parse `N=40,U=15,...` into ops and weights."""
+    ops = []
+    weights = []
+    for part in mix.split(","):
+        op, weight = part.split("=")
+        if op not in "NUIDX":
+            raise ValueError(f"Unknown op {op!r} in mix")
+        ops.append(op)
+        weights.append(float(weight))
+    return ops, weights
+
+
+def quote(value):
+    return '"' + "".join(ESCAPES.get(c, c) for c in value) + '"'
+
+
+class Generator:
+    def __init__(
+        self,
+        devices=4,
+        ops=100_000,
+        records=10_000,
+        keys=8,
+        keysPerOp=3,
+        keySize=6,
+        valueSize=16,
+        escapes=0.1,
+        mix=DEFAULT_MIX,
+        seed=1,
+    ):
+        self.devices = devices
+        self.ops = ops
+        self.records = records
+        self.keysPerOp = min(keysPerOp, keys)
+        self.keySize = keySize
+        self.valueSize = valueSize
+        self.escapes = escapes
+        self.mix = parseMix(mix)
+        self.rnd = random.Random(seed)
+        self.keys = [
+            "k" + "".join(self.rnd.choices(string.ascii_lowercase, k=max(0, keySize - 1)))
+            + str(n)
+            for n in range(keys)
+        ]
+        # I and D ops only touch the counters, which N and U never set to
+        # strings, so the generated history always replays.
+        self.counters = self.keys[:max(1, len(self.keys) // 4)]
+        self.fields = self.keys[len(self.counters):] or self.counters
+
+    def params(self):
+        return {
+            "devices": self.devices,
+            "ops": self.ops,
+            "records": self.records,
+            "keys": len(self.keys),
+            "keysPerOp": self.keysPerOp,
+            "keySize": self.keySize,
+            "valueSize": self.valueSize,
+            "escapes": self.escapes,
+            "mix": ",".join(f"{op}={weight:g}" for op, weight in zip(*self.mix)),
+        }
+
+    def value(self):
+        rnd = self.rnd
+        if rnd.random() < 0.5:
+            return str(rnd.randint(-1000, 1_000_000))
+        text = "".join(rnd.choices(string.ascii_letters + " ", k=self.valueSize))
+        if rnd.random() < self.escapes:
+            pos = rnd.randrange(len(text) + 1)
+            text = text[:pos] + rnd.choice('"\\\n\t') + text[pos:]
+        return quote(text)
+
+    def line(self, ts):
+        rnd = self.rnd
+        op = rnd.choices(*self.mix)[0]
+        recordId = f"rec-{rnd.randrange(self.records)}"
+        if op == "X":
+            keys = rnd.sample(self.keys, rnd.randrange(self.keysPerOp + 1))
+            return " ".join([op, str(ts), recordId] + keys) + "\n"
+        elif op in "ID":
+            keys = rnd.sample(self.counters, min(self.keysPerOp, len(self.counters)))
+            pairs = [f"{key}={rnd.randint(1, 10)}" for key in keys]
+        else:
+            keys = rnd.sample(self.fields, min(self.keysPerOp, len(self.fields)))
+            pairs = [f"{key}={self.value()}" for key in keys]
+        return " ".join([op, str(ts), recordId] + pairs) + "\n"
+
+    def write(self, dirname):
+        """Write the device files into `dirname` and return their paths."""
+        os.makedirs(dirname, exist_ok=True)
+        paths = [os.path.join(dirname, f"device{n:03d}.nexus") for n in range(self.devices)]
+        files = [open(path, "w", encoding="utf8", newline="\n") for path in paths]
+        try:
+            for n, f in enumerate(files):
+                f.writelines(headerLines(f"device{n:03d}", f"00000000-0000-0000-0000-{n:012d}"))
+            ts = 1_700_000_000_000_000_000
+            for _ in range(self.ops):
+                ts += self.rnd.randint(1, 5_000_000)
+                files[self.rnd.randrange(self.devices)].write(self.line(ts))
+        finally:
+            for f in files:
+                f.close()
+        return paths
+
+
+def addArguments(parser):
+    parser.add_argument("--devices", type=int, default=4)
+    parser.add_argument("--ops", type=int, default=100_000)
+    parser.add_argument("--records", type=int, default=10_000)
+    parser.add_argument("--keys", type=int, default=8)
+    parser.add_argument("--keys-per-op", type=int, default=3, dest="keysPerOp")
+    parser.add_argument("--key-size", type=int, default=6, dest="keySize")
+    parser.add_argument("--value-size", type=int, default=16, dest="valueSize")
+    parser.add_argument("--escapes", type=float, default=0.1, help="share of strings with escapes")
+    parser.add_argument("--mix", type=str, default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=1)
+
+
+def fromArguments(args):
+    return Generator(
+        devices=args.devices,
+        ops=args.ops,
+        records=args.records,
+        keys=args.keys,
+        keysPerOp=args.keysPerOp,
+        keySize=args.keySize,
+        valueSize=args.valueSize,
+        escapes=args.escapes,
+        mix=args.mix,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dirname")
+    addArguments(parser)
+    args = parser.parse_args()
+    paths = fromArguments(args).write(args.dirname)
+    size = sum(os.path.getsize(path) for path in paths)
+    print(f"Wrote {args.ops:,} ops to {len(paths)} device files ({size / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
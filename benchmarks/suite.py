@@ -0,0 +1,237 @@
+"""Benchmark suite: time the main read, query and write paths.
+
+    python benchmarks/suite.py run [-o results.json] [generator options]
+    python benchmarks/suite.py compare old.json new.json [--threshold 0.1]
+
+`run` builds a synthetic database with generate.py, times every case
+below (best of `--repeat` runs) and writes the results as JSON, along
+with the generator parameters and the git revision. `compare` prints the
+change of each case between two result files and exits with status 1
+when any case got slower by more than the threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Run from a checkout without installing the package.
+sys.path.insert(0, ROOT)
+
+import generate
+from nexus import parser
+from nexus.db import NexusDB
+from nexus.file import NexusFile
+
+
+def best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def readLines(path):
+    with open(path, encoding="utf8") as f:
+        return [line for line in f if line[0] != "*"]
+
+
+def benchParser(dirname, paths, gen, repeat):
+    lines = readLines(paths[0])
+
+    def run():
+        parse = parser.parseOpLine
+        for line in lines:
+            parse(line)
+    return len(lines), best(run, repeat)
+
+
+def benchFileReadAll(dirname, paths, gen, repeat):
+    def run():
+        nf = NexusFile(paths[0], "r")
+        nf.readAll()
+        nf.close()
+    return len(readLines(paths[0])), best(run, repeat)
+
+
+def benchDBReadAll(dirname, paths, gen, repeat):
+    count = sum(len(readLines(path)) for path in paths)
+    return count, best(lambda: NexusDB(dirname, checkpointEvery=None).readAll(), repeat)
+
+
+def benchFind(dirname, paths, gen, repeat):
+    db = NexusDB(dirname, checkpointEvery=None)
+    db.readAll()
+    counter, field = gen.counters[0], gen.fields[0]
+    queries = [
+        dict(prefix="rec-1"),
+        dict(where=f"{counter}>5 OR {field}~ab", fields=[field]),
+        dict(where=f"NOT {counter}<0", orderBy=field, limit=10),
+    ]
+
+    def run():
+        for query in queries:
+            for _ in db.query(**query):
+                pass
+    return len(queries) * len(db.records), best(run, repeat)
+
+
+def benchScan(dirname, paths, gen, repeat, pageSize=50):
+    db = NexusDB(dirname, checkpointEvery=None)
+    db.readAll()
+
+    def run():
+        page = db.scan("rec-", limit=pageSize)
+        while page:
+            page = db.scan("rec-", startAfter=page[-1][0], limit=pageSize)
+    return len(db.records), best(run, repeat)
+
+
+def benchBulkWrites(dirname, paths, gen, repeat, count=20_000):
+    def run():
+        with TemporaryDirectory() as tempdir:
+            db = NexusDB(tempdir)
+            with db.batch() as b:
+                for n in range(count):
+                    b.set(f"rec-{n}", {"n": str(n), "name": "benchmark"})
+    return count, best(run, repeat)
+
+
+def benchSetMany(dirname, paths, gen, repeat, count=20_000):
+    def run():
+        with TemporaryDirectory() as tempdir:
+            NexusDB(tempdir).setMany((f"rec-{n}", {"n": str(n), "name": "benchmark"}) for n in range(count))
+    return count, best(run, repeat)
+
+
+def benchStartup(dirname, paths, gen, repeat):
+    """A command on an empty database: interpreter and nexus startup."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    with TemporaryDirectory() as tempdir:
+        command = [
+            sys.executable, "-c", "from nexus.main import main; main()",
+            tempdir, "get", "rec-1",
+        ]
+
+        def run():
+            subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+        return 1, best(run, repeat)
+
+
+def benchCLI(dirname, paths, gen, repeat):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    command = [
+        sys.executable, "-c", "from nexus.main import main; main()",
+        dirname, "get", "rec-1",
+    ]
+
+    def run():
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+    return 1, best(run, repeat)
+
+
+CASES = {
+    "parser.parseOpLine": benchParser,
+    "NexusFile.readAll": benchFileReadAll,
+    "NexusDB.readAll": benchDBReadAll,
+    "find": benchFind,
+    "scan": benchScan,
+    "bulk writes": benchBulkWrites,
+    "setMany": benchSetMany,
+    "cli startup": benchStartup,
+    "cli get": benchCLI,
+}
+
+
+def gitRevision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    gen = generate.fromArguments(args)
+    results = {}
+    with TemporaryDirectory() as tempdir:
+        paths = gen.write(tempdir)
+        for name, bench in CASES.items():
+            if args.only and name not in args.only:
+                continue
+            count, seconds = bench(tempdir, paths, gen, args.repeat)
+            results[name] = {"count": count, "seconds": seconds, "perSecond": count / seconds}
+            print(f"{name:<20} {count / seconds:>14,.0f} /s {seconds * 1000:>10.1f} ms")
+    data = {
+        "revision": gitRevision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": dict(gen.params(), seed=args.seed),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump(data, f, indent=2)
+
+
+def compare(args):
+    with open(args.old, encoding="utf8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf8") as f:
+        new = json.load(f)
+    if old["params"] != new["params"]:
+        print("Warning: the results were run with different parameters", file=sys.stderr)
+    print(f"{'case':<20} {old['revision'] or 'old':>12} {new['revision'] or 'new':>12} {'change':>8}")
+    regressions = 0
+    for name, result in new["results"].items():
+        before = old["results"].get(name)
+        if before is None:
+            print(f"{name:<20} {'':>12} {result['seconds'] * 1000:>10.1f}ms")
+            continue
+        change = result["seconds"] / before["seconds"] - 1
+        flag = ""
+        if change > args.threshold:
+            flag = " slower"
+            regressions += 1
+        elif change < -args.threshold:
+            flag = " faster"
+        print(
+            f"{name:<20} {before['seconds'] * 1000:>10.1f}ms {result['seconds'] * 1000:>10.1f}ms"
+            f" {change:>+8.1%}{flag}"
+        )
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    argParser = argparse.ArgumentParser()
+    commands = argParser.add_subparsers(dest="command", required=True)
+
+    runParser = commands.add_parser("run")
+    runParser.add_argument("-o", "--output", type=str, default=None)
+    runParser.add_argument("--repeat", type=int, default=3)
+    runParser.add_argument("--only", type=str, action="append", choices=list(CASES))
+    generate.addArguments(runParser)
+
+    compareParser = commands.add_parser("compare")
+    compareParser.add_argument("old")
+    compareParser.add_argument("new")
+    compareParser.add_argument("--threshold", type=float, default=0.1)
+
+    args = argParser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
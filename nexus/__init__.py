@@ -1,18 +1,23 @@
 from __future__ import annotations
 
 
-from typing import Iterable, Optional, Tuple, List
+# typing is slow to import and only needed by type checkers here.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Iterable, Optional, Tuple, List
 
 # from .db import NexusFile
 
 
 class NexusPage:
-    owner: 'nexus.file.NexusFile'
+    owner: 'nexus.db.NexusDB'
+    recordId: Optional[str]
     styles: List[NexusStyle]
     blocks: List[NexusBlock]
 
-    def __init__(self, owner):
+    def __init__(self, owner, recordId=None):
         self.owner = owner
+        self.recordId = recordId
         self.styles = []
         self.blocks = []
     
@@ -26,7 +31,7 @@ class NexusPage:
         raise NotImplementedError()
     
     def getPropertyHistory(self, name: str) -> Iterable[str]:
-        raise NotImplementedError()
+        return [value for _, value in self.owner.history(self.recordId, name)]
     
     def getBlocks(self) -> Iterable[NexusBlock]:
         raise NotImplementedError()
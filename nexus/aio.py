@@ -0,0 +1,133 @@
+"""asyncio front end for NexusDB.
+
+Everything that reads or writes files runs in an executor (the loop's
+default thread pool unless one is given), so the event loop stays
+responsive while a large database loads. Lookups in records that are
+already loaded are answered directly, and so are writes to a batch,
+see AsyncWriteBatch.
+"""
+import asyncio
+import functools
+
+from nexus.db import NexusDB
+from nexus.file import Durability
+
+
+class AsyncNexusDB:
+    def __init__(self, dirname, executor=None, **kwargs):
+        self.db = NexusDB(dirname, **kwargs)
+        self._executor = executor
+
+    @property
+    def records(self):
+        return self.db.records
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def load(self, workers=None):
+        """Load the database, like NexusDB.readAll().
+
+        With `workers` the device files are parsed concurrently in that
+        many processes, otherwise in one executor thread.
+        """
+        await self._run(self.db.readAll, workers=workers)
+
+    async def refresh(self):
+        return await self._run(self.db.refresh)
+
+    async def get(self, recordId, key=None):
+        if self.db.records:
+            return self.db.get(recordId, key)
+        # Before the database is loaded get() reads the record from the files.
+        return await self._run(self.db.get, recordId, key)
+
+    async def query(self, where=(), **kwargs):
+        """Run NexusDB.query() in the executor and return the results as a list."""
+        return await self._run(lambda: list(self.db.query(where, **kwargs)))
+
+    async def asOf(self, ts):
+        return await self._run(self.db.asOf, ts)
+
+    async def set(self, recordId, data):
+        await self._run(self.db.set, recordId, data)
+
+    async def inc(self, recordId, data):
+        await self._run(self.db.inc, recordId, data)
+
+    async def dec(self, recordId, data):
+        await self._run(self.db.dec, recordId, data)
+
+    async def delete(self, recordId, data=None):
+        await self._run(self.db.delete, recordId, data)
+
+    def batch(self, durability=Durability.BATCH, bufferSize=1 << 20):
+        """Open a write session, used as `async with db.batch() as b:`."""
+        return AsyncWriteBatch(self, self.db.batch(durability, bufferSize))
+
+    async def changes(self, interval=1.0):
+        """Yield the set of changed record IDs each time the files change.
+
+        Wraps NexusDB.watch(), whose thread hands each change to the loop.
+        Stopping the watch waits for that thread, so it is done in the
+        executor.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        handle = self.db.watch(
+            lambda changed: loop.call_soon_threadsafe(queue.put_nowait, changed),
+            interval,
+        )
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            await self._run(handle.stop)
+
+
+class AsyncWriteBatch:
+    """A WriteBatch used from the loop.
+
+    Unless every op is fsynced, ops are encoded into the batch's buffer on
+    the loop. That is quick, but once the buffer is full (about every
+    `bufferSize` bytes) the write to the file happens on the loop too.
+    Opening, committing and closing the batch run in the executor.
+    """
+
+    def __init__(self, adb, batch):
+        self._adb = adb
+        self._batch = batch
+
+    async def __aenter__(self):
+        await self._adb._run(self._batch.__enter__)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _write(self, fn, *args):
+        # Going through the executor for each op costs more than the
+        # occasional write of a full buffer on the loop.
+        if self._batch.durability is Durability.OP:
+            await self._adb._run(fn, *args)
+        else:
+            fn(*args)
+
+    async def set(self, recordId, data):
+        await self._write(self._batch.set, recordId, data)
+
+    async def inc(self, recordId, data):
+        await self._write(self._batch.inc, recordId, data)
+
+    async def dec(self, recordId, data):
+        await self._write(self._batch.dec, recordId, data)
+
+    async def delete(self, recordId, data=None):
+        await self._write(self._batch.delete, recordId, data)
+
+    async def commit(self):
+        await self._adb._run(self._batch.commit)
+
+    async def close(self):
+        await self._adb._run(self._batch.close)
@@ -0,0 +1,190 @@
+"""Per-device Bloom filters of record IDs, kept in `<local device>.<device>.bloom`
+sidecars.
+
+A device's filter holds the ID of every record its text file and sealed
+segments have ops for. It can tell for certain that a device never
+touched a record, so point lookups skip those devices without reading
+their files.
+
+A filter is brought up to date from the offset it covered last time. It
+is rebuilt when the text file was rewritten (compacted or sealed), its
+segments changed, or it holds more IDs than it was sized for. Every
+device reading the folder keeps filters of its own, named after it, so
+a synced folder never has two devices writing the same sidecar.
+
+Sidecar Layout:
+<JSON header line>
+<filter bits>
+"""
+import json
+import math
+import os
+import re
+from hashlib import blake2b
+
+from . import segment
+from .checkpoint import fingerprint, matchesFingerprint
+from .utils import atomicWrite
+
+
+VERSION = 1
+SUFFIX = ".bloom"
+FALSE_POSITIVE_RATE = 0.01
+MIN_CAPACITY = 1024
+
+
+# The record ID of every op line, as parser.B_OP_LINE matches them.
+B_OP_ID = re.compile(rb'^[NUIDX] \d+ ([a-zA-Z0-9\.\-_]+)(?=[\t \r\n])', re.M)
+
+
+class BloomFilter:
+    """A Bloom filter of byte strings sized for `capacity` of them."""
+
+    def __init__(self, capacity, bits=None, hashes=None, data=None):
+        self.capacity = capacity
+        if bits is None:
+            bits = math.ceil(-capacity * math.log(FALSE_POSITIVE_RATE) / math.log(2) ** 2)
+            bits = (bits + 7) & ~7
+        if hashes is None:
+            hashes = max(1, round(bits / capacity * math.log(2)))
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(bits // 8) if data is None else data
+
+    def _positions(self, key):
+        # Double hashing: two 64 bit hashes from one digest give every position.
+        digest = blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def update(self, keys):
+        """Add `keys`, returning how many of them were not in the filter yet."""
+        data = self.data
+        positions = self._positions
+        added = 0
+        for key in keys:
+            new = False
+            for pos in positions(key):
+                byte = data[pos >> 3]
+                mask = 1 << (pos & 7)
+                if not byte & mask:
+                    data[pos >> 3] = byte | mask
+                    new = True
+            added += new
+        return added
+
+    def __contains__(self, key):
+        data = self.data
+        return all(data[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+def sidecarPath(filename, localDevice):
+    dirname, name = os.path.split(filename)
+    return os.path.join(dirname, f"{localDevice}.{name[:-len('.nexus')]}{SUFFIX}")
+
+
+class DeviceFilter:
+    """The Bloom filter of one device file and its sealed segments."""
+
+    def __init__(self, filename, localDevice, capacity=MIN_CAPACITY):
+        self.filename = filename
+        self.path = sidecarPath(filename, localDevice)
+        self.filter = BloomFilter(capacity)
+        self.count = 0
+        self.file = None
+        self.segments = []
+
+    @classmethod
+    def load(cls, filename, localDevice):
+        """Load `localDevice`'s sidecar of `filename`, or an empty filter if it
+        can't be read."""
+        device = cls(filename, localDevice)
+        try:
+            with open(device.path, "rb") as f:
+                header = json.loads(f.readline())
+                data = bytearray(f.read())
+        except (OSError, ValueError):
+            return device
+        if header.get("version") != VERSION or len(data) * 8 != header["bits"]:
+            return device
+        device.filter = BloomFilter(header["capacity"], header["bits"], header["hashes"], data)
+        device.count = header["count"]
+        device.file = header["file"]
+        device.segments = header["segments"]
+        return device
+
+    def save(self):
+        header = {
+            "version": VERSION,
+            "capacity": self.filter.capacity,
+            "bits": self.filter.bits,
+            "hashes": self.filter.hashes,
+            "count": self.count,
+            "file": self.file,
+            "segments": self.segments,
+        }
+        with atomicWrite(self.path, cache=True) as f:
+            f.write(json.dumps(header, separators=(",", ":")).encode("utf8") + b"\n")
+            f.write(self.filter.data)
+
+    def mayContain(self, recordId):
+        return recordId.encode("utf8") in self.filter
+
+    def update(self):
+        """Add the IDs of ops appended since the last update.
+
+        Returns True if the filter changed.
+        """
+        segmentPaths = segment.segmentPaths(self.filename)
+        segments = [os.path.basename(path) for path in segmentPaths]
+        exists = os.path.exists(self.filename)
+        if self.file is None:
+            rebuild = exists
+        else:
+            rebuild = not (exists and matchesFingerprint(self.filename, self.file))
+        if rebuild or segments != self.segments:
+            self._rebuild(segmentPaths, segments)
+            return True
+        if not exists:
+            return False
+        offset = self.file["offset"]
+        if os.path.getsize(self.filename) <= offset:
+            return False
+        ids, end = _readIds(self.filename, offset)
+        self.count += self.filter.update(ids)
+        self.file = fingerprint(self.filename, end)
+        if self.count > self.filter.capacity:
+            self._rebuild(segmentPaths, segments)
+        return True
+
+    def _rebuild(self, segmentPaths, segments):
+        ids = set()
+        for path in segmentPaths:
+            with segment.Segment(path) as seg:
+                ids.update(recordId.encode("utf8") for recordId in seg.ids)
+        end = 0
+        if os.path.exists(self.filename):
+            fileIds, end = _readIds(self.filename, 0)
+            ids.update(fileIds)
+        # Leave room to grow so appends don't force a rebuild right away.
+        self.filter = BloomFilter(max(MIN_CAPACITY, 2 * len(ids)))
+        self.filter.update(ids)
+        self.count = len(ids)
+        self.file = fingerprint(self.filename, end) if os.path.exists(self.filename) else None
+        self.segments = segments
+
+
+def _readIds(filename, offset):
+    """The record IDs of the op lines after `offset`, as bytes.
+
+    Like the offset indexes, this includes a last line without a newline.
+    """
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        buf = f.read()
+    end = len(buf)
+    if buf and not buf.endswith(b"\n"):
+        buf += b"\n"
+    return set(B_OP_ID.findall(buf)), offset + end
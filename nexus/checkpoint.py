@@ -0,0 +1,103 @@
+import json
+import os
+
+from .file import Record
+from .utils import atomicWrite
+
+
+VERSION = 1
+FINGERPRINT_SIZE = 4096
+
+
+class Checkpoint:
+    """Materialized records as of a byte offset in every device file.
+
+    `ts` is the timestamp of the last op applied. Ops appended after the
+    checkpoint can only be replayed on top of it when they are newer than
+    that, otherwise the merge order would differ from a full replay.
+    """
+
+    def __init__(self, records, offsets, ts):
+        self.records = records
+        self.offsets = offsets
+        self.ts = ts
+
+
+def fingerprint(path, offset):
+    """Hash the start of a file and the bytes leading up to `offset`."""
+    import hashlib
+
+    with open(path, "rb") as f:
+        head = f.read(min(offset, FINGERPRINT_SIZE))
+        tailStart = max(0, offset - FINGERPRINT_SIZE)
+        f.seek(tailStart)
+        tail = f.read(offset - tailStart)
+    return {
+        "offset": offset,
+        "head": hashlib.sha1(head).hexdigest(),
+        "tail": hashlib.sha1(tail).hexdigest(),
+        "newline": tail.endswith(b"\n"),
+    }
+
+
+def matchesFingerprint(path, fp):
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return False
+    offset = fp["offset"]
+    if size < offset:
+        return False
+    if size > offset and offset and not fp["newline"]:
+        # The last line read was incomplete and has since been finished.
+        return False
+    current = fingerprint(path, offset)
+    return current["head"] == fp["head"] and current["tail"] == fp["tail"]
+
+
+def save(path, records, offsets, ts, segments=()):
+    data = {
+        "version": VERSION,
+        "ts": ts,
+        "segments": list(segments),
+        "files": {
+            os.path.basename(filename): fingerprint(filename, offset)
+            for filename, offset in offsets.items()
+        },
+        "records": records,
+    }
+    with atomicWrite(path, "w", encoding="utf8", cache=True) as f:
+        # `default` turns a RecordStore and its records into dicts as it goes.
+        json.dump(data, f, separators=(",", ":"), default=dict)
+
+
+def load(path, filenames, segments=()):
+    """Load the checkpoint at `path` if it is still valid for `filenames`.
+
+    Returns None when there is no checkpoint, it is from another format
+    version, any device file it covers is missing or was rewritten, or
+    the sealed segment names differ from `segments`.
+    """
+    try:
+        with open(path, "r", encoding="utf8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != VERSION:
+        return None
+    if data.get("segments", []) != list(segments):
+        return None
+
+    byName = {os.path.basename(filename): filename for filename in filenames}
+    offsets = {}
+    for name, fp in data["files"].items():
+        filename = byName.get(name)
+        if filename is None or not matchesFingerprint(filename, fp):
+            return None
+        offsets[filename] = fp["offset"]
+
+    records = {}
+    for recordId, values in data["records"].items():
+        rec = records[recordId] = Record(values)
+        rec.id = recordId
+    return Checkpoint(records, offsets, data["ts"])
@@ -1,92 +1,1114 @@
 from __future__ import annotations
-from nexus.file import NexusFile, Record, EndOfRecords
+from nexus.file import NexusFile, Record, EndOfRecords, Durability, replaceFile, encodeLine
+from nexus.utils import deviceId, timestamp
+from nexus import checkpoint, parser, segment
+from nexus.stats import Stats, countOps
+from nexus.idindex import IdIndex
 
 
-from typing import Iterable
 from enum import Enum
+import heapq
+import itertools
 import os
-import uuid
+import threading
+import time
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Callable, Iterable, Optional
 
 
 class NexusDB:
     dirname: str
+    parallelChunkSize: int = 32 << 20
 
-    def __init__(self, dirname: str) -> None:
+    def __init__(
+        self,
+        dirname: str,
+        checkpointEvery: int = 10_000,
+        snapshotEvery: Optional[int] = 100_000,
+        snapshotInterval: Optional[float] = None,
+        compactRecords: bool = False,
+        statsHook: Optional[Callable[[str, dict], None]] = None,
+    ) -> None:
         if not os.path.exists(dirname):
             os.mkdir(dirname)
         self.dirname = dirname
-        self._device = str(uuid.uuid1(uuid.getnode(), 0))[24:]    
+        self._device = deviceId()
 
         self._write_file_path = os.path.join(dirname, f"{self._device}.nexus")
-        self._read_file_paths = [
-            os.path.join(dirname, f"{filename}")
-            for filename in os.listdir(dirname)
-        ]
-        if self._write_file_path not in self._read_file_paths:
-            self._read_file_paths.insert(0, self._write_file_path)
+        self._read_file_paths = []
+        self._scanReadFiles()
+
+        self._checkpoint_path = os.path.join(dirname, f"{self._device}.checkpoint")
+        self.checkpointEvery = checkpointEvery
+        self.snapshotEvery = snapshotEvery
+        self.snapshotInterval = snapshotInterval
+        self.compactRecords = compactRecords
+        self.statsHook = statsHook
+        self._counters = Stats()
 
         self.records = {}
+        self._offsets = {}
+        self._lastTs = 0
+        self._replayed = 0
+        self._stats = {}
+        self._lock = threading.RLock()
+        self._subscribers = []
+        self._watcher = None
+        self._fileStates = {}
+        self._segments = {}
+        self._filters = {}
+        self._offsetIndexes = {}
+        self._timeIndexes = {}
+        self._ids = IdIndex()
+    
+    def _scanReadFiles(self):
+        paths = set(self._read_file_paths)
+        paths.add(self._write_file_path)
+        paths.update(
+            os.path.join(self.dirname, filename)
+            for filename in os.listdir(self.dirname)
+            if filename.endswith(".nexus")
+        )
+        self._read_file_paths = sorted(paths)
     
     def _openReadFiles(self):
-        return [NexusFile(path, "r") for path in self._read_file_paths]
+        files = [NexusFile(path, "r") for path in self._read_file_paths]
+        self._stats = {path: _statFile(path) for path in self._read_file_paths}
+        self._segments = self._scanSegments()
+        return files
+
+    def _scanSegments(self):
+        segments = {}
+        for path in self._read_file_paths:
+            paths = segment.segmentPaths(path)
+            if paths:
+                segments[path] = paths
+        return segments
+
+    def _iterDeviceOps(self, nf, withSegments=True):
+        """Ops of one device: its sealed segments, then its text file."""
+        if withSegments:
+            for path in self._segments.get(nf._filename, ()):
+                with segment.Segment(path) as seg:
+                    yield from seg.iterOps()
+        yield from nf.iterOps()
+
+    def readAll(self, workers=None):
+        """Build `records` from the last checkpoint plus any ops appended since.
+
+        Falls back to a full replay when there is no usable checkpoint, and
+        saves a new one once `checkpointEvery` ops had to be replayed.
+        With `workers` the device files are parsed by a pool of that many
+        processes (0 for one per CPU) and merged here, with the same result
+        as a serial replay.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            if workers is None:
+                self._readAll()
+            else:
+                from nexus import parallel
+
+                with parallel.createExecutor(workers) as executor:
+                    self._readAll(executor)
+            self._counters.loads += 1
+            self._counters.loadTime += time.perf_counter() - start
+            self._counters.recordsMaterialized = len(self.records)
+        self._emitStats("load")
 
-    def readAll(self):
-        ts = 0
+    def stats(self):
+        """Return the counters and timers kept since the database was opened.
+
+        See nexus.stats for what each one measures.
+        """
+        return self._counters.asDict()
+
+    def _emitStats(self, event):
+        if self.statsHook is not None:
+            self.statsHook(event, self.stats())
+
+    def _readAll(self, executor=None):
         files = self._openReadFiles()
-        nextOps = [(nf, nf.parseNextRecord()) for nf in files]
-        while not all(op[1] is None for op in nextOps):
-            # Find the next timestamp, read that line, advance that file
-            nextOps.sort(key=lambda op: op[1][1] if op[1] else float('inf'))
-            lowestIdx = 0
-            # Process operation
-            nf = nextOps[lowestIdx][0]
-            op, ts, recordId, data = nextOps[lowestIdx][1]
-            nf.applyOperation(op, self.records, recordId, data)
-            # Advance the entry in nextOps
+        try:
+            start = None
+            if self.checkpointEvery is not None:
+                start = checkpoint.load(
+                    self._checkpoint_path,
+                    self._read_file_paths,
+                    self._segmentNames(),
+                )
+            if not self._replay(files, start, executor):
+                self._replay(files, None, executor)
+        except parser.ParserError:
+            self._counters.parseErrors += 1
+            raise
+        finally:
+            for nf in files:
+                nf.close()
+        if self.checkpointEvery is not None and self._replayed >= self.checkpointEvery:
+            self.saveCheckpoint()
+
+    def _replay(self, files, start, executor=None):
+        if start is None:
+            self.records = self._newRecords()
+            self._lastTs = 0
+        else:
+            self.records = self._newRecords(start.records)
+            self._lastTs = start.ts
+        offsets = {}
+        for nf in files:
+            if start is None:
+                offsets[nf._filename] = segment.sealedOffset(nf._filename, self._segments.get(nf._filename))
+            else:
+                offsets[nf._filename] = start.offsets.get(nf._filename, 0)
+            nf.seek(offsets[nf._filename])
+
+        count = 0
+        if executor is not None:
+            from nexus import parallel
+
+            segments = self._segments if start is None else {}
+            streams = parallel.openStreams(executor, files, segments, self.parallelChunkSize)
+        else:
+            streams = [self._iterDeviceOps(nf, start is None) for nf in files]
+        counters = self._counters
+        streams = [countOps(counters, nf._filename, stream) for nf, stream in zip(files, streams)]
+        parseTime = counters.parseTime
+        clock = time.perf_counter
+        applyTime = 0.0
+        began = clock()
+        try:
+            for op, ts, recordId, data in mergeOps(streams):
+                if start is not None and count == 0 and ts <= start.ts:
+                    # An op older than the checkpoint was synced in late, so it
+                    # can't be applied on top of it in timestamp order.
+                    return False
+                applied = clock()
+                self.applyOperation(op, ts, recordId, data)
+                applyTime += clock() - applied
+                self._lastTs = ts
+                count += 1
+        finally:
+            for stream in streams:
+                stream.close()
+            counters.applyTime += applyTime
+            counters.mergeTime += clock() - began - applyTime - (counters.parseTime - parseTime)
+            for nf in files:
+                counters.addBytes(nf._filename, nf.offset - offsets[nf._filename])
+                if start is None:
+                    for path in self._segments.get(nf._filename, ()):
+                        counters.addBytes(path, os.path.getsize(path))
+
+        self._offsets = {nf._filename: nf.offset for nf in files}
+        self._replayed = count
+        return True
+
+    def refresh(self):
+        """Apply ops appended to the device files since they were last read.
+
+        Picks up device files that appeared in the directory since, and
+        only opens files whose size or modification time changed. Returns
+        the set of changed record IDs and passes it to every subscriber.
+        """
+        with self._lock:
             try:
-                nextOps[lowestIdx] = (nf, nf.parseNextRecord())
-            except EndOfRecords:
-                nextOps[lowestIdx] = (nf, None)
+                changed = self._refresh()
+            except parser.ParserError:
+                self._counters.parseErrors += 1
+                raise
+            self._counters.refreshes += 1
+            self._counters.recordsMaterialized = len(self.records)
+        self._emitStats("refresh")
+        if changed:
+            for callback in list(self._subscribers):
+                callback(changed)
+        return changed
 
-    def getRecordIds(self):
-        id_set = set()
-        for nf in self._openReadFiles():
+    def _refresh(self):
+        self._scanReadFiles()
+        paths = [
+            path for path in self._read_file_paths
+            if _statFile(path) != self._stats.get(path)
+        ]
+        if not paths:
+            return set()
+        if self._scanSegments() != self._segments:
+            return self._reload()
+        for path in paths:
+            if not self._canResume(path):
+                return self._reload()
+
+        files = []
+        try:
+            for path in paths:
+                self._stats[path] = _statFile(path)
+                nf = NexusFile(path, "r")
+                nf.seek(self._offsets.get(path, 0))
+                files.append(nf)
+
+            changed = set()
+            streams = [
+                countOps(self._counters, nf._filename, nf.iterOps(partial=False))
+                for nf in files
+            ]
+            for op, ts, recordId, data in mergeOps(streams):
+                if not changed and self._offsets and ts <= self._lastTs:
+                    # Synced in out of order, so replay everything in order.
+                    return self._reload()
+                self.applyOperation(op, ts, recordId, data)
+                self._lastTs = ts
+                changed.add(recordId)
+            for nf in files:
+                self._counters.addBytes(nf._filename, nf.offset - self._offsets.get(nf._filename, 0))
+                self._offsets[nf._filename] = nf.offset
+            return changed
+        finally:
+            for nf in files:
+                nf.close()
+
+    def _canResume(self, path):
+        return _canResume(path, self._offsets.get(path, 0), self._stats.get(path))
+
+    def _reload(self):
+        old = self.records
+        self._readAll()
+        return {
+            recordId
+            for recordId in old.keys() | self.records.keys()
+            if old.get(recordId) != self.records.get(recordId)
+        }
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def watch(self, callback, interval=1.0):
+        """Call `callback(changedIds)` whenever another process appends ops.
+
+        A background thread calls refresh() when inotify reports a change
+        in the directory, where available, and at least every `interval`
+        seconds otherwise. Callbacks run on that thread. Call stop() on
+        the returned watcher to unsubscribe.
+        """
+        from nexus.watch import Watcher
+
+        self.subscribe(callback)
+        if self._watcher is None or not self._watcher.is_alive():
+            self._watcher = Watcher(self, interval)
+            self._watcher.start()
+        return WatchHandle(self, callback)
+
+    def _segmentNames(self):
+        return sorted(
+            os.path.basename(path)
+            for paths in self._segments.values()
+            for path in paths
+        )
+
+    def saveCheckpoint(self):
+        checkpoint.save(
+            self._checkpoint_path,
+            self.records,
+            self._offsets,
+            self._lastTs,
+            self._segmentNames(),
+        )
+
+    def _snapshotPaths(self):
+        """This device's point-in-time snapshots as `(ts, path)`, oldest first."""
+        snapshots = []
+        for filename in os.listdir(self.dirname):
+            parts = filename.split(".")
+            if len(parts) == 3 and parts[0] == self._device and parts[2] == "snapshot" and parts[1].isdigit():
+                snapshots.append((int(parts[1]), os.path.join(self.dirname, filename)))
+        return sorted(snapshots)
+
+    def asOf(self, ts):
+        """Return the records as they were after every op up to `ts`.
+
+        Replays from the nearest earlier snapshot, falling back to older
+        ones (and finally to a full replay) when a snapshot no longer
+        matches the device files or ops older than it were synced in
+        since. Snapshots are saved along the way every `snapshotEvery` ops
+        and every `snapshotInterval` seconds of log time, so later reads
+        around the same time only replay the gap.
+        """
+        with self._lock:
+            self._scanReadFiles()
+            segments = self._scanSegments()
+            segmentNames = sorted(
+                os.path.basename(path) for paths in segments.values() for path in paths
+            )
+            for snapshotTs, path in reversed(self._snapshotPaths()):
+                if snapshotTs > ts:
+                    continue
+                start = checkpoint.load(path, self._read_file_paths, segmentNames)
+                if start is not None:
+                    records = self._replayUntil(ts, start, segments, segmentNames)
+                    if records is not None:
+                        return records
+                os.remove(path)
+            return self._replayUntil(ts, None, segments, segmentNames)
+
+    def _replayUntil(self, until, start, segments, segmentNames):
+        files = [NexusFile(path, "r") for path in self._read_file_paths]
+        try:
+            streams = []
+            lastSegmentTs = 0
+            for nf in files:
+                if start is None:
+                    nf.seek(segment.sealedOffset(nf._filename, segments.get(nf._filename)))
+                else:
+                    nf.seek(start.offsets.get(nf._filename, 0))
+                paths = segments.get(nf._filename, ()) if start is None else ()
+                for path in paths:
+                    with segment.Segment(path) as seg:
+                        for _, opTs, _ in seg.iterIndex():
+                            lastSegmentTs = max(lastSegmentTs, opTs)
+                streams.append(_iterWithOffsets(nf, self._iterFileOps(nf, paths)))
+
+            records = start.records if start else {}
+            lastSnapshot = start.ts if start else None
+            offsets = dict(start.offsets) if start else {}
+            count = 0
+            interval = None if self.snapshotInterval is None else int(self.snapshotInterval * 1_000_000_000)
+            for op, ts, recordId, data, filename, offset in mergeOps(streams):
+                if start is not None and count == 0 and ts <= start.ts:
+                    return None
+                if ts > until:
+                    break
+                NexusFile.applyOperation(op, records, recordId, data)
+                if offset is not None:
+                    offsets[filename] = offset
+                count += 1
+                if lastSnapshot is None:
+                    lastSnapshot = ts
+                if ts <= lastSegmentTs or ts == lastSnapshot:
+                    # Snapshots hold text file offsets, which can't say how
+                    # far into a device's segments the replay got.
+                    continue
+                if (
+                    (self.snapshotEvery is not None and count % self.snapshotEvery == 0)
+                    or (interval is not None and ts - lastSnapshot >= interval)
+                ):
+                    path = os.path.join(self.dirname, f"{self._device}.{ts}.snapshot")
+                    checkpoint.save(path, records, offsets, ts, segmentNames)
+                    lastSnapshot = ts
+            return records
+        finally:
+            for nf in files:
+                nf.close()
+
+    def seal(self, before=None):
+        """Move this device's history into a new binary sealed segment.
+
+        Ops with a timestamp before `before`, or every complete op when it
+        is None, are written to `<device>.<n>.nxseg` and this device's text
+        file is replaced with one holding only the remaining lines. Until
+        it is, readers skip the sealed lines, and if this is interrupted
+        the next seal() or compact() finishes it. Other writers on this
+        machine must not append to the file meanwhile. Returns the segment
+        path, or None if there was nothing to seal.
+        """
+        with self._lock:
+            self._finishRewrites()
+            sealed, _, kept, end = self._splitWriteFile(before)
+            if not sealed:
+                return None
+            path = segment.nextSegmentPath(self._write_file_path)
+            segment.writeSegment(path, sealed, checkpoint.fingerprint(self._write_file_path, end))
+            replaceFile(self._write_file_path, self._device, kept)
+            return path
+
+    def _finishRewrites(self):
+        """Finish an interrupted seal() or compact() of this device's file.
+
+        Segments already compacted into the text file are removed, and
+        lines already written to a segment are dropped from it.
+        """
+        for path in segment.compactedPaths(self._write_file_path):
+            os.remove(path)
+        offset = segment.sealedOffset(self._write_file_path)
+        if offset:
+            with open(self._write_file_path, "rb") as f:
+                f.seek(offset)
+                lines = f.readlines()
+            replaceFile(self._write_file_path, self._device, lines)
+
+    def compact(self, before=None, archive=False):
+        """Rewrite this device's history as the fewest ops with the same effect.
+
+        This device's sealed segments and the ops in its text file before
+        `before` (all complete ops when None) are reduced by compactOps()
+        and the text file is atomically replaced with the result followed
+        by the remaining lines, after which the segments are removed. The
+        new file names the last segment it holds, so readers ignore the
+        segments if removing them is interrupted. The ops of records that
+        another device has ops for between the first and last of this
+        device's are kept as they are, as compacting them would reorder
+        them around the other device's. With `archive` the original ops
+        are first saved as text to `<device>.<ts>.archive`. Other writers
+        on this machine must not append to the file meanwhile. Returns the
+        number of ops before and after compaction.
+        """
+        with self._lock:
+            self._finishRewrites()
+            segments = segment.segmentPaths(self._write_file_path)
+            ops = []
+            for path in segments:
+                with segment.Segment(path) as seg:
+                    ops.extend(seg.iterOps())
+            fromSegments = len(ops)
+            textOps, textLines, kept, _ = self._splitWriteFile(before)
+            ops.extend(textOps)
+            if not ops:
+                return 0, 0
+
+            if archive:
+                archivePath = os.path.join(self.dirname, f"{self._device}.{timestamp()}.archive")
+                lines = [encodeLine(*op) for op in ops[:fromSegments]] + textLines
+                replaceFile(archivePath, self._device, lines)
+
+            shared = self._sharedRecords(ops)
+            compacted = compactOps(op for op in ops if op[2] not in shared)
+            if shared:
+                compacted.extend(op for op in ops if op[2] in shared)
+                compacted.sort(key=lambda op: op[1])
+            lines = [encodeLine(*op) for op in compacted] + kept
+            lastSequence = segment.lastSequence(self._write_file_path)
+            if lastSequence:
+                lines.insert(0, f"* compacted={lastSequence}\n")
+            replaceFile(self._write_file_path, self._device, lines)
+            for path in segments:
+                os.remove(path)
+            return len(ops), len(compacted)
+
+    def _sharedRecords(self, ops):
+        """IDs of the records in this device's `ops` that another device has
+        ops for between the first and last of them."""
+        spans = {}
+        for _, ts, recordId, _ in ops:
+            span = spans.get(recordId)
+            spans[recordId] = (ts, ts) if span is None else (span[0], ts)
+        shared = set()
+        self._scanReadFiles()
+        for path, deviceFilter in self._deviceFilters().items():
+            if path == self._write_file_path:
+                continue
+            ids = [recordId for recordId in spans if deviceFilter.mayContain(recordId)]
+            if not ids:
+                continue
+            for recordId, recordOps in self._offsetIndex(path).readOpsMany(ids).items():
+                first, last = spans[recordId]
+                if any(first <= ts <= last for _, ts, _, _ in recordOps):
+                    shared.add(recordId)
+        return shared
+
+    def _splitWriteFile(self, before):
+        """Split this device's text file at the first op not before `before`.
+
+        Returns the parsed ops and raw lines before it, the raw lines from
+        it on, and the offset of the split. A final line without a newline
+        is always kept.
+        """
+        ops = []
+        lines = []
+        kept = []
+        end = 0
+        if not os.path.exists(self._write_file_path):
+            return ops, lines, kept, end
+        with open(self._write_file_path, "rb") as f:
+            for line in f:
+                if line.isspace() or line.startswith(b"*"):
+                    pass
+                elif kept or not line.endswith(b"\n"):
+                    kept.append(line)
+                else:
+                    item = parser.parseOpLine(line.decode("utf8"))
+                    if before is None or item[1] < before:
+                        ops.append(item)
+                        lines.append(line)
+                    else:
+                        kept.append(line)
+                if not kept and line.endswith(b"\n"):
+                    end += len(line)
+        return ops, lines, kept, end
+
+    def _newRecords(self, records=None):
+        if self.compactRecords:
+            from nexus.store import RecordStore
+
+            return RecordStore(records)
+        return records if records is not None else {}
+
+    def applyOperation(self, op, ts, recordId, data):
+        records = self.records
+        if recordId not in records or (op == 'X' and not data):
+            self._ids.changed(records, recordId)
+        if self.compactRecords:
+            records.apply(op, recordId, data)
+        else:
+            NexusFile.applyOperation(op, records, recordId, data)
+
+    def _fileRecords(self, path):
+        """Records of a single device file, reparsed only when it changes."""
+        state = self._fileStates.get(path)
+        current = _statFile(path)
+        segments = segment.segmentPaths(path)
+        if state is not None and state[3] != segments:
+            state = None
+        if state is not None and state[0] == current:
+            return state[2]
+
+        nf = NexusFile(path, "r")
+        try:
+            current = _statFile(path)
+            if state is not None and _canResume(path, state[1], state[0]):
+                nf.records = state[2]
+                nf.seek(state[1])
+            else:
+                for segmentPath in segments:
+                    with segment.Segment(segmentPath) as seg:
+                        for op, ts, recordId, data in seg.iterOps():
+                            nf.applyOperation(op, nf.records, recordId, data)
+                nf.seek(segment.sealedOffset(path, segments))
             nf.readAll()
-            id_set.update(nf.records.keys())
-        return id_set
+        finally:
+            nf.close()
+        self._fileStates[path] = (current, nf.offset, nf.records, segments)
+        return nf.records
+
+    def getRecordIds(self):
+        with self._lock:
+            self._scanReadFiles()
+            id_set = set()
+            for path in self._read_file_paths:
+                id_set.update(self._fileRecords(path).keys())
+            return id_set
     
+    def _deviceFilters(self):
+        """The Bloom filter of each device file, brought up to date."""
+        from nexus import bloom
+
+        filters = {}
+        for path in self._read_file_paths:
+            deviceFilter = self._filters.get(path)
+            if deviceFilter is None:
+                deviceFilter = self._filters[path] = bloom.DeviceFilter.load(path, self._device)
+            if deviceFilter.update():
+                deviceFilter.save()
+            filters[path] = deviceFilter
+        return filters
+
+    def estimateRecordCount(self):
+        """About how many records the database has, without reading it.
+
+        This is the most records any device has ops for, by the devices'
+        Bloom filters, so it is low when devices wrote different records.
+        """
+        with self._lock:
+            self._scanReadFiles()
+            return max((deviceFilter.count for deviceFilter in self._deviceFilters().values()), default=0)
+
+    def _filesWith(self, recordId):
+        """Device files that may have ops of `recordId`, by their Bloom filters."""
+        return [path for path, deviceFilter in self._deviceFilters().items() if deviceFilter.mayContain(recordId)]
+
     def findAllOfRecordsEntries(self, recordId):
-        entries = []
-        for nf in self._openReadFiles():
-            nf.readAll()
-            record = nf.records.get(recordId)
-            if record is not None:
-                entries.append(record)
-        return entries
+        with self._lock:
+            self._scanReadFiles()
+            entries = []
+            for path in self._filesWith(recordId):
+                record = self._fileRecords(path).get(recordId)
+                if record is not None:
+                    entries.append(record)
+            return entries
+
+    def _timeIndex(self, path):
+        from nexus import timeindex
+
+        index = self._timeIndexes.get(path)
+        if index is None:
+            index = self._timeIndexes[path] = timeindex.TimeIndex.load(path, self._device)
+        if index.update():
+            index.save()
+        return index
+
+    def iterOps(self, since=None, until=None):
+        """Yield every `(op, ts, recordId, data)` op in the database, merged
+        in timestamp order, straight from the device files and segments.
+
+        Only ops newer than `since` and not newer than `until` are yielded.
+        Each device's timestamp index finds where in its file to start, and
+        reading it stops after `until`. Files are read as the generator
+        advances, so memory use does not grow with the database.
+        """
+        with self._lock:
+            self._scanReadFiles()
+            paths = list(self._read_file_paths)
+            indexes = {}
+            if since is not None or until is not None:
+                indexes = {path: self._timeIndex(path) for path in paths}
+        files = [NexusFile(path, "r") for path in paths]
+        try:
+            streams = []
+            for nf in files:
+                segmentPaths = segment.segmentPaths(nf._filename)
+                start = segment.sealedOffset(nf._filename, segmentPaths)
+                index = indexes.get(nf._filename)
+                if index is not None:
+                    segmentPaths = [path for path in segmentPaths if index.segmentInRange(path, since, until)]
+                    if since is not None:
+                        start = max(start, index.startOffset(since))
+                nf.seek(start)
+                stream = self._iterFileOps(nf, segmentPaths)
+                if until is not None:
+                    stream = itertools.takewhile(lambda item: item[1] <= until, stream)
+                streams.append(stream)
+            for item in mergeOps(streams):
+                if since is None or item[1] > since:
+                    yield item
+        finally:
+            for nf in files:
+                nf.close()
+
+    @staticmethod
+    def _iterFileOps(nf, segmentPaths):
+        for path in segmentPaths:
+            with segment.Segment(path) as seg:
+                yield from seg.iterOps()
+        yield from nf.iterOps()
+
+    def iterRecords(self, prefix=None, keys=None):
+        """Yield the records whose ID starts with `prefix`, with only `keys`.
+
+        Once readAll() loaded the database the loaded records are yielded
+        as they are. Otherwise the device files are replayed keeping only
+        the matching records and keys, so memory is bounded by what was
+        asked for rather than by the size of the database.
+        """
+        if keys is not None:
+            keys = list(keys)
+        if self.records:
+            for recordId in self.iterIds(prefix or ""):
+                record = self.records.get(recordId)
+                if record is not None:
+                    yield _projectRecord(record, keys)
+            return
+
+        records = {}
+        keySet = None if keys is None else set(keys)
+        for op, ts, recordId, data in self.iterOps():
+            if prefix and not recordId.startswith(prefix):
+                continue
+            if keySet is not None and data:
+                if op == 'X':
+                    data = [key for key in data if key in keySet]
+                    if not data:
+                        continue
+                else:
+                    data = {key: value for key, value in data.items() if key in keySet}
+            NexusFile.applyOperation(op, records, recordId, data)
+        for recordId in sorted(records):
+            yield _projectRecord(records[recordId], keys)
+
+    def history(self, recordId, key=None):
+        """Return `(ts, value)` for every op that changed `key` of a record.
+
+        `value` is the key's value after the op, or None once it was
+        deleted. Without `key` it is a copy of the whole record instead.
+        Only the record's own ops are read, like in readRecord().
+        """
+        records = {}
+        changes = []
+        for op, ts, _, data in mergeOps(self._recordStreams([recordId])[recordId]):
+            NexusFile.applyOperation(op, records, recordId, data)
+            record = records.get(recordId)
+            if key is None:
+                changes.append((ts, None if record is None else dict(record)))
+            elif (op == 'X' and not data) or key in data:
+                changes.append((ts, None if record is None else record.get(key)))
+        return changes
+
+    def query(self, where=(), prefix="", fields=None, orderBy=None, descending=False, limit=None):
+        """Yield the loaded records matching `where`, see nexus.query.
+
+        `where` is a query string or a list of query words.
+        """
+        from nexus.query import Query
+
+        query = Query(where, prefix, fields, orderBy, descending, limit)
+        return query.run(self.records, self.iterIds(prefix))
+
+    def iterIds(self, prefix="", startAfter=None):
+        """Iterate over the IDs of the loaded records starting with `prefix`,
+        in order.
+
+        With `startAfter`, only the IDs after it are yielded.
+        """
+        with self._lock:
+            return self._ids.iterIds(self.records, prefix, startAfter)
+
+    def scan(self, prefix="", startAfter=None, limit=None):
+        """Return `(recordId, record)` for the loaded records whose ID starts
+        with `prefix`, in ID order, up to `limit` of them.
+
+        The last ID of a page is the cursor for the next one: pass it as
+        `startAfter`. Pages stay consistent when records are added or
+        removed in between, and cost about the size of the page.
+        """
+        with self._lock:
+            ids = self._ids.iterIds(self.records, prefix, startAfter)
+            return [(recordId, self.records[recordId]) for recordId in itertools.islice(ids, limit)]
+
+    def _offsetIndex(self, path):
+        """The offset index of one device file, brought up to date."""
+        from nexus import offsets
+
+        index = self._offsetIndexes.get(path)
+        if index is None:
+            index = self._offsetIndexes[path] = offsets.OffsetIndex(path, self._device)
+        index.update()
+        return index
+
+    def _recordStreams(self, recordIds):
+        """The ops of each of `recordIds`, as one list per device that has any.
+
+        Devices are picked by their Bloom filters and the ops found through
+        their offset indexes, each brought up to date once.
+        """
+        recordIds = list(recordIds)
+        streams = {recordId: [] for recordId in recordIds}
+        with self._lock:
+            self._scanReadFiles()
+            for path, deviceFilter in self._deviceFilters().items():
+                ids = [recordId for recordId in recordIds if deviceFilter.mayContain(recordId)]
+                if ids:
+                    for recordId, ops in self._offsetIndex(path).readOpsMany(ids).items():
+                        streams[recordId].append(ops)
+        return streams
+
+    def readRecord(self, recordId):
+        """Read a single record from the files, without loading the database.
+
+        Only the devices whose Bloom filter may hold `recordId` are read,
+        and in those only the ops of the record, found through the
+        devices' offset indexes.
+        """
+        return self.readRecords([recordId]).get(recordId)
+
+    def readRecords(self, recordIds):
+        """Read several records like readRecord(), returned by ID.
+
+        Each device's indexes are brought up to date once for all of them.
+        Records that don't exist are left out.
+        """
+        records = {}
+        for recordId, recordStreams in self._recordStreams(recordIds).items():
+            for op, ts, _, data in mergeOps(recordStreams):
+                NexusFile.applyOperation(op, records, recordId, data)
+        return records
 
     def get(self, recordId, key=None):
-        record = self.records.get(recordId)
+        """Return a record, or one of its values.
+
+        Before the database is loaded the record is read on its own with
+        readRecord().
+        """
+        if self.records:
+            record = self.records.get(recordId)
+        else:
+            record = self.readRecord(recordId)
         if record and key:
             return record[key]
         else:
             return record
     
+    def _openWriteFile(self, **kwargs):
+        return NexusFile(self._write_file_path, device=self._device, **kwargs)
+
     def set(self, recordId, data):
-        nf = NexusFile(self._write_file_path)
+        start = time.perf_counter()
+        nf = self._openWriteFile()
         nf.set(recordId, data)
         nf.close()
+        self._countWrites(1, time.perf_counter() - start)
     
     def inc(self, recordId, data):
-        nf = NexusFile(self._write_file_path)
+        start = time.perf_counter()
+        nf = self._openWriteFile()
         nf.inc(recordId, data)
         nf.close()
+        self._countWrites(1, time.perf_counter() - start)
     
     def dec(self, recordId, data):
-        nf = NexusFile(self._write_file_path)
+        start = time.perf_counter()
+        nf = self._openWriteFile()
         nf.dec(recordId, data)
         nf.close()
+        self._countWrites(1, time.perf_counter() - start)
     
-    def delete(self, recordId, data):
-        nf = NexusFile(self._write_file_path)
+    def delete(self, recordId, data=None):
+        start = time.perf_counter()
+        nf = self._openWriteFile()
         nf.delete(recordId, data)
         nf.close()
+        self._countWrites(1, time.perf_counter() - start)
+
+    def setMany(self, items):
+        """Set many records in one write, see NexusFile.setMany()."""
+        start = time.perf_counter()
+        nf = self._openWriteFile()
+        count = nf.setMany(items)
+        nf.close()
+        self._countWrites(count, time.perf_counter() - start)
+        return count
+
+    def _countWrites(self, count, seconds):
+        self._counters.writes += count
+        self._counters.writeTime += seconds
+        self._emitStats("write")
+
+    def batch(self, durability=Durability.BATCH, bufferSize=1 << 20):
+        """Open a write session that keeps this device's file open.
+
+        Use as `with db.batch() as b: b.set(...)`. Encoded lines are
+        buffered and written in chunks of about `bufferSize` bytes. The
+        durability policy decides when they are fsynced: never
+        (Durability.NONE), once when the batch ends (Durability.BATCH) or
+        after every op (Durability.OP).
+        """
+        return WriteBatch(self, durability, bufferSize)
+
+
+class WriteBatch:
+    def __init__(self, db, durability, bufferSize):
+        self.db = db
+        self.durability = durability
+        self.bufferSize = bufferSize
+        self._file = None
+
+    def __enter__(self):
+        self._file = self.db._openWriteFile(
+            buffering=self.bufferSize,
+            durability=self.durability,
+        )
+        self._pending = 0
+        self._elapsed = 0.0
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def set(self, recordId, data):
+        start = time.perf_counter()
+        self._file.set(recordId, data)
+        self._elapsed += time.perf_counter() - start
+        self._pending += 1
+
+    def inc(self, recordId, data):
+        start = time.perf_counter()
+        self._file.inc(recordId, data)
+        self._elapsed += time.perf_counter() - start
+        self._pending += 1
+
+    def dec(self, recordId, data):
+        start = time.perf_counter()
+        self._file.dec(recordId, data)
+        self._elapsed += time.perf_counter() - start
+        self._pending += 1
+
+    def delete(self, recordId, data=None):
+        start = time.perf_counter()
+        self._file.delete(recordId, data)
+        self._elapsed += time.perf_counter() - start
+        self._pending += 1
+
+    def setMany(self, items):
+        start = time.perf_counter()
+        count = self._file.setMany(items)
+        self._elapsed += time.perf_counter() - start
+        self._pending += count
+        return count
+
+    def commit(self):
+        """Write out everything buffered so far, honoring the durability policy."""
+        start = time.perf_counter()
+        self._file.flush(sync=self.durability is not Durability.NONE)
+        self._countWrites(start)
+
+    def close(self):
+        if self._file is not None:
+            start = time.perf_counter()
+            self._file.close()
+            self._file = None
+            self._countWrites(start)
+
+    def _countWrites(self, start):
+        self._elapsed += time.perf_counter() - start
+        self.db._countWrites(self._pending, self._elapsed)
+        self._pending = 0
+        self._elapsed = 0.0
+
+
+class WatchHandle:
+    def __init__(self, db, callback):
+        self.db = db
+        self.callback = callback
+
+    def stop(self):
+        db = self.db
+        db.unsubscribe(self.callback)
+        if not db._subscribers and db._watcher is not None:
+            db._watcher.stop()
+            db._watcher = None
+
+
+def _iterWithOffsets(nf, stream):
+    """Tag each op with the text file offset just after it, or None for
+    ops from a segment."""
+    filename = nf._filename
+    inText = False
+    for item in stream:
+        # The text file is only read once its segments are exhausted.
+        if not inText and nf.offset:
+            inText = True
+        yield item + (filename, nf.offset if inText else None)
+
+
+def _projectRecord(record, keys):
+    if keys is None:
+        return record
+    projected = Record((key, record[key]) for key in keys if key in record)
+    projected.id = record.id
+    return projected
+
+
+def _statFile(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _canResume(path, offset, stat):
+    """Whether `path` only had bytes appended since it was read to `offset`."""
+    current = _statFile(path)
+    if current is None:
+        return False
+    if stat is not None and stat[0] != current[0]:
+        # Replaced by a different file, e.g. after a compaction.
+        return False
+    if current[1] < offset:
+        return False
+    if offset:
+        with open(path, "rb") as f:
+            f.seek(offset - 1)
+            # A partially read last line has been continued since.
+            return f.read(1) == b"\n"
+    return True
+
+
+def compactOps(ops):
+    """Reduce one device's ops, in timestamp order, to the ops they amount to.
+
+    Each record becomes at most an X op for its last full delete, X ops for
+    keys deleted since, N ops with the values keys were last set to and I
+    ops with the net change of keys that were only ever incremented or
+    decremented. Keeping those as relative changes means they still add to
+    values other devices set. Every key keeps the timestamp it was last
+    written or deleted at, with the keys of a record written at the same
+    time in one op, so other devices' ops before or after still merge in
+    the same order. Only where another device wrote the same record in
+    between is the result not exact, see NexusDB.compact().
+    """
+    records = {}
+    for op, ts, recordId, data in ops:
+        state = records.get(recordId)
+        if state is None:
+            state = records[recordId] = {
+                "cleared": None, "created": None, "dropped": {}, "values": {}, "relative": {},
+            }
+        values = state["values"]
+        relative = state["relative"]
+        dropped = state["dropped"]
+        if op == 'X':
+            if data:
+                for key in data:
+                    values.pop(key, None)
+                    relative.pop(key, None)
+                    dropped[key] = ts
+            else:
+                state["cleared"] = ts
+                state["created"] = None
+                values.clear()
+                relative.clear()
+                dropped.clear()
+            continue
+        # Every other op creates the record, even without any values.
+        state["created"] = ts
+        if op in ('N', 'U'):
+            for key, value in data.items():
+                relative.pop(key, None)
+                dropped.pop(key, None)
+                values[key] = (value, ts)
+        elif op in ('I', 'D'):
+            sign = 1 if op == 'I' else -1
+            for key, value in data.items():
+                if key in values:
+                    values[key] = (values[key][0] + sign * value, ts)
+                elif key in dropped or state["cleared"] is not None:
+                    # Counts up from zero again after a delete
+                    dropped.pop(key, None)
+                    values[key] = (sign * value, ts)
+                else:
+                    relative[key] = (relative.get(key, (0,))[0] + sign * value, ts)
+
+    compacted = []
+    for recordId, state in records.items():
+        if state["cleared"] is not None:
+            compacted.append(('X', state["cleared"], recordId, []))
+        byTs = {}
+        for key, ts in state["dropped"].items():
+            byTs.setdefault(('X', ts), []).append(key)
+        for key, (value, ts) in state["values"].items():
+            byTs.setdefault(('N', ts), {})[key] = value
+        for key, (value, ts) in state["relative"].items():
+            byTs.setdefault(('I', ts), {})[key] = value
+        if state["created"] is not None and not state["values"] and not state["relative"]:
+            byTs[('N', state["created"])] = {}
+        for op, ts in sorted(byTs, key=lambda item: item[1]):
+            data = byTs[op, ts]
+            compacted.append((op, ts, recordId, sorted(data) if op == 'X' else data))
+    compacted.sort(key=lambda op: op[1])
+    return compacted
+
+
+def mergeOps(streams):
+    """Merge per-file op streams into one stream in timestamp order.
+
+    Each stream must already be ordered by timestamp, as device files are.
+    Ties are broken by the position of the stream, so callers should pass
+    streams in a stable order (the database sorts them by file name).
+    """
+    heap = []
+    for idx, stream in enumerate(streams):
+        stream = iter(stream)
+        for item in stream:
+            heap.append((item[1], idx, item, stream))
+            break
+    heapq.heapify(heap)
+    while heap:
+        _, idx, item, stream = heap[0]
+        yield item
+        for item in stream:
+            heapq.heapreplace(heap, (item[1], idx, item, stream))
+            break
+        else:
+            heapq.heappop(heap)
@@ -1,15 +1,31 @@
+from __future__ import annotations
+
 import io
+import mmap
 import os
 import re
-import typing
-import uuid
+from collections.abc import Mapping
+from enum import Enum, auto
 
-from .utils import timestamp
+from .utils import atomicWrite, deviceId, timestamp
 from . import parser
 
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    import typing
+
 
 R_KEY = re.compile(r'(\w+)')
 R_ID = re.compile(r'^[-0-9a-f]+')
+R_VALID_KEY = re.compile(r'[a-z_][a-z0-9\.\-_]*\Z', re.I)
+
+# The inverse of parser.ESCAPES.
+STRING_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t'})
+
+# First characters of the strings int() or float() might accept.
+NUMBER_START = frozenset('+-.0123456789iInN \t\n\r\v\f')
+
+_validKeys = set()
 
 
 class EndOfRecords(ValueError):
@@ -17,8 +33,91 @@ class EndOfRecords(ValueError):
 
 
 class Record(dict):
+    __slots__ = ('id',)
     id: str
 
+
+class Durability(Enum):
+    NONE = auto()   # Leave flushing to the OS
+    BATCH = auto()  # fsync when the file is flushed or closed
+    OP = auto()     # fsync after every op
+
+def headerLines(device, fileid):
+    return [
+        f'* format=nexus\n',
+        f'* encoding=utf8\n',
+        f'* version=0\n',
+        f'* revision=0\n',
+        f'* device={device}\n',
+        f'* fileid={str(fileid)}\n',
+    ]
+
+
+def replaceFile(filename, device, lines):
+    """Atomically replace a device file with a new header and `lines`.
+
+    The new file is written and synced next to the old one and renamed
+    over it, so readers and sync clients see either file but never a
+    partly written one. `lines` are encoded lines, as str or bytes.
+    """
+    import uuid
+
+    with atomicWrite(filename, sync=True) as f:
+        f.write(''.join(headerLines(device, uuid.uuid4())).encode('utf8'))
+        for line in lines:
+            f.write(line.encode('utf8') if isinstance(line, str) else line)
+
+
+def encodeValue(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    elif isinstance(value, int):
+        return str(value)
+    elif isinstance(value, float):
+        enc = repr(value)
+        if parser.R_TOKEN_NUMBER.match(enc.lstrip('-')):
+            return enc
+    elif isinstance(value, str):
+        return _quote(value)
+    raise ValueError(f"Cannot write '{value.__class__.__name__}' type values.")
+
+
+def _quote(value):
+    return '"' + value.translate(STRING_ESCAPES) + '"'
+
+
+def checkKey(key):
+    """Raise ValueError unless `key` is a key the parser can read back."""
+    if key not in _validKeys:
+        if not isinstance(key, str) or not R_VALID_KEY.match(key):
+            raise ValueError(f"Invalid key {key!r}")
+        _validKeys.add(key)
+
+
+def encodeLine(op, ts, recordId, data):
+    buffer = [
+        op,
+        ' ',
+        str(ts),
+        ' ',
+        recordId,
+    ]
+    if op == 'X':
+        buffer.append(' ')
+        if data:
+            for key in data:
+                checkKey(key)
+                buffer.extend([key, ' '])
+    else:
+        buffer.append(' ')
+        for key, value in data.items():
+            checkKey(key)
+            buffer.extend((key, '=', encodeValue(value), ' '))
+    buffer.pop() # Remove the last space, not needed
+    buffer.append('\n')
+    return ''.join(buffer)
+
+
 class NexusFile:
     """Nexus Data File
     
@@ -45,77 +144,92 @@ class NexusFile:
     * updated=<updated time>
     * fileid=<random UUID>
     * fromfileid=<random UUID>
+    * compacted=<last sealed segment compacted into the file>
     """
 
     _file: io.StringIO
-    _id: uuid.UUID
+    _id: 'uuid.UUID'
+    _buffer: typing.Optional[mmap.mmap] = None
 
     records: typing.Mapping[str, typing.Mapping[str, typing.Any]]
 
-    def __init__(self, filename: str, mode: str = "a") -> None:
+    def __init__(
+        self,
+        filename: str,
+        mode: str = "a",
+        device: typing.Optional[str] = None,
+        buffering: int = -1,
+        durability: Durability = Durability.NONE,
+        useMmap: bool = False,
+    ) -> None:
         self._filename = filename
-        self._device = str(uuid.uuid1(uuid.getnode(), 0))[24:]
+        self._device = device or deviceId()
+        self.durability = durability
 
         is_new = not os.path.exists(filename)
         if is_new:
             # new file, write header
+            import uuid
+
             self._id = uuid.uuid4()
-            ts = timestamp()
-            open(filename, "w").writelines([
-                f'* format=nexus\n',
-                f'* encoding=utf8\n',
-                f'* version=0\n',
-                f'* revision=0\n',
-                f'* device={self._device}\n',
-                f'* fileid={str(self._id)}\n',
-            ])
-
-        self._file = open(filename, mode)
+            with open(filename, "w", encoding="utf8") as f:
+                f.writelines(headerLines(self._device, self._id))
+
+        if mode == "r":
+            # Read in binary so `offset` is a byte position that can be
+            # seeked back to, e.g. when resuming from a checkpoint.
+            self._file = open(filename, "rb")
+            size = os.fstat(self._file.fileno()).st_size
+            if useMmap and size:
+                self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._file = open(filename, mode, buffering=buffering, encoding="utf8")
+        self.offset = 0
         self.records = {}
             
     
     def close(self):
+        if self.durability is not Durability.NONE and not self._file.closed:
+            self.flush(sync=True)
+        if self._buffer is not None:
+            self._buffer.close()
         self._file.close()
     
+    def flush(self, sync=False):
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+    
+    def seek(self, offset):
+        if self._buffer is None:
+            self._file.seek(offset)
+        self.offset = offset
+    
     def writeLine(self, recordId, op, data):
-        buffer = [
-            op,
-            ' ',
-            str(timestamp()),
-            ' ',
-            recordId,
-        ]
-        if op == 'X':
-            buffer.append(' ')
-            if data:
-                for key in data:
-                    buffer.extend([key, ' '])
-        else:
-            buffer.append(' ')
-            for key, value in data.items():
-                assert re.match(R_KEY, key)
-                if isinstance(value, int):
-                    enc = str(value)
-                elif isinstance(value, str):
-                    enc = repr(value)
-                    if enc[0] == "'":
-                        enc = '"' + enc[1:-1] + '"'
-                else:
-                    raise ValueError(f"Cannot write '{value.__class__.__name__}' type values.")
-                buffer.extend((key, '=', enc, ' '))
-        buffer.pop() # Remove the last space, not needed
-        buffer.append('\n')
-        line = ''.join(buffer)
+        line = encodeLine(op, timestamp(), recordId, data)
         self._file.write(line)
+        if self.durability is Durability.OP:
+            self.flush(sync=True)
     
     def _stringToValue(self, string):
+        # Only strings are parsed, other values are kept as they are,
+        # except bools, which are written as 1 and 0.
+        if not isinstance(string, str):
+            return int(string) if isinstance(string, bool) else string
+        if string[:1] not in NUMBER_START and string[:1].isascii():
+            return string
         try:
             return int(string)
         except ValueError:
             try:
-                return float(string)
+                value = float(string)
             except ValueError:
                 return string
+            # The parser has no syntax for floats like nan, inf or 1e+20,
+            # so those strings are written as they are.
+            if parser.R_TOKEN_NUMBER.match(repr(value).lstrip('-')):
+                return value
+            return string
     
     def _convertDictValues(self, data):
         for key, value in data.items():
@@ -141,7 +255,29 @@ class NexusFile:
     
     def delete(self, recordId, keys=None):
         self.writeLine(recordId, 'X', keys)
-    
+
+    def setMany(self, items):
+        """Set many records, given as `(recordId, data)` pairs or a mapping.
+
+        Like set(), but all the lines are encoded into one buffer and
+        written at once, and the callers' dicts are left unchanged.
+        Returns the number of records written.
+        """
+        if isinstance(items, Mapping):
+            items = items.items()
+        records = self.records
+        stringToValue = self._stringToValue
+        lines = []
+        for recordId, data in items:
+            values = {key: stringToValue(value) for key, value in data.items()}
+            lines.append(encodeLine('N', timestamp(), recordId, values))
+            records.setdefault(recordId, {}).update(values)
+        if lines:
+            self._file.write(''.join(lines))
+            if self.durability is Durability.OP:
+                self.flush(sync=True)
+        return len(lines)
+
     def get(self, recordId, key=None):
         if not self.records:
             self.readAll()
@@ -152,101 +288,86 @@ class NexusFile:
             return record
     
     def _parseOpLine(self, line):
-        if line[0] == '*':
-            ts, linedata = line.split(' ', 1)
-            return '*', 0, linedata.strip(), None
-        try:
-            op, ts, linedata = line.split(' ', 2)
-        except ValueError:
-            raise ValueError("Invalid line: %r" % (line,))
-        ts = int(ts)
-        data = None
-        p = parser.Parser(linedata)
-        t, recordId = p.readToken([parser.TOKEN_TYPE.ID])
-        if op == 'X':
-            data = []
-            while p.remaining:
-                t, key = p.readToken([parser.TOKEN_TYPE.KEY, parser.TOKEN_TYPE.LINEEND])
-                if t == parser.TOKEN_TYPE.LINEEND:
-                    break
-                else:
-                    data.append(key)
-            
-        elif op in 'NUID':
-            data = self._parseRecordData(p.remaining)
-        else:
-            data = None
-        # ts = int(ts)
-        return op, ts, recordId, data
+        return parser.parseOpLine(line)
     
-    def applyOperation(self, op, records, recordId, data):
+    @staticmethod
+    def _getRecord(records, recordId):
+        # The record's id is the same string object as its key in `records`.
+        rec = records.get(recordId)
+        if rec is None:
+            rec = records[recordId] = Record()
+            rec.id = recordId
+        return rec
+
+    @staticmethod
+    def applyOperation(op, records, recordId, data):
         if op == 'X':
             rec = records.get(recordId)
-            if rec:
+            if rec is not None:
                 if data:
                     for key in data:
-                        rec.pop(key)
+                        rec.pop(key, None)
                 else:
                     records.pop(recordId)
             
         elif op in 'NU':
-            rec = records.setdefault(recordId, Record())
-            rec.id = recordId
-            rec.update(data)
+            NexusFile._getRecord(records, recordId).update(data)
         elif op == 'I':
-            records.setdefault(recordId, Record())
-            rec = records[recordId]
+            rec = NexusFile._getRecord(records, recordId)
             for key, value in data.items():
                 rec.setdefault(key, 0)
                 rec[key] += data[key]
         elif op == 'D':
-            records.setdefault(recordId, Record())
-            rec = records[recordId]
+            rec = NexusFile._getRecord(records, recordId)
             for key, value in data.items():
                 rec.setdefault(key, 0)
                 rec[key] -= data[key]
     
     def _parseRecordData(self, line):
-        p = parser.Parser(line)
-        record = {}
-
-        # t, record.id = p.readToken([parser.TOKEN_TYPE.ID])
-
-        while p.remaining:
-            # End of line?
-            try:
-                t, n = p.readToken([parser.TOKEN_TYPE.LINEEND], advance=False)
-            except parser.ParserError:
-                pass
-            else:
-                break
-
-            _, key = p.readToken([parser.TOKEN_TYPE.KEY])
-            p.readToken([parser.TOKEN_TYPE.OP_EQ])
-            t, value = p.readToken([
-                parser.TOKEN_TYPE.STRING,
-                parser.TOKEN_TYPE.NUMBER,
-            ])
-
-            if t == parser.TOKEN_TYPE.STRING:
-                value = p.parseStringLiteral(value)
-            elif t == parser.TOKEN_TYPE.NUMBER:
-                value = float(value)
-                as_int = int(value)
-                if as_int == value:
-                    value = as_int 
-            
-            record[key] = value
-
-        return record
+        return parser.parseRecordData(line)
     
-    def parseNextRecord(self):
+    def parseNextRecord(self, partial=True):
+        if self._buffer is not None:
+            for item in self._iterMapped(partial):
+                return item
+            raise EndOfRecords()
         line = self._file.readline()
+        while line and line.isspace():
+            self.offset += len(line)
+            line = self._file.readline()
+        if line and not partial and not line.endswith(b'\n'):
+            # Still being written (or synced); leave it for the next read.
+            self._file.seek(self.offset)
+            line = None
         if line:
-            return self._parseOpLine(line)
+            self.offset += len(line)
+            return self._parseOpLine(line.decode('utf8'))
         else:
             raise EndOfRecords()
     
+    def _iterMapped(self, partial=True):
+        for nextPos, item in parser.iterOpBuffer(self._buffer, self.offset, partial):
+            self.offset = nextPos
+            yield item
+
+    def iterOps(self, partial=True):
+        """Yield the remaining `(op, ts, recordId, data)` ops, skipping meta data lines.
+
+        With `partial=False` a final line without a newline is not consumed.
+        """
+        if self._buffer is not None:
+            for item in self._iterMapped(partial):
+                if item[0] != '*':
+                    yield item
+            return
+        while True:
+            try:
+                item = self.parseNextRecord(partial)
+            except EndOfRecords:
+                return
+            if item[0] != '*':
+                yield item
+    
     def readRecord(self):
         op, ts, recordId, data = self.parseNextRecord()
         if op == '*':
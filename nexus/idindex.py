@@ -0,0 +1,84 @@
+"""Record IDs in sorted order, for prefix scans and paging, see NexusDB.scan().
+
+The index follows one records mapping. Applying an op only notes the IDs
+that were added or removed, and the sorted list catches up on the next
+scan: with bisect for a few changes, or by sorting again after many,
+such as a full load. When the database swaps its records for a new
+mapping the list is rebuilt from it.
+"""
+import itertools
+from bisect import bisect_left, bisect_right
+
+
+# Past this share of pending changes, sorting all the IDs again is cheaper.
+REBUILD_RATIO = 0.05
+CHUNK_SIZE = 256
+
+
+class IdIndex:
+    def __init__(self):
+        self._records = None
+        self._ids = []
+        self._pending = set()
+        self._version = 0
+
+    def changed(self, records, recordId):
+        """Note that `recordId` may have been added to or removed from `records`."""
+        # Changes to other records are covered by the rebuild on their first scan.
+        if records is self._records:
+            self._pending.add(recordId)
+
+    def _sync(self, records):
+        if records is self._records and not self._pending:
+            return
+        if records is not self._records or len(self._pending) > REBUILD_RATIO * len(self._ids):
+            self._records = records
+            self._ids = sorted(records)
+        else:
+            ids = self._ids
+            for recordId in self._pending:
+                i = bisect_left(ids, recordId)
+                indexed = i < len(ids) and ids[i] == recordId
+                if recordId in records:
+                    if not indexed:
+                        ids.insert(i, recordId)
+                elif indexed:
+                    del ids[i]
+        self._pending.clear()
+        self._version += 1
+
+    def iterIds(self, records, prefix="", startAfter=None):
+        """Iterate over the IDs in `records` starting with `prefix`, in order.
+
+        With `startAfter`, only the IDs after it are yielded, so the last
+        ID of one page is the cursor for the next one. The index catches
+        up with `records` right away, so callers can hold their lock for
+        just this call. IDs are yielded from copies of up to CHUNK_SIZE of
+        them, so one removed while iterating may still come up.
+        """
+        self._sync(records)
+        return self._iterIds(prefix, startAfter)
+
+    def _iterIds(self, prefix, startAfter):
+        ids = self._ids
+        pos = bisect_left(ids, prefix)
+        if startAfter is not None:
+            pos = max(pos, bisect_right(ids, startAfter))
+        version = self._version
+        while pos < len(ids):
+            chunk = ids[pos:pos + CHUNK_SIZE]
+            # The IDs are sorted, so if the last one has the prefix all do.
+            last = chunk[-1].startswith(prefix)
+            if not last:
+                chunk = list(itertools.takewhile(lambda recordId: recordId.startswith(prefix), chunk))
+            yield from chunk
+            if not last or not chunk:
+                return
+            if self._version != version:
+                # The list changed while this was suspended, so find the
+                # place after the last ID again.
+                ids = self._ids
+                version = self._version
+                pos = bisect_right(ids, chunk[-1])
+            else:
+                pos += len(chunk)
@@ -1,7 +1,5 @@
 import argparse
-import base64
 import sys
-import uuid
 
 
 RECORD_COMMANDS = [
@@ -24,27 +22,146 @@ def printRecord(nf, recordId, fields=None):
         print(f"{recordId}\t{values}")
 
 
+def printValues(recordId, values, out=None):
+    values = "\t".join("" if value is None else str(value) for value in values)
+    print(f"{recordId}\t{values}", file=out)
+
+
+def parsePairs(pairs):
+    data = {}
+    for pair in pairs:
+        try:
+            key, value = pair.split('=', 1)
+        except ValueError:
+            key = pair
+            value = True
+        data[key] = value
+    return data
+
+
+EXEC_COMMANDS = ['set', 'get', 'inc', 'dec', 'delete', 'find']
+
+# Past this share of the records, loading the database (from its
+# checkpoint) is cheaper than reading the changed records on their own.
+READ_ALL_SHARE = 0.05
+
+
+def execCommands(nf, lines, out=sys.stdout):
+    """Run newline separated commands against one open database.
+
+    Each line is `<command> <record id> <args>...`, split like a shell
+    would. Writes go through one write batch and are applied to the
+    loaded records as well, so later reads see them. The database is
+    only loaded once the first read comes along. Results are written to
+    `out` as tab separated lines, and errors to stderr. Returns the
+    number of failed lines.
+    """
+    import shlex
+    from nexus.query import Query
+
+    loaded = False
+    failed = 0
+    with nf.batch() as batch:
+        for lineno, line in enumerate(lines, 1):
+            try:
+                words = shlex.split(line, comments=True)
+                if not words:
+                    continue
+                command, recordId, pairs = words[0], words[1] if len(words) > 1 else '', words[2:]
+                if command not in EXEC_COMMANDS:
+                    raise ValueError(f"Unknown command {command!r}")
+                if command in ('get', 'find'):
+                    if not loaded:
+                        batch.commit()
+                        nf.readAll()
+                        loaded = True
+                    if command == 'get':
+                        record = nf.get(recordId) or {}
+                        if pairs:
+                            values = [record.get(key) for key in pairs]
+                        else:
+                            values = [f"{key}={value}" for key, value in record.items()]
+                        printValues(recordId, values, out)
+                    else:
+                        query = Query(pairs, prefix=recordId)
+                        for resultId, values in query.run(nf.records, nf.iterIds(recordId)):
+                            if query.fields:
+                                printValues(resultId, values, out)
+                            else:
+                                print(resultId, file=out)
+                    out.flush()
+                    continue
+                if not recordId:
+                    raise ValueError(f"{command} needs a record id")
+                data = parsePairs(pairs)
+                if command == 'delete':
+                    batch.delete(recordId, data)
+                    op, data = 'X', list(data)
+                else:
+                    # The batch converts the values in place.
+                    getattr(batch, command)(recordId, data)
+                    op = {'set': 'N', 'inc': 'I', 'dec': 'D'}[command]
+                if loaded:
+                    nf.applyOperation(op, None, recordId, data)
+            except ValueError as e:
+                failed += 1
+                print(f"line {lineno}: {e}", file=sys.stderr)
+    return failed
+
+
+def loadRecords(nf, asOf=None):
+    if asOf is None:
+        nf.readAll()
+    else:
+        nf.records = nf.asOf(asOf)
+
+
+def loadRecord(nf, recordId, asOf=None):
+    if asOf is None:
+        record = nf.readRecord(recordId)
+        nf.records = {} if record is None else {recordId: record}
+    else:
+        nf.records = nf.asOf(asOf)
+
+
+def loadChangedRecords(nf, since, until, asOf=None):
+    """Load only the records with changes after `since` and up to `until`."""
+    changed = dict.fromkeys(recordId for _, _, recordId, _ in nf.iterOps(since, until))
+    if asOf is None and len(changed) <= READ_ALL_SHARE * nf.estimateRecordCount():
+        records = nf.readRecords(changed)
+    else:
+        if asOf is None:
+            nf.readAll()
+            records = nf.records
+        else:
+            records = nf.asOf(asOf)
+        records = {recordId: records.get(recordId) for recordId in changed}
+    nf.records = {recordId: record for recordId, record in records.items() if record is not None}
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('path', type=str, action='store')
     parser.add_argument('command', type=str, action='store')
     parser.add_argument('--key-size', type=int, action='store', default=5, dest='key_size')
+    parser.add_argument('--stats', action='store_true', help='print counters and timers to stderr')
     args, remaining = parser.parse_known_args()
+    nf = None
 
     if args.command in RECORD_COMMANDS:
         recordParser = argparse.ArgumentParser()
         parser.add_argument('id', type=str, action='store')
         parser.add_argument('pairs', type=str, nargs='*')
+        parser.add_argument('--as-of', type=int, action='store', default=None, dest='as_of')
+        if args.command == 'find':
+            parser.add_argument('--order-by', type=str, action='store', default=None, dest='order_by')
+            parser.add_argument('--desc', action='store_true')
+            parser.add_argument('--limit', type=int, action='store', default=None)
+            parser.add_argument('--since', type=int, action='store', default=None)
+            parser.add_argument('--until', type=int, action='store', default=None)
         recordArgs, remaining = parser.parse_known_args()
 
-        data = {}
-        for pair in recordArgs.pairs:
-            try:
-                key, value = pair.split('=', 1)
-            except ValueError:
-                key = pair
-                value = True
-            data[key] = value
+        data = parsePairs(recordArgs.pairs)
 
         from nexus.file import NexusFile
         from nexus.db import NexusDB
@@ -56,48 +173,29 @@ def main():
 
         nf = NexusDB(args.path)
         if args.command == 'find':
-            # TODO: Parse filters and apply to record search
-            from . import parser
-
-            filters = []
-            fields = []
-            for string in recordArgs.pairs:
-                p = parser.Parser(string)
-                tokens = p.readUntilEnd(parser.EVAL_TOKEN_TYPES)
-                if len(tokens) == 3:
-                    _, key = tokens[0]
-                    _, op = tokens[1]
-                    _, value = tokens[2]
-                    if op == '<':
-                        filter = lambda rec, key=key, value=value: rec.get(key) < float(value)
-                    elif op == '>':
-                        filter = lambda rec, key=key, value=value: rec.get(key) > float(value)
-                    elif op == '=':
-                        filter = lambda rec, key=key, value=value: str(rec.get(key)) == str(value)
-                    elif op == '!=':
-                        filter = lambda rec, key=key, value=value: str(rec.get(key)) != str(value)
-                    elif op == '~':
-                        filter = lambda rec, key=key, value=value: str(value) in str(rec.get(key))
-                    elif op == '~=':
-                        filter = lambda rec, key=key, value=value: str(rec.get(key)).startswith(str(value))
-                    elif op == '=~':
-                        filter = lambda rec, key=key, value=value: str(rec.get(key)).endswith(str(value))
-                    filters.append(filter)
-                else:
-                    fields.append(string)
+            from nexus.query import Query
 
-            nf.readAll()
-            from glob import fnmatch
-            for recordId in nf.getRecordIds():
-                if recordId.startswith(recordArgs.id):
-                    ok = True
-                    for filter in filters:
-                        if not filter(nf.get(recordId)):
-                            ok = False
-                    if ok:
-                        printRecord(nf, recordId, fields)
+            query = Query(
+                recordArgs.pairs,
+                prefix=recordArgs.id,
+                orderBy=recordArgs.order_by,
+                descending=recordArgs.desc,
+                limit=recordArgs.limit,
+            )
+            if recordArgs.since is None and recordArgs.until is None:
+                loadRecords(nf, recordArgs.as_of)
+            else:
+                loadChangedRecords(nf, recordArgs.since, recordArgs.until, recordArgs.as_of)
+            for recordId, values in query.run(nf.records, nf.iterIds(recordArgs.id)):
+                if query.fields:
+                    printValues(recordId, values)
+                else:
+                    print(recordId)
         elif args.command == 'create':
             if recordArgs.id.endswith('-'):
+                import base64
+                import uuid
+
                 rndPostfix = base64.encodebytes(uuid.uuid4().bytes)[:-3].decode('ascii')[:args.key_size]
                 newId = recordArgs.id + rndPostfix
             else:
@@ -112,7 +210,7 @@ def main():
         elif args.command == 'delete':
             nf.delete(recordArgs.id, data)
         elif args.command == 'get':
-            nf.readAll()
+            loadRecord(nf, recordArgs.id, recordArgs.as_of)
             if data:
                 for key in data:
                     print(nf.get(recordArgs.id, key))
@@ -121,6 +219,35 @@ def main():
                 printRecord(nf, recordArgs.id, data.keys())
                 # for key in record:
                 #     print(key, '=', record[key])
+    elif args.command == 'compact':
+        parser.add_argument('--before', type=int, action='store', default=None)
+        parser.add_argument('--archive', action='store_true')
+        compactArgs = parser.parse_args()
+
+        from nexus.db import NexusDB
+
+        nf = NexusDB(compactArgs.path)
+        old, new = nf.compact(before=compactArgs.before, archive=compactArgs.archive)
+        print(f"Compacted {old} ops into {new}")
+    elif args.command == 'exec':
+        parser.add_argument('source', type=str, action='store', nargs='?', default='-')
+        execArgs = parser.parse_args()
+
+        from nexus.db import NexusDB
+
+        nf = NexusDB(execArgs.path)
+        if execArgs.source == '-':
+            failed = execCommands(nf, sys.stdin)
+        else:
+            with open(execArgs.source, encoding='utf8') as f:
+                failed = execCommands(nf, f)
     else:
         recordArgs = None
 
+    if args.stats and nf is not None:
+        from nexus.stats import formatStats
+
+        print(formatStats(nf.stats()), file=sys.stderr)
+    if args.command == 'exec' and failed:
+        sys.exit(1)
+
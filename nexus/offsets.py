@@ -0,0 +1,296 @@
+"""Per-device record offset indexes, kept in `<local device>.<device>.offsets`
+sidecars.
+
+The index maps each record ID to where its ops are in a device's sealed
+segments and text file, so a point read seeks to a record's own ops
+instead of scanning the device. Lookups bisect the sorted part of the
+sidecar through mmap, so they cost about the same for any file size.
+
+Ops appended to the text file are added to an unsorted tail, and the
+tail is merged into the sorted part once it reaches MAX_TAIL bytes. The
+index is rebuilt when the text file was rewritten (compacted or sealed)
+or its segments changed. The sidecar is only ever replaced as a whole,
+and each reading device has its own, like the Bloom filters.
+
+Sidecar Layout:
+<JSON header line, padded with spaces>
+<sorted lines>
+<tail lines>
+
+Each line is `<record id>\t<location>,<location>...`, with the record's
+locations in the order of the device's ops. A location is the byte
+position of a text file line, or `<segment>:<position>:<ts>` for an op in
+the device's n-th segment.
+"""
+import json
+import mmap
+import os
+
+from . import parser, segment
+from .checkpoint import fingerprint, matchesFingerprint
+from .utils import atomicWrite
+
+
+VERSION = 1
+SUFFIX = ".offsets"
+MAX_TAIL = 1 << 18
+HEADER_SLACK = 64
+
+
+def sidecarPath(filename, localDevice):
+    dirname, name = os.path.split(filename)
+    return os.path.join(dirname, f"{localDevice}.{name[:-len('.nexus')]}{SUFFIX}")
+
+
+class OffsetIndex:
+    """The offset index of one device file and its sealed segments."""
+
+    def __init__(self, filename, localDevice):
+        self.filename = filename
+        self.path = sidecarPath(filename, localDevice)
+
+    def _open(self):
+        try:
+            return open(self.path, "rb")
+        except OSError:
+            return None
+
+    @staticmethod
+    def _readHeader(f):
+        if f is None:
+            return None, 0
+        line = f.readline()
+        try:
+            header = json.loads(line)
+        except ValueError:
+            return None, 0
+        if not line.endswith(b"\n") or header.get("version") != VERSION:
+            return None, 0
+        return header, len(line)
+
+    def update(self):
+        """Index the ops appended since the last update.
+
+        Returns True if the index changed.
+        """
+        # The header and the lines are read from the same open sidecar,
+        # even if another reader replaces it in the meantime.
+        f = self._open()
+        try:
+            return self._update(f)
+        finally:
+            if f is not None:
+                f.close()
+
+    def _update(self, f):
+        segmentPaths = segment.segmentPaths(self.filename)
+        segments = [os.path.basename(path) for path in segmentPaths]
+        exists = os.path.exists(self.filename)
+        header, headerSize = self._readHeader(f)
+        if header is None or header["segments"] != segments:
+            rebuild = True
+        elif header["file"] is None:
+            rebuild = exists
+        else:
+            rebuild = not (exists and matchesFingerprint(self.filename, header["file"]))
+        if rebuild:
+            self._rebuild(segmentPaths, segments)
+            return True
+
+        if not exists or os.path.getsize(self.filename) <= header["file"]["offset"]:
+            return False
+        entries, end = _indexFile(self.filename, header["file"]["offset"])
+        header["file"] = fingerprint(self.filename, end)
+        tail = b"".join(recordId + b"\t" + loc + b"\n" for recordId, loc in entries)
+        encoded = _encodeHeader(header)
+        body = f.read()
+        if len(body) + headerSize - header["sorted"] + len(tail) > MAX_TAIL or len(encoded) >= headerSize:
+            self._merge(header, body + tail)
+            return True
+        with atomicWrite(self.path, cache=True) as out:
+            out.write(encoded.ljust(headerSize - 1) + b"\n")
+            out.write(body)
+            out.write(tail)
+        return True
+
+    def _rebuild(self, segmentPaths, segments):
+        locations = {}
+        for segmentIdx, path in enumerate(segmentPaths):
+            with segment.Segment(path) as seg:
+                for pos, ts, recordId in seg.iterIndex():
+                    _add(locations, recordId.encode("utf8"), b"%d:%d:%d" % (segmentIdx, pos, ts))
+        fp = None
+        if os.path.exists(self.filename):
+            entries, end = _indexFile(self.filename, segment.sealedOffset(self.filename, segmentPaths))
+            for recordId, loc in entries:
+                _add(locations, recordId, loc)
+            fp = fingerprint(self.filename, end)
+        self._write({"version": VERSION, "file": fp, "segments": segments}, locations)
+
+    def _merge(self, header, lines):
+        locations = {}
+        for line in lines.splitlines():
+            recordId, locs = line.split(b"\t")
+            _add(locations, recordId, locs)
+        self._write(header, locations)
+
+    def _write(self, header, locations):
+        body = b"".join(
+            recordId + b"\t" + b",".join(locs) + b"\n"
+            for recordId, locs in sorted(locations.items())
+        )
+        # Room for the header to grow, so appends keep the sorted part where it is.
+        header["sorted"] = 0
+        headerSize = len(_encodeHeader(header)) + HEADER_SLACK
+        header["sorted"] = headerSize + len(body)
+        with atomicWrite(self.path, cache=True) as f:
+            f.write(_encodeHeader(header).ljust(headerSize - 1) + b"\n")
+            f.write(body)
+
+    def lookup(self, recordId):
+        """Locations of the ops of `recordId`, in the device's order.
+
+        Each is `(segment index, position, ts)` for an op in a segment, or
+        `(None, position, None)` for a line of the text file.
+        """
+        return self.lookupMany([recordId]).get(recordId, [])
+
+    def lookupMany(self, recordIds):
+        """Locations of the ops of each of `recordIds` that has any, by ID,
+        reading the sidecar once."""
+        f = self._open()
+        if f is None:
+            return {}
+        found = {}
+        with f:
+            header, headerSize = self._readHeader(f)
+            if header is None:
+                return {}
+            size = os.fstat(f.fileno()).st_size
+            if size <= headerSize:
+                return {}
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                # Searching the tail for each of many IDs costs more than
+                # reading it once.
+                tail = _readTail(buf, header["sorted"]) if len(recordIds) > 1 else None
+                for recordId in recordIds:
+                    key = recordId.encode("utf8")
+                    locs = []
+                    line = _bisect(buf, headerSize, header["sorted"], key)
+                    if line is not None:
+                        locs.extend(line.split(b","))
+                    if tail is None:
+                        locs.extend(_findInTail(buf, header["sorted"], key))
+                    else:
+                        locs.extend(tail.get(key, ()))
+                    if locs:
+                        found[recordId] = [_parseLocation(loc) for loc in dict.fromkeys(locs)]
+        return found
+
+    def readOps(self, recordId):
+        """Read the ops of `recordId`, in the order the device has them."""
+        return self.readOpsMany([recordId]).get(recordId, [])
+
+    def readOpsMany(self, recordIds):
+        """Read the ops of each of `recordIds` that has any, by ID."""
+        found = self.lookupMany(recordIds)
+        if not found:
+            return {}
+        segmentPaths = segment.segmentPaths(self.filename)
+        opsById = {}
+        segments = {}
+        textFile = None
+        try:
+            for recordId, locations in found.items():
+                ops = opsById[recordId] = []
+                for segmentIdx, pos, ts in locations:
+                    if segmentIdx is None:
+                        if textFile is None:
+                            textFile = open(self.filename, "rb")
+                        textFile.seek(pos)
+                        ops.append(parser.parseOpLine(textFile.readline().decode("utf8")))
+                    else:
+                        seg = segments.get(segmentIdx)
+                        if seg is None:
+                            seg = segments[segmentIdx] = segment.Segment(segmentPaths[segmentIdx])
+                        ops.append(seg.readOp(pos, ts))
+        finally:
+            if textFile is not None:
+                textFile.close()
+            for seg in segments.values():
+                seg.close()
+        return opsById
+
+
+def _add(locations, recordId, loc):
+    locs = locations.get(recordId)
+    if locs is None:
+        locs = locations[recordId] = []
+    locs.append(loc)
+
+
+def _encodeHeader(header):
+    return json.dumps(header, separators=(",", ":")).encode("utf8")
+
+
+def _indexFile(filename, offset):
+    """`(record id, location)` of each op line after `offset`.
+
+    A last line without a newline is indexed too, since NexusDB.readAll()
+    applies it. Its fingerprint then has no newline at the end, so the
+    index is rebuilt once the line is continued.
+    """
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        buf = f.read()
+    end = len(buf)
+    if buf and not buf.endswith(b"\n"):
+        buf += b"\n"
+    entries = [
+        (m.group(3), b"%d" % (offset + m.start()))
+        for m in parser.B_OP_LINE.finditer(buf)
+    ]
+    return entries, offset + end
+
+
+def _bisect(buf, lo, hi, key):
+    """Find the locations of `key` in the sorted lines between `lo` and `hi`."""
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = buf.rfind(b"\n", lo, mid) + 1 or lo
+        tab = buf.find(b"\t", start, hi)
+        end = buf.find(b"\n", tab, hi) + 1
+        lineKey = buf[start:tab]
+        if lineKey == key:
+            return buf[tab + 1:end - 1]
+        elif lineKey < key:
+            lo = end
+        else:
+            hi = start
+    return None
+
+
+def _findInTail(buf, start, key):
+    # The tail starts after a newline, so every line in it does.
+    needle = b"\n" + key + b"\t"
+    pos = buf.find(needle, start - 1)
+    while pos >= 0:
+        lineStart = pos + len(needle)
+        end = buf.find(b"\n", lineStart)
+        yield buf[lineStart:end]
+        pos = buf.find(needle, end)
+
+
+def _readTail(buf, start):
+    tail = {}
+    for line in buf[start:].splitlines():
+        recordId, locs = line.split(b"\t")
+        _add(tail, recordId, locs)
+    return tail
+
+
+def _parseLocation(loc):
+    if b":" in loc:
+        segmentIdx, pos, ts = loc.split(b":")
+        return int(segmentIdx), int(pos), int(ts)
+    return None, int(loc), None
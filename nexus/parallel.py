@@ -0,0 +1,77 @@
+"""Parse device files in worker processes for NexusDB.readAll(workers=...).
+
+Each device file is split into byte ranges on line boundaries and every
+range (and sealed segment) is parsed by a worker into a list of ops. The
+parent chains the lists of each device back together, in file order, so
+they can be merged exactly like the streams of a serial replay.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from . import parser, segment
+
+
+CHUNK_SIZE = 32 << 20
+
+
+def parseRange(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        buf = f.read(end - start)
+    return [item for _, item in parser.iterOpBuffer(buf) if item[0] != '*']
+
+
+def parseSegment(path):
+    with segment.Segment(path) as seg:
+        return list(seg.iterOps())
+
+
+def splitRanges(path, start, chunkSize=CHUNK_SIZE):
+    """Split `path` from `start` to its current end into line aligned ranges."""
+    end = os.path.getsize(path)
+    ranges = []
+    with open(path, "rb") as f:
+        while start < end:
+            stop = start + chunkSize
+            if stop < end:
+                f.seek(stop)
+                f.readline()
+                stop = min(f.tell(), end)
+            else:
+                stop = end
+            ranges.append((start, stop))
+            start = stop
+    return ranges
+
+
+def _chain(futures):
+    for future in futures:
+        yield from future.result()
+
+
+def openStreams(executor, files, segmentPaths, chunkSize=CHUNK_SIZE):
+    """Submit every file to `executor` and return one op stream per file.
+
+    `files` are NexusFile readers positioned where parsing should start,
+    and `segmentPaths` maps a file name to the segments to read before it.
+    The readers' offsets are moved to the end of what was submitted.
+    """
+    streams = []
+    for nf in files:
+        futures = [
+            executor.submit(parseSegment, path)
+            for path in segmentPaths.get(nf._filename, ())
+        ]
+        ranges = splitRanges(nf._filename, nf.offset, chunkSize)
+        futures.extend(
+            executor.submit(parseRange, nf._filename, start, end)
+            for start, end in ranges
+        )
+        if ranges:
+            nf.seek(ranges[-1][1])
+        streams.append(_chain(futures))
+    return streams
+
+
+def createExecutor(workers):
+    return ProcessPoolExecutor(max_workers=workers or None)
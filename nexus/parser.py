@@ -1,5 +1,5 @@
 from enum import Enum, auto
-from re import compile, match, I
+from re import compile, I, M, S
 
 R_WS = compile(r'[\t ]+')
 R_TOKEN_EQ = compile(r'(=)')
@@ -9,6 +9,41 @@ R_TOKEN_STRING = compile(r'((?<!\\)".*?(?<!\\)")', I)
 R_TOKEN_NUMBER = compile(r'(\d+(\.\d+)?(?=\s|$))', I)
 R_TOKEN_LINEEND = compile(r'(\n|$)')
 
+# Whole-line patterns used by parseOpLine(). These match at a position in the
+# line instead of on slices of it, so a line is scanned exactly once. The B_
+# versions match the same syntax in bytes, such as a memory mapped file.
+P_LINE_HEAD = r'(\S+) (\d+) ([a-z0-9\.\-_]+)(?=[\t \r\n]|$)'
+P_LINE_PAIR = (
+    r'[\t ]*([a-z_][a-z0-9\.\-_]*)[\t ]*=[\t ]*'
+    r'(?:"((?:[^"\\]|\\.)*)"|(-?\d+(?:\.\d+)?)(?=\s|$))'
+)
+P_LINE_KEY = r'[\t ]*([a-z_][a-z0-9\.\-_]*)(?=\s|$)'
+P_LINE_END = r'[\t \r]*(\n|$)'
+
+R_LINE_HEAD = compile(P_LINE_HEAD, I)
+R_LINE_PAIR = compile(P_LINE_PAIR, I | S)
+R_LINE_KEY = compile(P_LINE_KEY, I)
+R_LINE_END = compile(P_LINE_END)
+
+B_LINE_HEAD = compile(P_LINE_HEAD.encode(), I)
+B_LINE_PAIR = compile(P_LINE_PAIR.encode(), I | S)
+B_LINE_KEY = compile(P_LINE_KEY.encode(), I)
+B_LINE_END = compile(P_LINE_END.encode())
+B_BLANK = compile(rb'[\t \r]*$')
+B_OP_LINE = compile(rb'^([NUIDX]) (\d+) ([a-zA-Z0-9\.\-_]+)(?=[\t \r\n])[^\n]*\n', M)
+R_STRING_BODY = compile(r'"((?:[^"\\]|\\.)*)"', S)
+R_ESCAPE = compile(r'\\(.)', S)
+
+_OPS = {op.encode(): op for op in 'NUIDX'}
+
+ESCAPES = {
+    'r': '\r',
+    'n': '\n',
+    't': '\t',
+    '\\': '\\',
+    '"': '"',
+}
+
 
 class ParserError(ValueError):
     pass
@@ -81,8 +116,11 @@ class Parser:
         return self.text[self.index]
     
     def stopAtToken(self):
-        while m := match(R_WS, self.char):
-            self.index += m.end()
+        m = R_WS.match(self.text, self.index)
+        if m is not None:
+            self.index = m.end()
+        if self.index >= len(self.text):
+            raise IndexError(self.index)
 
     def readToken(self, acceptTokenTypes=None, advance=True):
         try:
@@ -91,16 +129,15 @@ class Parser:
             return TOKEN_TYPE.STOP, ''
 
         for tokenType, tokenPattern in TOKENS.items():
-            m = match(tokenPattern, self.remaining)
+            if acceptTokenTypes and tokenType not in acceptTokenTypes:
+                continue
+            m = tokenPattern.match(self.text, self.index)
             if m is not None:
-                if acceptTokenTypes:
-                    if tokenType not in acceptTokenTypes:
-                        continue
                 if advance:
-                    self.index += m.end()
-                return tokenType, m.groups()[0]
-        snippet = self.remaining
-        if len(snippet) > 20:
+                    self.index = m.end()
+                return tokenType, m.group(1)
+        snippet = self.text[self.index:self.index + 20]
+        if len(self.text) - self.index > 20:
             snippet += '...'
         raise ParserError(f"No token found at {self.index} ({snippet!r})")
     
@@ -113,25 +150,184 @@ class Parser:
         return tokens
     
     def parseStringLiteral(self, literal):
-        idx = 0
-        buffer = []
-        quote = literal[idx]
-        idx += 1
-        while True:
-            char = literal[idx]
-            if char == '"':
+        m = R_STRING_BODY.match(literal)
+        if m is None:
+            raise ParserError(f"Unterminated string literal {literal!r}")
+        return unescape(m.group(1))
+
+
+def unescape(body):
+    if '\\' not in body:
+        return body
+    return R_ESCAPE.sub(lambda m: ESCAPES.get(m.group(1), m.group(0)), body)
+
+
+def parseNumber(token):
+    if '.' in token:
+        value = float(token)
+        as_int = int(value)
+        if as_int == value:
+            return as_int
+        return value
+    return int(token)
+
+
+def parseRecordData(line, pos=0):
+    """Parse the `key=value ...` pairs of an op line, starting at `pos`."""
+    record = {}
+    end = len(line)
+    while pos < end:
+        m = R_LINE_PAIR.match(line, pos)
+        if m is None:
+            break
+        key, string, number = m.groups()
+        if number is None:
+            record[key] = unescape(string)
+        else:
+            record[key] = parseNumber(number)
+        pos = m.end()
+    _expectLineEnd(line, pos)
+    return record
+
+
+def parseKeyList(line, pos=0):
+    """Parse the bare keys of a delete (`X`) op line, starting at `pos`."""
+    keys = []
+    end = len(line)
+    while pos < end:
+        m = R_LINE_KEY.match(line, pos)
+        if m is None:
+            break
+        keys.append(m.group(1))
+        pos = m.end()
+    _expectLineEnd(line, pos)
+    return keys
+
+
+def parseOpLine(line):
+    """Parse one complete device file line into `(op, ts, recordId, data)`."""
+    if line[0] == '*':
+        _, linedata = line.split(' ', 1)
+        return '*', 0, linedata.strip(), None
+    m = R_LINE_HEAD.match(line)
+    if m is None:
+        raise ParserError("Invalid line: %r" % (line,))
+    op, ts, recordId = m.groups()
+    if op in ('N', 'U', 'I', 'D'):
+        data = parseRecordData(line, m.end())
+    elif op == 'X':
+        data = parseKeyList(line, m.end())
+    else:
+        data = None
+    return op, int(ts), recordId, data
+
+
+def _expectLineEnd(line, pos):
+    if R_LINE_END.match(line, pos) is None:
+        snippet = line[pos:pos + 20]
+        raise ParserError(f"No token found at {pos} ({snippet!r})")
+
+
+_decodedKeys = {}
+_decodedIds = {}
+
+
+def _decodeKey(raw):
+    key = _decodedKeys.get(raw)
+    if key is None:
+        key = _decodedKeys[raw] = raw.decode('ascii')
+    return key
+
+
+def _decodeId(raw):
+    recordId = _decodedIds.get(raw)
+    if recordId is None:
+        if len(_decodedIds) >= 100_000:
+            _decodedIds.clear()
+        recordId = _decodedIds[raw] = raw.decode('ascii')
+    return recordId
+
+
+def isBlank(buf, pos, end):
+    return B_BLANK.match(buf, pos, end) is not None
+
+
+def parseOpBuffer(buf, pos, end):
+    """Parse the op line in `buf[pos:end]` the way parseOpLine() does.
+
+    `buf` is any bytes-like object, such as an mmap of a device file. The
+    line is matched in place and only the IDs, keys and string values
+    are decoded, so lines are never copied out of the buffer first.
+    """
+    if buf[pos] == 42:  # '*'
+        return parseOpLine(buf[pos:end].decode('utf8'))
+    m = B_LINE_HEAD.match(buf, pos, end)
+    if m is None:
+        raise ParserError("Invalid line: %r" % (buf[pos:end],))
+    op, ts, recordId = m.groups()
+    return _parseOpBody(buf, op.decode('utf8'), int(ts), _decodeId(recordId), m.end(), end)
+
+
+def iterOpBuffer(buf, pos=0, partial=True):
+    """Yield `(nextPos, op)` for each line of `buf` from `pos` on.
+
+    Lines in the usual N/U/I/D/X shape are found by scanning the whole
+    buffer with one pattern, and anything in between (meta data, blank or
+    malformed lines) goes through parseOpBuffer(). With `partial=False` a
+    final line without a newline is left alone.
+    """
+    for m in B_OP_LINE.finditer(buf, pos):
+        start = m.start()
+        if start != pos:
+            yield from _iterOpLines(buf, pos, start, True)
+        pos = m.end()
+        op, ts, recordId = m.group(1, 2, 3)
+        yield pos, _parseOpBody(buf, _OPS[op], int(ts), _decodeId(recordId), m.end(3), pos - 1)
+    if pos < len(buf):
+        yield from _iterOpLines(buf, pos, len(buf), partial)
+
+
+def _iterOpLines(buf, pos, end, partial):
+    while pos < end:
+        lineEnd = buf.find(b'\n', pos, end)
+        if lineEnd == -1:
+            if not partial:
+                return
+            lineEnd = nextPos = end
+        else:
+            nextPos = lineEnd + 1
+        if not isBlank(buf, pos, lineEnd):
+            yield nextPos, parseOpBuffer(buf, pos, lineEnd)
+        pos = nextPos
+
+
+def _parseOpBody(buf, op, ts, recordId, pos, end):
+    if op in ('N', 'U', 'I', 'D'):
+        data = {}
+        match = B_LINE_PAIR.match
+        while pos < end:
+            m = match(buf, pos, end)
+            if m is None:
+                break
+            key, string, number = m.groups()
+            if number is None:
+                data[_decodeKey(key)] = unescape(string.decode('utf8'))
+            elif b'.' in number:
+                data[_decodeKey(key)] = parseNumber(number.decode('ascii'))
+            else:
+                data[_decodeKey(key)] = int(number)
+            pos = m.end()
+    elif op == 'X':
+        data = []
+        while pos < end:
+            m = B_LINE_KEY.match(buf, pos, end)
+            if m is None:
                 break
-            elif char == '\\':
-                idx += 1
-                esc = literal[idx]
-                if esc == 'r':
-                    char = '\r'
-                elif esc == 'n':
-                    char = '\n'
-                elif esc == '\\':
-                    char = '\\'
-                elif esc == '"':
-                    char = '"'
-            buffer.append(char)
-            idx += 1
-        return ''.join(buffer)
+            data.append(_decodeKey(m.group(1)))
+            pos = m.end()
+    else:
+        data = None
+        pos = end
+    if B_LINE_END.match(buf, pos, end) is None:
+        raise ParserError(f"No token found at {pos} ({buf[pos:min(end, pos + 20)]!r})")
+    return op, ts, recordId, data
@@ -0,0 +1,252 @@
+"""Record queries for `nexus find` and NexusDB.query().
+
+A query is a list of words, such as the arguments given to `nexus find`:
+
+    prio>3 AND ( done=0 OR NOT owner~=bob ) task prio
+
+Each `key<op>value` word is a comparison, the words AND, OR and NOT and
+parentheses combine them (comparisons next to each other are ANDed), and
+any other word is a key to project. The value of a comparison is a number,
+a "quoted string" or else the rest of the word as a string. It is
+converted once when the query is compiled, not for every record.
+
+Comparison Operators:
+=   Equal
+!=  Not equal
+<   Less than (also <=, >, >=)
+~   Contains
+~=  Starts with
+=~  Ends with
+"""
+import heapq
+import itertools
+import operator
+from re import compile, I, S
+
+from .parser import ParserError, R_STRING_BODY, parseNumber, unescape
+
+
+R_WORD = compile(r'\s*((?:[^\s"()]|"(?:[^"\\]|\\.)*")+|[()])', S)
+R_COMPARISON = compile(r'([a-z_][a-z0-9\.\-_]*)(!=|~=|=~|<=|>=|=|<|>|~)(.*)', I | S)
+R_FIELD = compile(r'[a-z_][a-z0-9\.\-_]*$', I)
+R_NUMBER = compile(r'-?\d+(?:\.\d+)?$')
+
+KEYWORDS = ('AND', 'OR', 'NOT')
+
+ORDERINGS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+class QueryError(ParserError):
+    pass
+
+
+def splitWords(text):
+    """Split a query string into words, keeping quoted strings whole."""
+    words = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = R_WORD.match(text, pos)
+        if m is None:
+            raise QueryError(f"Unterminated string in query at {pos} ({text[pos:pos + 20]!r})")
+        words.append(m.group(1))
+        pos = m.end()
+    return words
+
+
+def parseLiteral(text):
+    if R_NUMBER.match(text):
+        return parseNumber(text)
+    m = R_STRING_BODY.match(text)
+    if m is not None and m.end() == len(text):
+        return unescape(m.group(1))
+    return text
+
+
+def _isNumber(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def compileComparison(key, op, literal):
+    """Return a `test(record)` function for one `key<op>literal` comparison.
+
+    A record without the key fails every comparison except `!=`.
+    """
+    missing = object()
+    if op == '=':
+        return lambda rec: rec.get(key, missing) == literal
+    elif op == '!=':
+        return lambda rec: rec.get(key, missing) != literal
+    elif op in ORDERINGS:
+        compare = ORDERINGS[op]
+        if _isNumber(literal):
+            def test(rec):
+                value = rec.get(key)
+                return _isNumber(value) and compare(value, literal)
+        else:
+            def test(rec):
+                value = rec.get(key)
+                return isinstance(value, str) and compare(value, literal)
+        return test
+    literal = str(literal)
+    if op == '~':
+        return lambda rec: key in rec and literal in str(rec[key])
+    elif op == '~=':
+        return lambda rec: key in rec and str(rec[key]).startswith(literal)
+    elif op == '=~':
+        return lambda rec: key in rec and str(rec[key]).endswith(literal)
+    raise QueryError(f"Unknown operator {op!r}")
+
+
+class _WordParser:
+    """Recursive descent over query words: or_ := and_ (OR and_)*, and so on."""
+
+    def __init__(self, words):
+        self.words = words
+        self.index = 0
+        self.fields = []
+
+    def peek(self):
+        while self.index < len(self.words):
+            word = self.words[self.index]
+            if word == '(' or word == ')' or word.upper() in KEYWORDS or R_COMPARISON.match(word):
+                return word
+            if not R_FIELD.match(word):
+                raise QueryError(f"Invalid query word {word!r}")
+            # Anything else is a projected key, wherever it appears.
+            self.fields.append(word)
+            self.index += 1
+        return None
+
+    def next(self):
+        word = self.peek()
+        self.index += 1
+        return word
+
+    def parse(self):
+        test = self.parseOr()
+        word = self.peek()
+        if word is not None:
+            raise QueryError(f"Unexpected {word!r} in query")
+        return test
+
+    def parseOr(self):
+        tests = [self.parseAnd()]
+        while (self.peek() or '').upper() == 'OR':
+            self.next()
+            tests.append(self.parseAnd())
+        if len(tests) == 1:
+            return tests[0]
+        elif None in tests:
+            raise QueryError("Missing comparison next to OR")
+        return lambda rec: any(test(rec) for test in tests)
+
+    def parseAnd(self):
+        tests = []
+        while True:
+            word = self.peek()
+            if word is None or word == ')' or word.upper() == 'OR':
+                break
+            if word.upper() == 'AND':
+                self.next()
+                continue
+            tests.append(self.parseNot())
+        if len(tests) == 1:
+            return tests[0]
+        elif not tests:
+            return None
+        return lambda rec: all(test(rec) for test in tests)
+
+    def parseNot(self):
+        word = self.next()
+        if word is None:
+            raise QueryError("Query ends after NOT")
+        if word.upper() == 'NOT':
+            test = self.parseNot()
+            return lambda rec: not test(rec)
+        elif word == '(':
+            test = self.parseOr()
+            if self.next() != ')':
+                raise QueryError("Missing ')' in query")
+            return test or (lambda rec: True)
+        elif word == ')' or word.upper() in KEYWORDS:
+            raise QueryError(f"Unexpected {word!r} in query")
+        key, op, value = R_COMPARISON.match(word).groups()
+        return compileComparison(key, op, parseLiteral(value))
+
+
+def parseQuery(words):
+    """Compile query words into `(test, fields)`.
+
+    `test(record)` is None when there are no comparisons and `fields` are
+    the projected keys in the order given.
+    """
+    if isinstance(words, str):
+        words = splitWords(words)
+    p = _WordParser(list(words))
+    return p.parse(), p.fields
+
+
+def _sortKey(value):
+    # Missing values sort last and numbers before strings, so records with
+    # mixed value types can still be ordered.
+    if value is None:
+        return (2, 0)
+    elif _isNumber(value):
+        return (0, value)
+    return (1, str(value))
+
+
+class Query:
+    """A compiled query, run over a mapping of record ID to record."""
+
+    def __init__(self, where=(), prefix="", fields=None, orderBy=None, descending=False, limit=None):
+        self.test, whereFields = parseQuery(where)
+        self.prefix = prefix or ""
+        self.fields = list(fields or ()) + whereFields
+        self.orderBy = orderBy
+        self.descending = descending
+        self.limit = limit
+
+    def _matches(self, records, ids):
+        prefix = self.prefix
+        test = self.test
+        if ids is None:
+            items = records.items()
+        else:
+            items = ((recordId, records.get(recordId)) for recordId in ids)
+        for recordId, record in items:
+            if record is not None and recordId.startswith(prefix) and (test is None or test(record)):
+                yield recordId, record
+
+    def run(self, records, ids=None):
+        """Yield `(recordId, record)` for each match, or `(recordId, values)`
+        with the values of the projected keys when there are any.
+
+        `ids` are the record IDs to look at, in the order to yield them,
+        such as NexusDB.iterIds(prefix). Without them every record is.
+        Results stream as they are found, and without `orderBy` the scan
+        stops as soon as `limit` records matched.
+        """
+        matches = self._matches(records, ids)
+        if self.orderBy is not None:
+            key = self.orderBy
+            sortKey = lambda item: _sortKey(item[1].get(key))
+            if self.limit is not None:
+                pick = heapq.nlargest if self.descending else heapq.nsmallest
+                matches = pick(self.limit, matches, key=sortKey)
+            else:
+                matches = sorted(matches, key=sortKey, reverse=self.descending)
+        elif self.limit is not None:
+            matches = itertools.islice(matches, self.limit)
+        fields = self.fields
+        for recordId, record in matches:
+            if fields:
+                yield recordId, tuple(record.get(field) for field in fields)
+            else:
+                yield recordId, record
@@ -0,0 +1,404 @@
+"""Sealed segments: an immutable binary encoding of device file history.
+
+A device's own text file can be sealed, moving the ops it holds into
+`<device>.<sequence>.nxseg` and leaving the text file with only a header,
+so that it keeps syncing as a small append-only file.
+
+The segment is written before the text file is replaced, and records the
+fingerprint of the text file up to the last line it holds. As long as the
+text file still matches it, because sealing was interrupted or is still
+going on, readers skip those lines, see sealedOffset().
+
+Compacting a device goes the other way: the text file is replaced with
+the compacted ops of its segments, and a `* compacted=<sequence>` line
+saying which, before the segments are removed. Segments up to that
+sequence are no longer listed by segmentPaths().
+
+Segment Layout:
+MAGIC
+<varint length> <utf8 JSON source fingerprint, empty if there is none>
+<varint key count> (<varint length> <utf8 key>)...
+<varint id count> (<varint length> <utf8 record id>)...
+<varint shape count> (<varint key count> <varint key index>... <varint type count> <type codes>)...
+<op>...
+
+A shape is the list of keys an op touches and the type of each value, so
+ops with the same keys and value types share one. Each type code is one
+of T_INT, T_FLOAT, T_STR or T_BIGINT and X ops have shapes with no types.
+
+Op Layout:
+<u32 length of the rest of the op> <u8 op code> <u32 id index>
+<u16 shape index> <ts delta> <values> <string bytes>
+The values are packed with the shape's struct format: an int is a signed
+64 bit integer, a float a double, and a string or an int that doesn't fit
+in 64 bits is the length of its utf8 bytes, which follow the values.
+The ts delta from the previous op is a zigzag encoded varint stored as a
+u8 byte count followed by that many bytes, so it decodes in one call.
+All fixed width fields are little endian.
+"""
+import glob
+import json
+import mmap
+import os
+import struct
+
+from .checkpoint import matchesFingerprint
+from .utils import atomicWrite
+
+
+MAGIC = b"NXSEG\x00\x03\n"
+SUFFIX = ".nxseg"
+
+T_INT = "q"
+T_FLOAT = "d"
+T_STR = "s"
+T_BIGINT = "n"
+
+FORMATS = {T_INT: "q", T_FLOAT: "d", T_STR: "I", T_BIGINT: "I"}
+INT_MIN = -(1 << 63)
+INT_MAX = (1 << 63) - 1
+
+R_OP_HEADER = struct.Struct("<IBIH")
+
+
+class SegmentError(ValueError):
+    pass
+
+
+def segmentPaths(filename):
+    """Sealed segments of a `<device>.nexus` file, oldest first."""
+    paths = _allSegmentPaths(filename)
+    if paths:
+        compacted = compactedSequence(filename)
+        paths = [path for path in paths if sequence(path) > compacted]
+    return paths
+
+
+def compactedPaths(filename):
+    """Segments whose ops the text file already holds compacted, left
+    behind when compacting was interrupted."""
+    paths = _allSegmentPaths(filename)
+    if paths:
+        compacted = compactedSequence(filename)
+        paths = [path for path in paths if sequence(path) <= compacted]
+    return paths
+
+
+def _allSegmentPaths(filename):
+    base = filename[:-len(".nexus")]
+    return sorted(glob.glob(glob.escape(base) + ".*" + SUFFIX))
+
+
+def sequence(path):
+    return int(path.rsplit(".", 2)[-2])
+
+
+def compactedSequence(filename):
+    """The last segment compacted into a text file, by its meta data, or 0."""
+    try:
+        with open(filename, "rb") as f:
+            for line in f:
+                if not line.startswith(b"*"):
+                    break
+                if line.startswith(b"* compacted="):
+                    return int(line[len(b"* compacted="):])
+    except OSError:
+        pass
+    return 0
+
+
+def lastSequence(filename):
+    existing = _allSegmentPaths(filename)
+    return max([sequence(path) for path in existing] + [compactedSequence(filename)])
+
+
+def nextSegmentPath(filename):
+    return f"{filename[:-len('.nexus')]}.{lastSequence(filename) + 1:06d}{SUFFIX}"
+
+
+def sealedOffset(filename, paths=None):
+    """Where the ops of a device's text file that are not sealed yet start.
+
+    This is past the lines the newest of the device's segments (`paths`)
+    was sealed from while the file still starts with them, and 0 otherwise.
+    """
+    if paths is None:
+        paths = segmentPaths(filename)
+    if not paths:
+        return 0
+    source = readSource(paths[-1])
+    if source is not None and matchesFingerprint(filename, source):
+        return source["offset"]
+    return 0
+
+
+def readSource(path):
+    """The fingerprint of the text file a segment was sealed from, or None."""
+    with open(path, "rb") as f:
+        head = f.read(len(MAGIC) + 4)
+        if head[:len(MAGIC)] != MAGIC:
+            raise SegmentError(f"Not a nexus segment {path!r}")
+        length, pos = _readVarint(head, len(MAGIC))
+        f.seek(pos)
+        source = f.read(length)
+    return json.loads(source) if source else None
+
+
+def _writeVarint(out, n):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _zigzag(n):
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+
+def _readVarint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _writeString(out, string):
+    data = string.encode("utf8")
+    _writeVarint(out, len(data))
+    out += data
+
+
+def _valueType(value):
+    if isinstance(value, int):
+        return T_INT if INT_MIN <= value <= INT_MAX else T_BIGINT
+    elif isinstance(value, float):
+        return T_FLOAT
+    return T_STR
+
+
+def _shapeOf(op, data):
+    if op == 'X':
+        return tuple(data or ()), ""
+    return tuple(data), "".join(_valueType(value) for value in data.values())
+
+
+def encodeSegment(ops, source=None):
+    """Encode `(op, ts, recordId, data)` tuples, in timestamp order.
+
+    `source` is the fingerprint of the text file lines they were sealed
+    from, if any.
+    """
+    keyIndex = {}
+    idIndex = {}
+    shapeIndex = {}
+    for op, ts, recordId, data in ops:
+        idIndex.setdefault(recordId, len(idIndex))
+        shape = _shapeOf(op, data)
+        if shape not in shapeIndex:
+            shapeIndex[shape] = len(shapeIndex)
+            for key in shape[0]:
+                keyIndex.setdefault(key, len(keyIndex))
+    if len(shapeIndex) > 0xffff:
+        raise SegmentError("Too many distinct op shapes for one segment")
+
+    out = bytearray(MAGIC)
+    _writeString(out, "" if source is None else json.dumps(source, separators=(",", ":")))
+    for table in (keyIndex, idIndex):
+        _writeVarint(out, len(table))
+        for string in table:
+            _writeString(out, string)
+    _writeVarint(out, len(shapeIndex))
+    formats = []
+    for keys, types in shapeIndex:
+        _writeVarint(out, len(keys))
+        for key in keys:
+            _writeVarint(out, keyIndex[key])
+        _writeString(out, types)
+        formats.append(struct.Struct("<" + "".join(FORMATS[t] for t in types)))
+
+    body = bytearray()
+    lastTs = 0
+    for op, ts, recordId, data in ops:
+        shape = _shapeOf(op, data)
+        types = shape[1]
+        body.clear()
+        delta = _zigzag(ts - lastTs)
+        lastTs = ts
+        size = (delta.bit_length() + 7) // 8
+        body.append(size)
+        body += delta.to_bytes(size, "little")
+        if types:
+            values = []
+            strings = []
+            for t, value in zip(types, data.values()):
+                if t == T_STR:
+                    value = value.encode("utf8")
+                elif t == T_BIGINT:
+                    value = str(value).encode("ascii")
+                else:
+                    values.append(value)
+                    continue
+                values.append(len(value))
+                strings.append(value)
+            shapeIdx = shapeIndex[shape]
+            body += formats[shapeIdx].pack(*values)
+            for string in strings:
+                body += string
+        out += R_OP_HEADER.pack(
+            len(body) + R_OP_HEADER.size - 4,
+            ord(op),
+            idIndex[recordId],
+            shapeIndex[shape],
+        )
+        out += body
+    return bytes(out)
+
+
+def writeSegment(path, ops, source=None):
+    """Write a segment file atomically, so readers never see part of one."""
+    with atomicWrite(path, sync=True) as f:
+        f.write(encodeSegment(ops, source))
+
+
+class Segment:
+    """Read-only view of a sealed segment, mapped into memory."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < len(MAGIC):
+            self._file.close()
+            raise SegmentError(f"Truncated segment {path!r}")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise SegmentError(f"Not a nexus segment {path!r}")
+
+        length, pos = _readVarint(self._mmap, len(MAGIC))
+        source = self._mmap[pos:pos + length]
+        self.source = json.loads(source) if source else None
+        pos += length
+        self.keys, pos = self._readTable(pos)
+        self.ids, pos = self._readTable(pos)
+        self.shapes, pos = self._readShapes(pos)
+        self._opsStart = pos
+
+    def _readTable(self, pos):
+        buf = self._mmap
+        count, pos = _readVarint(buf, pos)
+        table = []
+        for _ in range(count):
+            length, pos = _readVarint(buf, pos)
+            table.append(buf[pos:pos + length].decode("utf8"))
+            pos += length
+        return table, pos
+
+    def _readShapes(self, pos):
+        buf = self._mmap
+        count, pos = _readVarint(buf, pos)
+        shapes = []
+        for _ in range(count):
+            keyCount, pos = _readVarint(buf, pos)
+            keys = []
+            for _ in range(keyCount):
+                keyIdx, pos = _readVarint(buf, pos)
+                keys.append(self.keys[keyIdx])
+            typeCount, pos = _readVarint(buf, pos)
+            types = buf[pos:pos + typeCount].decode("ascii")
+            pos += typeCount
+            fmt = struct.Struct("<" + "".join(FORMATS[t] for t in types))
+            strings = tuple(i for i, t in enumerate(types) if t in (T_STR, T_BIGINT))
+            bigints = tuple(i for i, t in enumerate(types) if t == T_BIGINT)
+            shapes.append((tuple(keys), fmt, strings, bigints))
+        return shapes, pos
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def iterOps(self):
+        """Yield `(op, ts, recordId, data)` like NexusFile.iterOps()."""
+        buf = self._mmap
+        ids = self.ids
+        shapes = self.shapes
+        unpackHeader = R_OP_HEADER.unpack_from
+        headerSize = R_OP_HEADER.size
+        pos = self._opsStart
+        end = len(buf)
+        ts = 0
+        while pos < end:
+            length, opCode, idIdx, shapeIdx = unpackHeader(buf, pos)
+            opEnd = pos + 4 + length
+            pos += headerSize
+
+            size = buf[pos]
+            delta = int.from_bytes(buf[pos + 1:pos + 1 + size], "little")
+            pos += 1 + size
+            ts += delta >> 1 if not delta & 1 else -((delta + 1) >> 1)
+
+            keys, fmt, strings, bigints = shapes[shapeIdx]
+            if opCode == 88:  # X
+                yield 'X', ts, ids[idIdx], list(keys)
+                pos = opEnd
+                continue
+            if strings:
+                values = list(fmt.unpack_from(buf, pos))
+                pos += fmt.size
+                for i in strings:
+                    n = values[i]
+                    values[i] = buf[pos:pos + n].decode("utf8")
+                    pos += n
+                for i in bigints:
+                    values[i] = int(values[i])
+            else:
+                values = fmt.unpack_from(buf, pos)
+            yield chr(opCode), ts, ids[idIdx], dict(zip(keys, values))
+            pos = opEnd
+
+    def iterIndex(self):
+        """Yield `(pos, ts, recordId)` for each op without decoding its values."""
+        buf = self._mmap
+        ids = self.ids
+        unpackHeader = R_OP_HEADER.unpack_from
+        pos = self._opsStart
+        end = len(buf)
+        ts = 0
+        while pos < end:
+            length, _, idIdx, _ = unpackHeader(buf, pos)
+            start = pos + R_OP_HEADER.size
+            size = buf[start]
+            delta = int.from_bytes(buf[start + 1:start + 1 + size], "little")
+            ts += delta >> 1 if not delta & 1 else -((delta + 1) >> 1)
+            yield pos, ts, ids[idIdx]
+            pos += 4 + length
+
+    def readOp(self, pos, ts):
+        """Decode the op at `pos`, as found by iterIndex(), whose time is `ts`."""
+        buf = self._mmap
+        length, opCode, idIdx, shapeIdx = R_OP_HEADER.unpack_from(buf, pos)
+        pos += R_OP_HEADER.size
+        pos += 1 + buf[pos]
+        keys, fmt, strings, bigints = self.shapes[shapeIdx]
+        if opCode == 88:  # X
+            return 'X', ts, self.ids[idIdx], list(keys)
+        values = list(fmt.unpack_from(buf, pos))
+        pos += fmt.size
+        for i in strings:
+            n = values[i]
+            values[i] = buf[pos:pos + n].decode("utf8")
+            pos += n
+        for i in bigints:
+            values[i] = int(values[i])
+        return chr(opCode), ts, self.ids[idIdx], dict(zip(keys, values))
@@ -0,0 +1,89 @@
+"""Counters and timers kept by every NexusDB, see NexusDB.stats().
+
+Timers are in seconds, from time.perf_counter(). Reading is split into
+the time spent inside each file's op stream (`parseTime`: reading and
+parsing), the rest of the merge loop (`mergeTime`) and applying the ops
+to the records (`applyTime`).
+"""
+from time import perf_counter
+
+
+class Stats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.bytesRead = {}
+        self.linesParsed = {}
+        self.parseErrors = 0
+        self.loads = 0
+        self.refreshes = 0
+        self.loadTime = 0.0
+        self.parseTime = 0.0
+        self.mergeTime = 0.0
+        self.applyTime = 0.0
+        self.recordsMaterialized = 0
+        self.writes = 0
+        self.writeTime = 0.0
+
+    def addBytes(self, path, count):
+        self.bytesRead[path] = self.bytesRead.get(path, 0) + count
+
+    def asDict(self):
+        return {
+            "loads": self.loads,
+            "refreshes": self.refreshes,
+            "bytesRead": sum(self.bytesRead.values()),
+            "linesParsed": sum(self.linesParsed.values()),
+            "parseErrors": self.parseErrors,
+            "loadTime": self.loadTime,
+            "parseTime": self.parseTime,
+            "mergeTime": self.mergeTime,
+            "applyTime": self.applyTime,
+            "recordsMaterialized": self.recordsMaterialized,
+            "writes": self.writes,
+            "writeTime": self.writeTime,
+            "files": {
+                path: {
+                    "bytesRead": self.bytesRead.get(path, 0),
+                    "linesParsed": self.linesParsed.get(path, 0),
+                }
+                for path in sorted(self.bytesRead.keys() | self.linesParsed.keys())
+            },
+        }
+
+
+def countOps(stats, path, stream):
+    """Pass through a file's op stream, counting its ops and the time spent in it."""
+    count = 0
+    spent = 0.0
+    stream = iter(stream)
+    try:
+        while True:
+            start = perf_counter()
+            for item in stream:
+                break
+            else:
+                spent += perf_counter() - start
+                return
+            spent += perf_counter() - start
+            count += 1
+            yield item
+    finally:
+        stats.linesParsed[path] = stats.linesParsed.get(path, 0) + count
+        stats.parseTime += spent
+
+
+def formatStats(stats):
+    """Render a NexusDB.stats() dict as `name<TAB>value` lines."""
+    lines = []
+    for name, value in stats.items():
+        if name == "files":
+            for path, counters in value.items():
+                for counter, count in counters.items():
+                    lines.append(f"{counter}[{path}]\t{count}")
+        elif isinstance(value, float):
+            lines.append(f"{name}\t{value:.6f}")
+        else:
+            lines.append(f"{name}\t{value}")
+    return "\n".join(lines)
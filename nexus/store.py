@@ -0,0 +1,163 @@
+"""Compact in-memory record storage, see NexusDB(compactRecords=True).
+
+A plain `Record` is a dict per record, holding its own hash table and a
+reference to every key. Here records with the same keys share one Shape,
+which holds the keys once, and a record is only its ID, its shape and a
+list of values in the shape's key order. Adding or removing a key moves
+a record to another shape, and shapes are shared between every record
+of a store that has the same keys in the same order.
+
+Records and the store itself are read-only mappings to callers, and only
+change through RecordStore.apply().
+"""
+import sys
+from collections.abc import Mapping
+
+from .file import Record
+
+
+class Shape:
+    __slots__ = ('keys', 'index', '_table', '_adding')
+
+    def __init__(self, keys, table):
+        self.keys = keys
+        self.index = {key: i for i, key in enumerate(keys)}
+        self._table = table
+        self._adding = {}
+
+    def adding(self, key):
+        shape = self._adding.get(key)
+        if shape is None:
+            shape = self._adding[key] = self._table.shape(self.keys + (sys.intern(key),))
+        return shape
+
+    def removing(self, key):
+        return self._table.shape(tuple(k for k in self.keys if k != key))
+
+
+class ShapeTable:
+    def __init__(self):
+        self._shapes = {}
+        self.empty = self.shape(())
+
+    def shape(self, keys):
+        shape = self._shapes.get(keys)
+        if shape is None:
+            shape = self._shapes[keys] = Shape(keys, self)
+        return shape
+
+    def __len__(self):
+        return len(self._shapes)
+
+
+class CompactRecord(Mapping):
+    __slots__ = ('id', '_shape', '_values')
+
+    def __init__(self, recordId, shape):
+        self.id = recordId
+        self._shape = shape
+        self._values = []
+
+    def __getitem__(self, key):
+        return self._values[self._shape.index[key]]
+
+    def get(self, key, default=None):
+        i = self._shape.index.get(key)
+        if i is None:
+            return default
+        return self._values[i]
+
+    def __contains__(self, key):
+        return key in self._shape.index
+
+    def __iter__(self):
+        return iter(self._shape.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f"CompactRecord({self.id!r}, {dict(self)!r})"
+
+    def _set(self, key, value):
+        i = self._shape.index.get(key)
+        if i is None:
+            self._shape = self._shape.adding(key)
+            self._values.append(value)
+        else:
+            self._values[i] = value
+
+    def _remove(self, key):
+        i = self._shape.index.get(key)
+        if i is not None:
+            self._shape = self._shape.removing(key)
+            del self._values[i]
+
+
+class RecordStore(Mapping):
+    """Record ID to CompactRecord, changed only by apply()."""
+
+    def __init__(self, records=None):
+        self._records = {}
+        self.shapes = ShapeTable()
+        if records:
+            for recordId, record in records.items():
+                self.apply('N', recordId, record)
+
+    def __getitem__(self, recordId):
+        return self._records[recordId]
+
+    def get(self, recordId, default=None):
+        return self._records.get(recordId, default)
+
+    def __contains__(self, recordId):
+        return recordId in self._records
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def _record(self, recordId):
+        rec = self._records.get(recordId)
+        if rec is None:
+            rec = self._records[recordId] = CompactRecord(recordId, self.shapes.empty)
+        return rec
+
+    def apply(self, op, recordId, data):
+        """Apply an op the way NexusFile.applyOperation() does to dicts."""
+        if op == 'X':
+            rec = self._records.get(recordId)
+            if rec is not None:
+                if data:
+                    for key in data:
+                        rec._remove(key)
+                else:
+                    del self._records[recordId]
+        elif op in 'NU':
+            rec = self._records.get(recordId)
+            if rec is None:
+                # Most records start with an N op, so take its keys as the
+                # shape and its values as the row in one go.
+                rec = self._records[recordId] = CompactRecord(recordId, self.shapes.shape(tuple(data)))
+                rec._values = list(data.values())
+            else:
+                for key, value in data.items():
+                    rec._set(key, value)
+        elif op == 'I':
+            rec = self._record(recordId)
+            for key, value in data.items():
+                rec._set(key, rec.get(key, 0) + value)
+        elif op == 'D':
+            rec = self._record(recordId)
+            for key, value in data.items():
+                rec._set(key, rec.get(key, 0) - value)
+
+    def toRecords(self):
+        """Copy the store into plain `Record` dicts."""
+        records = {}
+        for recordId, rec in self._records.items():
+            record = records[recordId] = Record(rec)
+            record.id = recordId
+        return records
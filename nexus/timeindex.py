@@ -0,0 +1,135 @@
+"""Sparse per-device timestamp indexes, kept in `<local device>.<device>.tsindex`
+sidecars.
+
+Device files are written in timestamp order, so the index only needs the
+byte offset and timestamp of the first op line after every STEP bytes.
+Reading the ops after a time then starts at the last indexed line that
+is not newer, instead of at the top of the file. For each sealed segment
+the index keeps the time range of its ops, so segments outside a window
+are not read at all.
+
+The index is brought up to date from the offset it covered last time,
+and rebuilt when the text file was rewritten or its segments changed.
+Each reading device has its own sidecars, like the Bloom filters.
+"""
+import bisect
+import json
+import os
+
+from . import parser, segment
+from .checkpoint import fingerprint, matchesFingerprint
+from .utils import atomicWrite
+
+
+VERSION = 1
+SUFFIX = ".tsindex"
+STEP = 64 << 10
+
+
+def sidecarPath(filename, localDevice):
+    dirname, name = os.path.split(filename)
+    return os.path.join(dirname, f"{localDevice}.{name[:-len('.nexus')]}{SUFFIX}")
+
+
+class TimeIndex:
+    def __init__(self, filename, localDevice):
+        self.filename = filename
+        self.path = sidecarPath(filename, localDevice)
+        self.clear()
+
+    def clear(self):
+        self.file = None
+        self.offsets = []
+        self.timestamps = []
+        self.segments = {}
+
+    @classmethod
+    def load(cls, filename, localDevice):
+        """Load `localDevice`'s sidecar of `filename`, or an empty index if it
+        can't be read."""
+        index = cls(filename, localDevice)
+        try:
+            with open(index.path, "r", encoding="utf8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        if data.get("version") != VERSION:
+            return index
+        index.file = data["file"]
+        index.offsets = data["offsets"]
+        index.timestamps = data["timestamps"]
+        index.segments = data["segments"]
+        return index
+
+    def save(self):
+        data = {
+            "version": VERSION,
+            "file": self.file,
+            "offsets": self.offsets,
+            "timestamps": self.timestamps,
+            "segments": self.segments,
+        }
+        with atomicWrite(self.path, "w", encoding="utf8", cache=True) as f:
+            json.dump(data, f, separators=(",", ":"))
+
+    def update(self):
+        """Index the lines appended since the last update.
+
+        Returns True if the index changed.
+        """
+        segmentPaths = segment.segmentPaths(self.filename)
+        names = [os.path.basename(path) for path in segmentPaths]
+        exists = os.path.exists(self.filename)
+        changed = False
+        if sorted(self.segments) != names or (
+            self.file is not None and not (exists and matchesFingerprint(self.filename, self.file))
+        ):
+            self.clear()
+            for path in segmentPaths:
+                self.segments[os.path.basename(path)] = _segmentRange(path)
+            changed = True
+        if not exists:
+            return changed
+        offset = self.file["offset"] if self.file else segment.sealedOffset(self.filename, segmentPaths)
+        if self.file is not None and os.path.getsize(self.filename) <= offset:
+            return changed
+        self.file = fingerprint(self.filename, self._indexFile(offset))
+        return True
+
+    def _indexFile(self, offset):
+        with open(self.filename, "rb") as f:
+            f.seek(offset)
+            buf = f.read()
+        end = buf.rfind(b"\n") + 1
+        nextOffset = self.offsets[-1] + STEP if self.offsets else 0
+        pos = max(0, nextOffset - offset)
+        while pos < end:
+            m = parser.B_OP_LINE.search(buf, pos, end)
+            if m is None:
+                break
+            self.offsets.append(offset + m.start())
+            self.timestamps.append(int(m.group(2)))
+            pos = m.start() + STEP
+        return offset + end
+
+    def startOffset(self, since):
+        """Where to start reading the text file for the ops newer than `since`."""
+        i = bisect.bisect_right(self.timestamps, since) - 1
+        return self.offsets[i] if i >= 0 else 0
+
+    def segmentInRange(self, path, since=None, until=None):
+        """Whether a segment may have ops newer than `since` and not newer than `until`."""
+        first, last = self.segments.get(os.path.basename(path), (None, None))
+        if first is None:
+            return True
+        return (since is None or last > since) and (until is None or first <= until)
+
+
+def _segmentRange(path):
+    first = last = None
+    with segment.Segment(path) as seg:
+        for _, ts, _ in seg.iterIndex():
+            if first is None:
+                first = ts
+            last = ts
+    return [first, last]
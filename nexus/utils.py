@@ -1,9 +1,96 @@
+import os
+from contextlib import contextmanager
 from time import time_ns
-from datetime import datetime
 
 
 def timestamp():
     return time_ns()
 
 def from_timestamp():
+    from datetime import datetime
+
     return datetime.fromtimestamp(int(1_000_000_000))
+
+
+_deviceId = None
+
+
+def configDir():
+    base = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "nexus")
+
+
+def deviceId():
+    """This machine's device identifier: the node uuid.uuid1() uses, in hex.
+
+    uuid.getnode() can be slow, so the result is cached per host in the
+    user's config directory (`$XDG_CONFIG_HOME/nexus/devices`). Hosts are
+    told apart by name in case that directory is itself synced.
+    """
+    global _deviceId
+    if _deviceId is not None:
+        return _deviceId
+    host = os.uname().nodename if hasattr(os, "uname") else os.environ.get("COMPUTERNAME", "")
+    path = os.path.join(configDir(), "devices")
+    devices = {}
+    try:
+        with open(path, encoding="utf8") as f:
+            for line in f:
+                name, _, device = line.rstrip("\n").rpartition("\t")
+                devices[name] = device
+    except OSError:
+        pass
+    device = devices.get(host)
+    if not device or len(device) != 12:
+        import uuid
+
+        device = str(uuid.uuid1(uuid.getnode(), 0))[24:]
+        devices[host] = device
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf8") as f:
+                f.writelines(f"{name}\t{value}\n" for name, value in devices.items())
+            os.replace(tmp, path)
+        except OSError:
+            pass
+    _deviceId = device
+    return device
+
+
+@contextmanager
+def atomicWrite(path, mode="wb", encoding=None, sync=False, cache=False):
+    """Write `path` through a temporary file that replaces it at the end.
+
+    The temporary file has a unique name next to `path`, so processes and
+    threads writing the same file at once don't get in each other's way,
+    and readers see the old file or one of the new ones, never part of
+    one. With `sync` the data is on disk before the rename. With `cache`
+    a rename that fails is left at that: the file can always be rebuilt,
+    and another process has most likely just saved the same data.
+    """
+    import uuid
+
+    tmp = f"{path}.{uuid.uuid4().hex[:12]}.tmp"
+    try:
+        with open(tmp, mode, encoding=encoding) as f:
+            yield f
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+    except BaseException:
+        _removeQuietly(tmp)
+        raise
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        _removeQuietly(tmp)
+        if not cache:
+            raise
+
+
+def _removeQuietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,70 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import threading
+
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+
+def openInotify(dirname):
+    """Return an inotify file descriptor watching `dirname`, or None."""
+    name = ctypes.util.find_library("c")
+    if name is None:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    if libc.inotify_add_watch(fd, os.fsencode(dirname), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class Watcher(threading.Thread):
+    """Background thread that calls NexusDB.refresh() when files change."""
+
+    def __init__(self, db, interval=1.0):
+        super().__init__(daemon=True)
+        self.db = db
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+        if threading.current_thread() is not self:
+            self.join()
+
+    def run(self):
+        fd = openInotify(self.db.dirname)
+        try:
+            while not self._stopped.is_set():
+                self._wait(fd)
+                if not self._stopped.is_set():
+                    self.db.refresh()
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _wait(self, fd):
+        if fd is None:
+            self._stopped.wait(self.interval)
+            return
+        readable, _, _ = select.select([fd], [], [], self.interval)
+        if readable:
+            try:
+                while os.read(fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
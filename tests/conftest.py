@@ -0,0 +1,10 @@
+import pytest
+
+from nexus import utils
+
+
+@pytest.fixture(autouse=True)
+def configDir(tmp_path, monkeypatch):
+    """Keep the cached device ID out of the real ~/.config."""
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "config"))
+    monkeypatch.setattr(utils, "_deviceId", None)
@@ -0,0 +1,75 @@
+import asyncio
+import os
+from tempfile import TemporaryDirectory
+
+from nexus.aio import AsyncNexusDB
+
+
+def test_async_db():
+    async def run(tempdir):
+        adb = AsyncNexusDB(tempdir)
+        await adb.set("todo-1", {"task": "one", "prio": "2"})
+        async with adb.batch() as batch:
+            await batch.set("todo-2", {"task": "two"})
+            await batch.inc("todo-1", {"prio": "3"})
+        await adb.load()
+        assert await adb.get("todo-1", "prio") == 5
+        assert await adb.query("prio>1", fields=["task"]) == [("todo-1", ("one",))]
+
+        changes = adb.changes(interval=0.05)
+        waiting = asyncio.ensure_future(changes.__anext__())
+        await asyncio.sleep(0.1)
+        with open(os.path.join(tempdir, "other.nexus"), "a") as f:
+            f.write('N 99999999999999999999 todo-3 task="three"\n')
+        assert await asyncio.wait_for(waiting, 5) == {"todo-3"}
+        await changes.aclose()
+        assert adb.db._watcher is None
+        assert (await adb.get("todo-3"))["task"] == "three"
+
+    with TemporaryDirectory() as tempdir:
+        asyncio.run(run(tempdir))
+
+
+def test_get_before_load_runs_in_executor():
+    from concurrent.futures import ThreadPoolExecutor
+
+    class CountingExecutor(ThreadPoolExecutor):
+        submitted = 0
+
+        def submit(self, *args, **kwargs):
+            self.submitted += 1
+            return super().submit(*args, **kwargs)
+
+    async def run(tempdir, executor):
+        adb = AsyncNexusDB(tempdir, executor=executor)
+        await adb.set("todo-1", {"task": "one"})
+        before = executor.submitted
+        assert await adb.get("todo-1", "task") == "one"
+        assert executor.submitted == before + 1
+
+    with TemporaryDirectory() as tempdir, CountingExecutor(1) as executor:
+        asyncio.run(run(tempdir, executor))
+
+
+def test_changes_stops_watch_in_executor(monkeypatch):
+    import threading
+    from nexus.db import WatchHandle
+
+    stoppedIn = []
+    stop = WatchHandle.stop
+    monkeypatch.setattr(WatchHandle, "stop", lambda handle: stoppedIn.append(threading.current_thread()) or stop(handle))
+
+    async def run(tempdir):
+        adb = AsyncNexusDB(tempdir)
+        changes = adb.changes(interval=0.05)
+        waiting = asyncio.ensure_future(changes.__anext__())
+        await asyncio.sleep(0.1)
+        # Cancelling the waiting consumer ends the generator too.
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        await changes.aclose()
+        assert adb.db._watcher is None
+
+    with TemporaryDirectory() as tempdir:
+        asyncio.run(run(tempdir))
+    assert len(stoppedIn) == 1 and stoppedIn[0] is not threading.main_thread()
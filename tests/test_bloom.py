@@ -0,0 +1,62 @@
+import os
+from tempfile import TemporaryDirectory
+
+from nexus import bloom
+from nexus.segment import writeSegment
+
+
+def _writeLines(path, *lines):
+    with open(path, "a", encoding="utf8") as f:
+        for line in lines:
+            f.write(line + "\n")
+
+
+def test_filter_has_no_false_negatives():
+    f = bloom.BloomFilter(1000)
+    keys = [f"rec-{n}".encode() for n in range(1000)]
+    assert f.update(keys) > 980
+    assert all(key in f for key in keys)
+    assert f.update(keys) == 0
+    falsePositives = sum(f"other-{n}".encode() in f for n in range(10_000))
+    assert falsePositives < 300
+
+
+def test_device_filter_updates_and_persists():
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "1.nexus")
+        _writeLines(path, "* format=nexus", 'N 100 a foo="x"', "I 200 b n=1")
+
+        deviceFilter = bloom.DeviceFilter.load(path, "me")
+        assert deviceFilter.update()
+        deviceFilter.save()
+        assert not deviceFilter.update()
+        assert deviceFilter.mayContain("a") and deviceFilter.mayContain("b")
+        assert not deviceFilter.mayContain("c")
+
+        _writeLines(path, "X 300 c")
+        deviceFilter = bloom.DeviceFilter.load(path, "me")
+        assert deviceFilter.count == 2
+        assert deviceFilter.update()
+        assert deviceFilter.count == 3
+        assert deviceFilter.mayContain("c")
+
+
+def test_device_filter_rebuilds():
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "1.nexus")
+        _writeLines(path, 'N 100 a foo="x"')
+        deviceFilter = bloom.DeviceFilter(path, "me")
+        deviceFilter.update()
+
+        # Sealing moves the ops into a segment and rewrites the file.
+        writeSegment(os.path.join(tempdir, "1.000001.nxseg"), [("N", 100, "a", {"foo": "x"})])
+        with open(path, "w", encoding="utf8") as f:
+            f.write('N 200 b foo="y"\n')
+        assert deviceFilter.update()
+        assert deviceFilter.mayContain("a") and deviceFilter.mayContain("b")
+
+        # Growing past its capacity resizes the filter.
+        _writeLines(path, *(f"N 300 rec-{n} n=1" for n in range(2 * bloom.MIN_CAPACITY)))
+        deviceFilter.update()
+        assert deviceFilter.filter.capacity > bloom.MIN_CAPACITY
+        assert all(deviceFilter.mayContain(f"rec-{n}") for n in range(2 * bloom.MIN_CAPACITY))
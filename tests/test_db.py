@@ -2,8 +2,11 @@ import os
 import re
 from tempfile import TemporaryDirectory
 
+import pytest
+
 from nexus.file import Record, NexusFile
 from nexus.db import NexusDB
+from nexus.parser import ParserError
 
 def test_single_db_entry():
     with TemporaryDirectory() as tempdir:
@@ -56,4 +59,758 @@ def test_db_record_write():
 
         db = NexusDB(tempdir)
         db.readAll()
-        assert db.get("ID-1", "name") == "Bobby Tables"
\ No newline at end of file
+        assert db.get("ID-1", "name") == "Bobby Tables"
+
+def test_empty_and_header_only_files():
+    with TemporaryDirectory() as tempdir:
+        open(os.path.join(tempdir, "1.nexus"), "w").close()
+
+        f = open(os.path.join(tempdir, "2.nexus"), "w")
+        f.write('* format=nexus\n')
+        f.write('* version=0\n')
+        f.write('N 10 1 foo="bar"\n')
+        f.close()
+
+        db = NexusDB(tempdir)
+        db.readAll()
+        assert db.get("1", "foo") == "bar"
+
+
+def test_merge_many_files():
+    with TemporaryDirectory() as tempdir:
+        for n in range(50):
+            f = open(os.path.join(tempdir, f"{n:02}.nexus"), "w")
+            for ts in range(n, 1000, 50):
+                f.write(f'N {ts} 1 last={ts}\n')
+                f.write(f'I {ts} 1 count=1\n')
+            f.close()
+
+        db = NexusDB(tempdir)
+        db.readAll()
+        assert db.get("1", "last") == 999
+        assert db.get("1", "count") == 1000
+
+
+def test_merge_tie_break_by_file_name():
+    with TemporaryDirectory() as tempdir:
+        for name in ("b", "a", "c"):
+            f = open(os.path.join(tempdir, f"{name}.nexus"), "w")
+            f.write(f'N 100 1 foo="{name}"\n')
+            f.close()
+
+        db = NexusDB(tempdir)
+        db.readAll()
+        assert db.get("1", "foo") == "c"
+
+
+def _writeLines(path, *lines, mode="a"):
+    with open(path, mode) as f:
+        for line in lines:
+            f.write(line + "\n")
+
+
+def test_checkpoint_replays_only_tail():
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "1.nexus")
+        _writeLines(path, 'N 100 1 foo="a"', 'I 200 1 count=5')
+
+        db = NexusDB(tempdir, checkpointEvery=1)
+        db.readAll()
+        assert os.path.exists(db._checkpoint_path)
+
+        _writeLines(path, 'I 300 1 count=2')
+        db = NexusDB(tempdir, checkpointEvery=1)
+        db.readAll()
+        assert db._replayed == 1
+        assert db.get("1", "foo") == "a"
+        assert db.get("1", "count") == 7
+
+
+def test_checkpoint_ignored_when_file_rewritten():
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "1.nexus")
+        _writeLines(path, 'N 100 1 foo="a"')
+
+        db = NexusDB(tempdir, checkpointEvery=1)
+        db.readAll()
+
+        _writeLines(path, 'N 100 1 foo="b"', 'N 200 2 foo="c"', mode="w")
+        db = NexusDB(tempdir, checkpointEvery=1)
+        db.readAll()
+        assert db._replayed == 2
+        assert db.get("1", "foo") == "b"
+        assert db.get("2", "foo") == "c"
+
+
+def test_checkpoint_ignored_for_late_synced_ops():
+    with TemporaryDirectory() as tempdir:
+        _writeLines(os.path.join(tempdir, "1.nexus"), 'N 300 1 foo="new"')
+
+        db = NexusDB(tempdir, checkpointEvery=1)
+        db.readAll()
+
+        _writeLines(os.path.join(tempdir, "2.nexus"), 'N 200 1 foo="old"')
+        db = NexusDB(tempdir, checkpointEvery=1)
+        db.readAll()
+        assert db._replayed == 2
+        assert db.get("1", "foo") == "new"
+
+
+def test_refresh_applies_appended_ops():
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "1.nexus")
+        _writeLines(path, 'N 100 1 foo="a"', 'N 100 2 foo="b"')
+
+        db = NexusDB(tempdir)
+        db.readAll()
+        assert db.refresh() == set()
+
+        _writeLines(path, 'U 200 2 foo="c"')
+        _writeLines(os.path.join(tempdir, "2.nexus"), 'N 300 3 foo="d"')
+        assert db.refresh() == {"2", "3"}
+        assert db.get("2", "foo") == "c"
+        assert db.get("3", "foo") == "d"
+
+
+def test_refresh_waits_for_complete_lines():
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "1.nexus")
+        _writeLines(path, 'N 100 1 count=1')
+
+        db = NexusDB(tempdir)
+        db.readAll()
+
+        with open(path, "a") as f:
+            f.write('I 200 1 count=')
+        assert db.refresh() == set()
+
+        with open(path, "a") as f:
+            f.write('5\n')
+        assert db.refresh() == {"1"}
+        assert db.get("1", "count") == 6
+
+
+def test_refresh_reloads_out_of_order_ops():
+    with TemporaryDirectory() as tempdir:
+        _writeLines(os.path.join(tempdir, "1.nexus"), 'N 300 1 foo="new"', 'N 300 2 foo="x"')
+
+        db = NexusDB(tempdir)
+        db.readAll()
+        _writeLines(os.path.join(tempdir, "2.nexus"), 'N 200 1 foo="old"', 'N 200 2 bar="y"')
+        assert db.refresh() == {"2"}
+        assert db.get("1", "foo") == "new"
+        assert db.get("2", "bar") == "y"
+
+
+def test_watch_calls_back_with_changed_ids():
+    import queue
+
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "1.nexus")
+        _writeLines(path, 'N 100 1 foo="a"')
+
+        db = NexusDB(tempdir)
+        db.readAll()
+        changes = queue.Queue()
+        watcher = db.watch(changes.put, interval=0.05)
+        try:
+            _writeLines(path, 'U 200 1 foo="b"')
+            assert changes.get(timeout=5) == {"1"}
+            assert db.get("1", "foo") == "b"
+        finally:
+            watcher.stop()
+
+
+def test_record_ids_cached_until_file_changes():
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "1.nexus")
+        _writeLines(path, 'N 100 1 foo="a"')
+        _writeLines(os.path.join(tempdir, "2.nexus"), 'N 100 2 foo="b"', 'X 200 2')
+
+        db = NexusDB(tempdir)
+        assert db.getRecordIds() == {"1"}
+        state = db._fileStates[path]
+        assert db.getRecordIds() == {"1"}
+        assert db._fileStates[path] is state
+
+        _writeLines(path, 'N 200 3 foo="c"')
+        assert db.getRecordIds() == {"1", "3"}
+        assert [rec["foo"] for rec in db.findAllOfRecordsEntries("3")] == ["c"]
+
+
+def test_read_record_skips_devices_without_it():
+    with TemporaryDirectory() as tempdir:
+        _writeLines(os.path.join(tempdir, "1.nexus"), 'N 100 a foo="x" n=1', 'N 150 b foo="y"', 'I 300 a n=2')
+        _writeLines(os.path.join(tempdir, "2.nexus"), 'U 200 a bar="z"', 'X 250 a foo')
+        _writeLines(os.path.join(tempdir, "3.nexus"), *(f'N {n} c-{n} n=1' for n in range(100)))
+
+        db = NexusDB(tempdir)
+        assert db.readRecord("a") == {"n": 3, "bar": "z"}
+        assert db.readRecord("missing") is None
+        assert os.path.exists(os.path.join(tempdir, f"{db._device}.3.bloom"))
+        assert [path for path in db._filesWith("a")] == [
+            os.path.join(tempdir, "1.nexus"), os.path.join(tempdir, "2.nexus"),
+        ]
+        assert db.findAllOfRecordsEntries("c-5") == [{"n": 1}]
+        assert os.path.join(tempdir, "1.nexus") not in db._fileStates
+
+
+def test_read_records_updates_indexes_once(monkeypatch):
+    from nexus import offsets
+
+    with TemporaryDirectory() as tempdir:
+        _writeLines(os.path.join(tempdir, "1.nexus"), 'N 100 a foo="x" n=1', 'N 150 b foo="y"', 'I 300 a n=2')
+        _writeLines(os.path.join(tempdir, "2.nexus"), 'U 200 a bar="z"', 'X 250 b')
+
+        db = NexusDB(tempdir)
+        updates = []
+        update = offsets.OffsetIndex.update
+        monkeypatch.setattr(offsets.OffsetIndex, "update", lambda index: updates.append(index.filename) or update(index))
+        assert db.readRecords(["a", "b", "missing"]) == {"a": {"foo": "x", "n": 3, "bar": "z"}}
+        assert sorted(updates) == [os.path.join(tempdir, "1.nexus"), os.path.join(tempdir, "2.nexus")]
+        assert db.readRecords(["a"]) == {"a": db.readRecord("a")}
+
+
+def test_get_reads_record_before_load():
+    with TemporaryDirectory() as tempdir:
+        _writeLines(os.path.join(tempdir, "1.nexus"), 'N 100 a foo="x" n=1', 'N 150 b foo="y"')
+        db = NexusDB(tempdir)
+        db.set("a", {"bar": "z"})
+        db.inc("a", {"n": 2})
+        assert db.get("a") == {"foo": "x", "n": 3, "bar": "z"}
+        assert db.get("b", "foo") == "y"
+        assert db.get("c") is None
+        assert os.path.exists(os.path.join(tempdir, f"{db._device}.1.offsets"))
+
+
+def test_get_reads_last_line_like_read_all():
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "1.nexus")
+        _writeLines(path, 'N 100 a n=1', 'N 150 b foo="y"')
+        with open(path, "a") as f:
+            f.write('I 200 a n=2')
+        with open(os.path.join(tempdir, "2.nexus"), "w") as f:
+            f.write('N 300 c foo="z"')
+
+        for recordId in ("a", "c"):
+            db = NexusDB(tempdir)
+            before = db.get(recordId)
+            db.readAll()
+            assert db.get(recordId) == before
+        assert before == {"foo": "z"}
+
+        # The indexes catch up once the line is continued.
+        with open(path, "a") as f:
+            f.write('0\nN 400 d foo="w"\n')
+        db = NexusDB(tempdir)
+        assert db.readRecords(["a", "d"]) == {"a": {"n": 21}, "d": {"foo": "w"}}
+        db.readAll()
+        assert db.get("a") == {"n": 21}
+
+
+def test_batch_writes():
+    from nexus.file import Durability
+
+    with TemporaryDirectory() as tempdir:
+        db = NexusDB(tempdir)
+        for durability in Durability:
+            with db.batch(durability=durability) as b:
+                for n in range(100):
+                    b.set(f"{durability.name}-{n}", {"n": n})
+                b.inc(f"{durability.name}-0", {"n": 5})
+                b.delete(f"{durability.name}-1")
+
+        db = NexusDB(tempdir)
+        db.readAll()
+        for durability in Durability:
+            assert db.get(f"{durability.name}-0", "n") == 5
+            assert db.get(f"{durability.name}-1") is None
+            assert db.get(f"{durability.name}-99", "n") == 99
+
+
+def test_set_many():
+    with TemporaryDirectory() as tempdir:
+        db = NexusDB(tempdir)
+        assert db.setMany((f"rec-{n}", {"n": n, "s": f"line\\{n}\n"}) for n in range(50)) == 50
+        with db.batch() as b:
+            b.setMany({"rec-0": {"n": 100}})
+        assert db.stats()["writes"] == 51
+
+        db = NexusDB(tempdir)
+        db.readAll()
+        assert len(db.records) == 50
+        assert db.get("rec-0") == {"n": 100, "s": "line\\0\n"}
+        assert db.get("rec-49", "s") == "line\\49\n"
+
+
+def test_seal_keeps_state_and_text_tail():
+    from nexus.segment import segmentPaths
+
+    with TemporaryDirectory() as tempdir:
+        db = NexusDB(tempdir, checkpointEvery=1)
+        _writeLines(db._write_file_path, 'N 100 1 foo="a" n=1', 'I 200 1 n=2', 'N 300 2 foo="b"')
+        _writeLines(os.path.join(tempdir, "other.nexus"), 'N 250 3 foo="c"')
+        db.readAll()
+
+        path = db.seal(before=300)
+        assert segmentPaths(db._write_file_path) == [path]
+        lines = open(db._write_file_path).read().splitlines()
+        assert [line for line in lines if not line.startswith("*")] == ['N 300 2 foo="b"']
+
+        db = NexusDB(tempdir, checkpointEvery=1)
+        db.readAll()
+        assert db._replayed == 4
+        assert db.get("1") == {"foo": "a", "n": 3}
+        assert db.get("2", "foo") == "b"
+        assert db.get("3", "foo") == "c"
+        assert db.getRecordIds() == {"1", "2", "3"}
+
+        assert db.seal() is not None
+        assert db.seal() is None
+        db = NexusDB(tempdir)
+        db.readAll()
+        assert db.get("1") == {"foo": "a", "n": 3}
+        assert db.get("2", "foo") == "b"
+
+
+def test_interrupted_seal_is_not_replayed_twice(monkeypatch):
+    from nexus import db as dbModule
+    from nexus.segment import segmentPaths
+
+    with TemporaryDirectory() as tempdir:
+        db = NexusDB(tempdir)
+        _writeLines(db._write_file_path, 'N 100 1 foo="a" n=1', 'I 200 1 n=2', 'D 300 2 n=1', 'N 400 2 foo="b"')
+        _writeLines(os.path.join(tempdir, "other.nexus"), 'I 250 1 n=5')
+
+        def crash(*args):
+            raise KeyboardInterrupt
+        monkeypatch.setattr(dbModule, "replaceFile", crash)
+        with pytest.raises(KeyboardInterrupt):
+            db.seal(before=400)
+        monkeypatch.undo()
+        assert len(segmentPaths(db._write_file_path)) == 1
+
+        # The text file still starts with the sealed lines, which are skipped.
+        expected = {"1": {"foo": "a", "n": 8}, "2": {"n": -1, "foo": "b"}}
+        own = {"foo": "a", "n": 3}
+        timestamps = [100, 200, 250, 300, 400]
+        for ts in (500, 600):
+            db = NexusDB(tempdir)
+            assert db.readRecord("1") == expected["1"]
+            assert [op[1] for op in db.iterOps()] == timestamps
+            assert [op[1] for op in db.iterOps(since=150, until=300)] == [200, 250, 300]
+            assert [change[0] for change in db.history("1", "n")] == [t for t in timestamps if t not in (300, 400)]
+            assert own in db.findAllOfRecordsEntries("1")
+            assert db.asOf(300) == {"1": {"foo": "a", "n": 8}, "2": {"n": -1}}
+            db.readAll()
+            assert db.records == expected
+            # Appending after the sealed lines still works.
+            _writeLines(db._write_file_path, f'I {ts} 1 n=1')
+            expected["1"]["n"] += 1
+            own["n"] += 1
+            timestamps.append(ts)
+
+        # The next seal drops them from the text file first.
+        db.seal()
+        assert len(segmentPaths(db._write_file_path)) == 2
+        db = NexusDB(tempdir)
+        db.readAll()
+        assert db.records == expected
+
+
+def test_compact_ops():
+    from nexus.db import compactOps
+
+    ops = [
+        ('N', 1, 'a', {'x': 1, 'y': 'one'}),
+        ('I', 2, 'a', {'x': 5, 'n': 2}),
+        ('D', 3, 'a', {'n': 1}),
+        ('U', 4, 'a', {'y': 'two'}),
+        ('X', 5, 'a', ['z']),
+        ('N', 6, 'b', {'x': 1}),
+        ('X', 7, 'b', []),
+        ('I', 8, 'b', {'x': 3}),
+        ('N', 9, 'c', {'x': 1}),
+        ('X', 10, 'c', []),
+    ]
+    assert compactOps(ops) == [
+        ('N', 2, 'a', {'x': 6}),
+        ('I', 3, 'a', {'n': 1}),
+        ('N', 4, 'a', {'y': 'two'}),
+        ('X', 5, 'a', ['z']),
+        ('X', 7, 'b', []),
+        ('N', 8, 'b', {'x': 3}),
+        ('X', 10, 'c', []),
+    ]
+
+    # Keys written at the same time share an op, and records that only
+    # lost keys still exist.
+    ops = [
+        ('N', 1, 'a', {'x': 1, 'y': 2}),
+        ('I', 2, 'a', {'n': 1}),
+        ('D', 3, 'a', {'n': 1}),
+        ('X', 4, 'a', ['x', 'y']),
+        ('U', 5, 'b', {'x': 1}),
+        ('X', 6, 'b', ['x']),
+    ]
+    assert compactOps(ops) == [
+        ('I', 3, 'a', {'n': 0}),
+        ('X', 4, 'a', ['x', 'y']),
+        ('N', 5, 'b', {}),
+        ('X', 6, 'b', ['x']),
+    ]
+
+
+def test_compact_rewrites_own_file():
+    with TemporaryDirectory() as tempdir:
+        db = NexusDB(tempdir, checkpointEvery=None)
+        for n in range(20):
+            db.set("counter", {"name": "hits"})
+            db.inc("counter", {"count": n})
+        db.set("gone", {"x": 1})
+        db.delete("gone")
+        db.seal()
+        db.inc("counter", {"count": 10})
+        db.dec("counter", {"count": 1})
+
+        db.readAll()
+        expected = dict(db.records)
+
+        assert db.compact(archive=True) == (44, 3)
+        assert not any(name.endswith(".nxseg") for name in os.listdir(tempdir))
+        archives = [name for name in os.listdir(tempdir) if name.endswith(".archive")]
+        assert len(archives) == 1
+
+        db = NexusDB(tempdir, checkpointEvery=None)
+        db.readAll()
+        assert db.records == expected
+        assert db.get("counter", "count") == sum(range(20)) + 9
+
+        lines = [line for line in open(db._write_file_path) if not line.startswith("*")]
+        assert len(lines) == 3
+
+
+def test_compact_with_other_devices():
+    with TemporaryDirectory() as tempdir:
+        db = NexusDB(tempdir, checkpointEvery=None)
+        _writeLines(
+            db._write_file_path,
+            'N 1 r x=1', 'I 2 s n=1', 'I 3 s n=2', 'I 10 r c=1', 'U 20 r y=3',
+            'I 30 r c=1', 'N 40 t a=1', 'U 50 t b=2',
+        )
+        other = os.path.join(tempdir, "other.nexus")
+        _writeLines(other, 'N 5 r x=2', 'N 15 r c=100', 'N 60 s n=7')
+        db = NexusDB(tempdir, checkpointEvery=None)
+        db.readAll()
+        expected = db.records
+        assert expected["r"] == {"x": 2, "c": 101, "y": 3}
+
+        # r is left alone, as the other device wrote to it in between.
+        assert db.compact() == (8, 7)
+        db = NexusDB(tempdir, checkpointEvery=None)
+        db.readAll()
+        assert db.records == expected
+
+        # Keys keep the time they were written at, so ops synced in late
+        # still land between them.
+        _writeLines(other, 'N 45 t a=5')
+        db.readAll()
+        assert db.records["t"] == {"a": 5, "b": 2}
+
+
+def test_interrupted_compact_is_not_replayed_twice(monkeypatch):
+    from nexus.segment import segmentPaths
+
+    with TemporaryDirectory() as tempdir:
+        db = NexusDB(tempdir, checkpointEvery=None)
+        _writeLines(db._write_file_path, 'N 1 a n=1', 'I 2 a n=2')
+        db.seal()
+        _writeLines(db._write_file_path, 'I 3 a n=4')
+        db.seal()
+        _writeLines(db._write_file_path, 'D 4 a n=1')
+
+        def crash(path):
+            raise KeyboardInterrupt
+        monkeypatch.setattr(os, "remove", crash)
+        with pytest.raises(KeyboardInterrupt):
+            db.compact()
+        monkeypatch.undo()
+
+        # The text file holds the compacted segments, which are ignored.
+        assert len(os.listdir(tempdir)) > 1 and segmentPaths(db._write_file_path) == []
+        db = NexusDB(tempdir, checkpointEvery=None)
+        assert db.readRecord("a") == {"n": 6}
+        db.readAll()
+        assert db.records == {"a": {"n": 6}}
+
+        # New segments are numbered after them, and the next seal removes them.
+        _writeLines(db._write_file_path, 'I 5 a n=1')
+        path = db.seal()
+        assert path.endswith(".000003.nxseg")
+        assert [name for name in os.listdir(tempdir) if name.endswith(".nxseg")] == [os.path.basename(path)]
+        db.readAll()
+        assert db.records == {"a": {"n": 7}}
+
+
+def test_parallel_read_matches_serial():
+    with TemporaryDirectory() as tempdir:
+        for n in range(4):
+            lines = []
+            for ts in range(n, 2000, 4):
+                lines.append(f'N {ts} r{ts % 37} name="file {n}" last={ts}')
+                lines.append(f'I {ts} r{ts % 11} count={n + 1}')
+                if ts % 50 == 0:
+                    lines.append(f'X {ts} r{ts % 37}')
+            _writeLines(os.path.join(tempdir, f"{n}.nexus"), *lines)
+
+        serial = NexusDB(tempdir, checkpointEvery=None)
+        serial.readAll()
+
+        db = NexusDB(tempdir, checkpointEvery=None)
+        db.parallelChunkSize = 4096
+        db.readAll(workers=2)
+        assert db.records == serial.records
+        assert db._offsets == serial._offsets
+
+
+def test_query():
+    with TemporaryDirectory() as tempdir:
+        db = NexusDB(tempdir)
+        db.set("todo-1", {"task": "Write docs", "prio": "3"})
+        db.set("todo-2", {"task": "Fix parser", "prio": "5"})
+        db.readAll()
+        assert list(db.query("prio>4", fields=["task"])) == [("todo-2", ("Fix parser",))]
+        assert [recordId for recordId, _ in db.query(orderBy="prio", descending=True, limit=1)] == ["todo-2"]
+
+
+def test_iter_ops_and_records():
+    with TemporaryDirectory() as tempdir:
+        _writeLines(
+            os.path.join(tempdir, "a.nexus"),
+            'N 1 todo-1 task="one" prio=1',
+            'N 4 note-1 text="hi"',
+            'X 6 todo-1 prio',
+        )
+        _writeLines(
+            os.path.join(tempdir, "b.nexus"),
+            'I 2 todo-2 count=2',
+            'U 5 todo-1 prio=3 done=0',
+        )
+        db = NexusDB(tempdir)
+        assert [ts for _, ts, _, _ in db.iterOps()] == [1, 2, 4, 5, 6]
+        assert [ts for _, ts, _, _ in db.iterOps(since=4)] == [5, 6]
+
+        streamed = list(db.iterRecords(prefix="todo", keys=["prio", "count"]))
+        assert streamed == [{}, {"count": 2}]
+        assert [record.id for record in streamed] == ["todo-1", "todo-2"]
+
+        db.readAll()
+        assert db.records == {rec.id: rec for rec in db.iterRecords()} == {
+            "todo-1": {"task": "one", "done": 0},
+            "todo-2": {"count": 2},
+            "note-1": {"text": "hi"},
+        }
+        assert list(db.iterRecords(prefix="todo", keys=["prio", "count"])) == streamed
+
+
+def test_iter_ops_time_window(monkeypatch):
+    from nexus import timeindex
+    from nexus.segment import writeSegment
+
+    monkeypatch.setattr(timeindex, "STEP", 64)
+    with TemporaryDirectory() as tempdir:
+        writeSegment(os.path.join(tempdir, "a.000001.nxseg"), [("N", 5, "old", {"n": 1})])
+        _writeLines(os.path.join(tempdir, "a.nexus"), *(f"N {n} a-{n} n={n}" for n in range(10, 300, 2)))
+        _writeLines(os.path.join(tempdir, "b.nexus"), *(f"U {n} b-{n % 5} n={n}" for n in range(11, 300, 3)))
+
+        db = NexusDB(tempdir)
+        everything = list(db.iterOps())
+        for since, until in [(None, 100), (100, None), (150, 160), (0, 4), (298, None), (4, 10)]:
+            expected = [
+                op for op in everything
+                if (since is None or op[1] > since) and (until is None or op[1] <= until)
+            ]
+            assert list(db.iterOps(since, until)) == expected
+
+        index = db._timeIndexes[os.path.join(tempdir, "a.nexus")]
+        assert len(index.offsets) > 10
+        assert index.startOffset(150) > 0
+        assert not index.segmentInRange(os.path.join(tempdir, "a.000001.nxseg"), since=5)
+
+        # Appends are indexed from where the last update stopped.
+        _writeLines(os.path.join(tempdir, "a.nexus"), *(f"N {n} a-{n} n={n}" for n in range(300, 400)))
+        assert [op[1] for op in db.iterOps(since=390)] == list(range(391, 400))
+        assert timeindex.TimeIndex.load(index.filename, db._device).offsets == index.offsets
+
+
+def test_concurrent_readers(monkeypatch):
+    import threading
+    from nexus import timeindex
+
+    monkeypatch.setattr(timeindex, "STEP", 64)
+    with TemporaryDirectory() as tempdir:
+        _writeLines(os.path.join(tempdir, "a.nexus"), *(f"N {n} a-{n % 9} n={n}" for n in range(10, 300, 2)))
+        _writeLines(os.path.join(tempdir, "b.nexus"), *(f"I {n} a-{n % 9} m=1" for n in range(11, 300, 3)))
+        expected = NexusDB(tempdir)
+        expected.readAll()
+        window = list(expected.iterOps(100, 200))
+        errors = []
+
+        def read():
+            try:
+                for _ in range(10):
+                    db = NexusDB(tempdir, checkpointEvery=1)
+                    assert db.readRecord("a-4") == expected.records["a-4"]
+                    assert list(db.iterOps(100, 200)) == window
+                    # Loading saves a checkpoint.
+                    db.readAll()
+                    assert db.records == expected.records
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert not [name for name in os.listdir(tempdir) if name.endswith(".tmp")]
+
+
+def test_scan_pages():
+    with TemporaryDirectory() as tempdir:
+        _writeLines(
+            os.path.join(tempdir, "a.nexus"),
+            *(f'N {n} todo-{n:03d} n={n}' for n in range(100, 0, -1)),
+            'N 200 note-1 text="hi"',
+        )
+        db = NexusDB(tempdir)
+        db.readAll()
+        page = db.scan("todo-", limit=10)
+        assert [recordId for recordId, _ in page] == [f"todo-{n:03d}" for n in range(1, 11)]
+        assert page[0][1] == {"n": 1}
+
+        # Records added and removed between pages don't shift the cursor.
+        db.delete("todo-011")
+        db.set("todo-0105", {"n": 0})
+        db.refresh()
+        page = db.scan("todo-", startAfter=page[-1][0], limit=3)
+        assert [recordId for recordId, _ in page] == ["todo-0105", "todo-012", "todo-013"]
+        assert db.scan("todo-", startAfter="todo-099") == [("todo-100", {"n": 100})]
+        assert [recordId for recordId, _ in db.query(prefix="todo-01", limit=2)] == ["todo-010", "todo-0105"]
+
+
+def test_history():
+    with TemporaryDirectory() as tempdir:
+        db = NexusDB(tempdir)
+        path = os.path.join(tempdir, "other.nexus")
+        _writeLines(
+            path,
+            '* device=other',
+            'N 1 todo-1 task="one" prio=1',
+            'N 2 todo-2 task="two"',
+            'I 5 todo-1 prio=2',
+            'X 7 todo-1 prio',
+        )
+        _writeLines(os.path.join(tempdir, "early.nexus"), 'U 3 todo-1 task="uno"')
+        assert db.history("todo-1", "prio") == [(1, 1), (5, 3), (7, None)]
+        assert db.history("todo-1", "task") == [(1, "one"), (3, "uno")]
+        assert db.history("todo-2") == [(2, {"task": "two"})]
+        assert db.history("missing", "task") == []
+        assert os.path.exists(os.path.join(tempdir, f"{db._device}.other.offsets"))
+
+        # Appended ops are indexed from where the sidecar left off.
+        _writeLines(path, 'X 9 todo-1')
+        db = NexusDB(tempdir)
+        assert db.history("todo-1", "task") == [(1, "one"), (3, "uno"), (9, None)]
+
+        # Sealing rewrites the file, so the index is rebuilt from the segment.
+        db.set("todo-2", {"task": "deux"})
+        db.seal()
+        assert [value for _, value in db.history("todo-2", "task")] == ["two", "deux"]
+
+        from nexus import NexusPage
+        assert NexusPage(db, "todo-1").getPropertyHistory("prio") == [1, 3, None, None]
+
+
+def test_as_of():
+    with TemporaryDirectory() as tempdir:
+        _writeLines(
+            os.path.join(tempdir, "a.nexus"),
+            *[f'I {ts} counter value=1' for ts in range(10, 110, 10)],
+        )
+        _writeLines(os.path.join(tempdir, "b.nexus"), 'N 35 todo-1 task="one"', 'X 75 todo-1')
+        db = NexusDB(tempdir, snapshotEvery=3)
+        assert db.asOf(5) == {}
+        assert db.asOf(55) == {"counter": {"value": 5}, "todo-1": {"task": "one"}}
+        assert [ts for ts, _ in db._snapshotPaths()] == [30, 50]
+
+        # Later reads start from the nearest snapshot at or before them.
+        assert db.asOf(100) == {"counter": {"value": 10}}
+        assert [ts for ts, _ in db._snapshotPaths()] == [30, 50, 75, 100]
+        assert db.asOf(40) == {"counter": {"value": 4}, "todo-1": {"task": "one"}}
+
+        # An op older than a snapshot synced in late invalidates it.
+        _writeLines(os.path.join(tempdir, "c.nexus"), 'I 45 counter value=100')
+        assert db.asOf(100) == {"counter": {"value": 110}}
+        assert db.asOf(40) == {"counter": {"value": 4}, "todo-1": {"task": "one"}}
+
+
+def test_as_of_interval_and_segments():
+    with TemporaryDirectory() as tempdir:
+        db = NexusDB(tempdir, snapshotEvery=None, snapshotInterval=20e-9)
+        path = db._write_file_path
+        _writeLines(path, *[f'I {ts} counter value=1' for ts in range(10, 60, 10)])
+        db.seal()
+        _writeLines(path, *[f'I {ts} counter value=1' for ts in range(60, 110, 10)])
+        assert db.asOf(100) == {"counter": {"value": 10}}
+        assert [ts for ts, _ in db._snapshotPaths()] == [60, 80, 100]
+        assert db.asOf(90) == {"counter": {"value": 9}}
+        assert db.asOf(30) == {"counter": {"value": 3}}
+
+
+def test_compact_records():
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "a.nexus")
+        _writeLines(path, 'N 1 todo-1 task="one"', 'I 2 todo-1 count=2', 'N 3 todo-2 task="two"')
+        db = NexusDB(tempdir, checkpointEvery=1, compactRecords=True)
+        db.readAll()
+        expected = {"todo-1": {"task": "one", "count": 2}, "todo-2": {"task": "two"}}
+        assert db.records == expected
+
+        _writeLines(path, 'X 4 todo-2')
+        assert db.refresh() == {"todo-2"}
+        del expected["todo-2"]
+
+        # Resumes from the checkpoint the first load saved.
+        db = NexusDB(tempdir, compactRecords=True)
+        db.readAll()
+        assert db._replayed == 1
+        assert db.records == expected
+        assert db.get("todo-1", "count") == 2
+
+
+def test_stats():
+    with TemporaryDirectory() as tempdir:
+        events = []
+        db = NexusDB(tempdir, statsHook=lambda event, stats: events.append((event, stats)))
+        db.set("todo-1", {"task": "one"})
+        with db.batch() as b:
+            b.set("todo-2", {"task": "two"})
+            b.inc("todo-2", {"count": "1"})
+        db.readAll()
+
+        stats = db.stats()
+        assert stats["writes"] == 3
+        assert stats["loads"] == 1
+        assert stats["linesParsed"] == 3
+        assert stats["bytesRead"] == os.path.getsize(db._write_file_path)
+        assert stats["recordsMaterialized"] == 2
+        assert stats["files"][db._write_file_path]["linesParsed"] == 3
+        assert [event for event, _ in events] == ["write", "write", "load"]
+        assert events[-1][1] == stats
+
+        _writeLines(os.path.join(tempdir, "other.nexus"), 'N 1 todo-3 task=three')
+        with pytest.raises(ParserError):
+            db.refresh()
+        assert db.stats()["parseErrors"] == 1
@@ -1,5 +1,7 @@
 import re
 
+import pytest
+
 from nexus.file import Record, NexusFile
 
 
@@ -157,4 +159,130 @@ def test_write_string_w_quote():
     f = open("test.nexus", "r")
     for line in f.readlines():
         pass
-    assert re.match(r'N \d+ 8 mobster="Billy \"The Big One\" McGee"\n', line)
+    assert re.match(r'N \d+ 8 mobster="Billy \\"The Big One\\" McGee"\n', line)
+
+
+MIXED_LINES = (
+    '* format=nexus\n'
+    '* version=0\n'
+    'N 1 a foo="Hello, \\"World\\"" x=1.5\n'
+    '\n'
+    'U 2 a bar="two\\nlines" n=-3\r\n'
+    'I 3 a x=2\n'
+    'X 4 a bar\n'
+    'M 5 a\n'
+    'D 6 b-2 count=4\n'
+    'X 7 b-2\n'
+    'N 8 c foo="partial"'
+)
+
+
+def test_mmap_reader_matches_readline():
+    f = open("test.nexus", "w")
+    f.write(MIXED_LINES)
+    f.close()
+
+    nf = NexusFile("test.nexus", "r")
+    expected = list(nf.iterOps())
+    offset = nf.offset
+    nf.close()
+
+    nf = NexusFile("test.nexus", "r", useMmap=True)
+    assert list(nf.iterOps()) == expected
+    assert nf.offset == offset
+    nf.close()
+
+
+def test_mmap_reader_partial_lines():
+    f = open("test.nexus", "w")
+    f.write(MIXED_LINES)
+    f.close()
+
+    for useMmap in (False, True):
+        nf = NexusFile("test.nexus", "r", useMmap=useMmap)
+        ops = list(nf.iterOps(partial=False))
+        assert ops[-1] == ('X', 7, 'b-2', [])
+        assert nf.offset == len(MIXED_LINES.encode()) - len('N 8 c foo="partial"')
+        nf.close()
+
+
+def test_mmap_reader_seek():
+    f = open("test.nexus", "w")
+    f.write('N 1 a x=1\nN 2 b x=2\nN 3 c x=3\n')
+    f.close()
+
+    nf = NexusFile("test.nexus", "r", useMmap=True)
+    nf.seek(len('N 1 a x=1\n'))
+    assert [op[2] for op in nf.iterOps()] == ['b', 'c']
+    nf.close()
+
+
+def test_write_string_escapes_round_trip():
+    values = ['back\\slash', 'it\'s "quoted"', 'two\nlines\r\n', 'tab\there', '\\"', 'ünï ✓']
+    nf = NexusFile("test.nexus", "w")
+    for n, value in enumerate(values):
+        nf.set(str(n), {"s": value})
+    nf.close()
+
+    nf = NexusFile("test.nexus", "r")
+    nf.readAll()
+    assert [nf.records[str(n)]["s"] for n in range(len(values))] == values
+    nf.close()
+
+
+def test_set_many():
+    data = {"name": "Seven \"7\"\n", "n": "7"}
+    nf = NexusFile("test.nexus", "w")
+    assert nf.setMany([("7", data), ("8", {"n": 8, "x": 1.5})]) == 2
+    assert nf.setMany({"9": {"n": -9}}) == 1
+    nf.close()
+    assert data == {"name": "Seven \"7\"\n", "n": "7"}
+
+    nf = NexusFile("test.nexus", "r")
+    nf.readAll()
+    assert nf.records == {
+        "7": {"name": "Seven \"7\"\n", "n": 7},
+        "8": {"n": 8, "x": 1.5},
+        "9": {"n": -9},
+    }
+    nf.close()
+
+
+def test_set_and_set_many_convert_alike():
+    nf = NexusFile("test.nexus", "w")
+    nf.set("a", {"flag": True, "f": 2.5, "n": "3"})
+    nf.setMany({"b": {"flag": True, "f": 2.5, "n": "3"}})
+    nf.close()
+
+    with open("test.nexus", "r") as f:
+        lines = f.readlines()[-2:]
+    assert all(line.endswith('flag=1 f=2.5 n=3\n') for line in lines)
+
+    nf = NexusFile("test.nexus", "r")
+    nf.readAll()
+    assert nf.records["a"] == nf.records["b"] == {"flag": 1, "f": 2.5, "n": 3}
+    nf.close()
+
+
+def test_write_unwritable_floats_as_strings():
+    values = {"a": "nan", "b": "inf", "c": "-Infinity", "d": "1e20", "e": "1e-7", "f": "1.5e3", "g": "-2.5"}
+    nf = NexusFile("test.nexus", "w")
+    nf.set("1", dict(values))
+    nf.setMany({"2": values})
+    nf.close()
+
+    nf = NexusFile("test.nexus", "r")
+    nf.readAll()
+    expected = {**values, "f": 1500, "g": -2.5}
+    assert nf.records == {"1": expected, "2": expected}
+    nf.close()
+
+
+def test_write_invalid_key():
+    nf = NexusFile("test.nexus", "w")
+    for key in ("two words", "a=b", "1st", ""):
+        with pytest.raises(ValueError):
+            nf.set("1", {key: 1})
+        with pytest.raises(ValueError):
+            nf.setMany([("1", {key: 1})])
+    nf.close()
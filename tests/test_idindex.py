@@ -0,0 +1,38 @@
+from nexus import idindex
+from nexus.idindex import IdIndex
+
+
+def test_iter_ids_follows_changes(monkeypatch):
+    monkeypatch.setattr(idindex, "CHUNK_SIZE", 2)
+    records = {f"todo-{n:02d}": {} for n in range(30)}
+    records.update({"note-1": {}, "zz": {}})
+    index = IdIndex()
+    assert list(index.iterIds(records, "todo-1")) == [f"todo-1{n}" for n in range(10)]
+    assert list(index.iterIds(records, "todo-", startAfter="todo-27")) == ["todo-28", "todo-29"]
+
+    del records["todo-28"]
+    index.changed(records, "todo-28")
+    records["todo-275"] = {}
+    index.changed(records, "todo-275")
+    assert list(index.iterIds(records, "todo-2", startAfter="todo-27")) == ["todo-275", "todo-29"]
+
+    # A generator picks up after its last chunk when the list changes under it.
+    ids = index.iterIds(records, "todo-0")
+    assert [next(ids), next(ids)] == ["todo-00", "todo-01"]
+    del records["todo-02"]
+    index.changed(records, "todo-02")
+    assert list(index.iterIds(records, "note")) == ["note-1"]
+    assert list(ids) == [f"todo-0{n}" for n in range(3, 10)]
+
+
+def test_iter_ids_syncs_when_called():
+    records = {"a": {}, "c": {}}
+    index = IdIndex()
+    list(index.iterIds(records))
+    records["b"] = {}
+    index.changed(records, "b")
+    # The catch up is done by the call, under the caller's lock, not on
+    # the first next().
+    ids = index.iterIds(records)
+    assert not index._pending
+    assert list(ids) == ["a", "b", "c"]
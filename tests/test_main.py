@@ -0,0 +1,64 @@
+import io
+import os
+import sys
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from nexus.db import NexusDB
+from nexus.main import execCommands
+
+
+def test_exec_commands(capsys):
+    commands = io.StringIO(
+        'set todo-1 task="Write docs" prio=3\n'
+        'set todo-2 task=Ship prio=5\n'
+        '# comments and blank lines are skipped\n'
+        '\n'
+        'get todo-1 task prio\n'
+        'inc todo-1 prio=2\n'
+        'get todo-1 prio missing\n'
+        'find todo prio>4 task\n'
+        'delete todo-2\n'
+        'find todo\n'
+        'bogus todo-1\n'
+        'get todo-3\n'
+    )
+    with TemporaryDirectory() as tempdir:
+        out = io.StringIO()
+        assert execCommands(NexusDB(tempdir), commands, out) == 1
+        assert out.getvalue().splitlines() == [
+            "todo-1\tWrite docs\t3",
+            "todo-1\t5\t",
+            "todo-1\tWrite docs",
+            "todo-2\tShip",
+            "todo-1",
+            "todo-3\t",
+        ]
+        assert "line 11: Unknown command 'bogus'" in capsys.readouterr().err
+
+        db = NexusDB(tempdir)
+        db.readAll()
+        assert db.records == {"todo-1": {"task": "Write docs", "prio": 5}}
+
+
+@pytest.mark.parametrize("readAllShare", [0, 1])
+def test_find_since_until(capsys, monkeypatch, readAllShare):
+    from nexus import main as mainModule
+    from nexus.main import main
+
+    # Both reading the changed records on their own and loading them all.
+    monkeypatch.setattr(mainModule, "READ_ALL_SHARE", readAllShare)
+    with TemporaryDirectory() as tempdir:
+        with open(os.path.join(tempdir, "a.nexus"), "w", encoding="utf8") as f:
+            f.write('N 100 todo-1 task="one"\nN 200 todo-2 task="two"\nN 300 todo-3 task="three"\n')
+            f.write('U 400 todo-1 task="uno"\nX 500 todo-3\n')
+
+        for flags, expected in [
+            (["--since", "150"], ["todo-1\tuno", "todo-2\ttwo"]),
+            (["--since", "150", "--until", "300"], ["todo-2\ttwo"]),
+            (["--until", "100"], ["todo-1\tuno"]),
+        ]:
+            monkeypatch.setattr(sys, "argv", ["nexus", tempdir, "find", "todo", "task"] + flags)
+            main()
+            assert capsys.readouterr().out.splitlines() == expected
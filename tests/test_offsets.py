@@ -0,0 +1,101 @@
+import os
+import threading
+from tempfile import TemporaryDirectory
+
+from nexus import offsets
+from nexus.segment import writeSegment
+
+
+def _writeLines(path, *lines):
+    with open(path, "a", encoding="utf8") as f:
+        for line in lines:
+            f.write(line + "\n")
+
+
+def _header(index):
+    with open(index.path, "rb") as f:
+        return index._readHeader(f)[0]
+
+
+def test_lookup_sorted_and_tail(monkeypatch):
+    monkeypatch.setattr(offsets, "MAX_TAIL", 200)
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "1.nexus")
+        _writeLines(path, "* format=nexus", *(f"N {n} rec-{n % 7} n={n}" for n in range(50)))
+
+        index = offsets.OffsetIndex(path, "me")
+        assert os.path.basename(index.path) == "me.1.offsets"
+        assert index.update()
+        assert not index.update()
+        assert [op[3]["n"] for op in index.readOps("rec-3")] == list(range(3, 50, 7))
+        assert index.readOps("rec-30") == []
+
+        # Appends go to the tail until it is merged into the sorted part.
+        _writeLines(path, "I 100 rec-3 n=1", 'N 101 new foo="x"')
+        inode = os.stat(index.path).st_ino
+        assert index.update()
+        # The sidecar is replaced, never patched where other readers map it.
+        assert os.stat(index.path).st_ino != inode
+        assert sorted(os.listdir(tempdir)) == ["1.nexus", "me.1.offsets"]
+        assert os.path.getsize(index.path) > _header(index)["sorted"]
+        assert [op[:3] for op in index.readOps("rec-3")][-1] == ("I", 100, "rec-3")
+        assert index.readOps("new") == [("N", 101, "new", {"foo": "x"})]
+        opsById = index.readOpsMany(["rec-3", "new", "rec-30"])
+        assert opsById == {"rec-3": index.readOps("rec-3"), "new": index.readOps("new")}
+
+        _writeLines(path, *(f"U {200 + n} rec-{n % 7} m=1" for n in range(20)))
+        assert index.update()
+        assert os.path.getsize(index.path) == _header(index)["sorted"]
+        ops = index.readOps("rec-3")
+        assert [op[1] for op in ops] == sorted(op[1] for op in ops)
+        assert len(ops) == 7 + 1 + 3
+        assert [op[0] for op in offsets.OffsetIndex(path, "me").readOps("new")] == ["N"]
+
+
+def test_rebuilt_after_seal():
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "1.nexus")
+        _writeLines(path, 'N 100 a foo="x"', "N 150 b n=1")
+        index = offsets.OffsetIndex(path, "me")
+        index.update()
+
+        writeSegment(
+            os.path.join(tempdir, "1.000001.nxseg"),
+            [("N", 100, "a", {"foo": "x"}), ("N", 150, "b", {"n": 1})],
+        )
+        with open(path, "w", encoding="utf8") as f:
+            f.write("I 200 b n=2\n")
+        assert index.update()
+        assert index.readOps("a") == [("N", 100, "a", {"foo": "x"})]
+        assert index.readOps("b") == [("N", 150, "b", {"n": 1}), ("I", 200, "b", {"n": 2})]
+
+
+def test_concurrent_readers(monkeypatch):
+    monkeypatch.setattr(offsets, "MAX_TAIL", 200)
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "1.nexus")
+        _writeLines(path, "* format=nexus", *(f"N {n} rec-{n % 7} n={n}" for n in range(50)))
+        errors = []
+
+        def read(n):
+            try:
+                for i in range(20):
+                    if n == 0:
+                        _writeLines(path, f"I {100 + i} rec-3 n=1")
+                    index = offsets.OffsetIndex(path, "me")
+                    index.update()
+                    ns = [op[3]["n"] for op in index.readOps("rec-3") if op[0] == "N"]
+                    assert ns == list(range(3, 50, 7))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert sorted(os.listdir(tempdir)) == ["1.nexus", "me.1.offsets"]
+        index = offsets.OffsetIndex(path, "me")
+        index.update()
+        assert len(index.readOps("rec-3")) == 7 + 20
@@ -1,6 +1,6 @@
 import pytest
 
-from nexus.parser import Parser, ParserError, TOKEN_TYPE
+from nexus.parser import Parser, ParserError, TOKEN_TYPE, parseOpLine
 
 
 @pytest.mark.parametrize("string,expectedType,valid", (
@@ -119,3 +119,29 @@ CHAR_SLASH = '\x5c'
 def test_string_literal_parsing(literal, value):
     p = Parser(literal)
     assert value == p.parseStringLiteral(literal)
+
+
+@pytest.mark.parametrize("line,expected", (
+    ('N 0 1 foo="Hello, World!"', ('N', 0, '1', {'foo': 'Hello, World!'})),
+    ('U 12 todo-1 x=42 y=3.5\n', ('U', 12, 'todo-1', {'x': 42, 'y': 3.5})),
+    ('I 12 todo-1 x=1.0\n', ('I', 12, 'todo-1', {'x': 1})),
+    ('N 5 a s="back\\\\slash" t="two\\nlines"\n', ('N', 5, 'a', {'s': 'back\\slash', 't': 'two\nlines'})),
+    ('N 5 a s="say \\"hi\\"" n=-3\n', ('N', 5, 'a', {'s': 'say "hi"', 'n': -3})),
+    ('X 7 todo-1\n', ('X', 7, 'todo-1', [])),
+    ('X 7 todo-1 x y\n', ('X', 7, 'todo-1', ['x', 'y'])),
+    ('* version=0\n', ('*', 0, 'version=0', None)),
+))
+def test_parse_op_line(line, expected):
+    assert parseOpLine(line) == expected
+
+
+@pytest.mark.parametrize("line", (
+    'N 0',
+    'N zero 1 x=1',
+    'N 0 1 x=',
+    'N 0 1 x="unterminated',
+    'N 0 1 x=1 junk',
+))
+def test_parse_op_line_invalid(line):
+    with pytest.raises(ParserError):
+        parseOpLine(line)
@@ -0,0 +1,71 @@
+import pytest
+
+from nexus.file import Record
+from nexus.query import Query, QueryError, parseQuery, splitWords
+
+
+RECORDS = {
+    "todo-1": {"task": "Write docs", "prio": 3, "done": 0},
+    "todo-2": {"task": "Fix parser", "prio": 5, "done": 1, "owner": "bob"},
+    "todo-3": {"task": "Ship it", "prio": 1, "done": 0, "owner": "alice"},
+    "note-1": {"task": "Not a todo", "prio": 9},
+}
+
+
+def ids(query, records=RECORDS):
+    return [recordId for recordId, _ in query.run(records)]
+
+
+@pytest.mark.parametrize("where,expected", [
+    ("", ["todo-1", "todo-2", "todo-3"]),
+    ("prio>1", ["todo-1", "todo-2"]),
+    ("prio>=3 done=0", ["todo-1"]),
+    ("prio>3 OR owner=alice", ["todo-2", "todo-3"]),
+    ("NOT done=1", ["todo-1", "todo-3"]),
+    ("done=0 AND ( prio<2 OR task~docs )", ["todo-1", "todo-3"]),
+    ("owner!=bob", ["todo-1", "todo-3"]),
+    ("task~=Fix", ["todo-2"]),
+    ("task=~it", ["todo-3"]),
+    ('task="Ship it"', ["todo-3"]),
+    ('prio="3"', []),
+    ("owner<b", ["todo-3"]),
+])
+def test_query_where(where, expected):
+    assert ids(Query(where, prefix="todo")) == expected
+
+
+def test_query_words_keep_shell_stripped_values():
+    assert ids(Query(["task=Ship it"])) == ["todo-3"]
+
+
+def test_query_fields_and_order():
+    query = Query("prio>1 task", fields=["prio"], orderBy="prio", descending=True)
+    assert list(query.run(RECORDS)) == [
+        ("note-1", (9, "Not a todo")),
+        ("todo-2", (5, "Fix parser")),
+        ("todo-1", (3, "Write docs")),
+    ]
+
+
+def test_query_limit_stops_scanning():
+    seen = []
+
+    class Records(dict):
+        def items(self):
+            for item in super().items():
+                seen.append(item[0])
+                yield item
+
+    assert ids(Query("done=0", limit=1), Records(RECORDS)) == ["todo-1"]
+    assert seen == ["todo-1"]
+    assert ids(Query(orderBy="prio", limit=2)) == ["todo-3", "todo-1"]
+
+
+def test_split_words():
+    assert splitWords('a=1 (b="x y" OR c)') == ["a=1", "(", 'b="x y"', "OR", "c", ")"]
+
+
+@pytest.mark.parametrize("where", ["a=1 OR", "( a=1", "a=1 )", "NOT", 'a="open', "a=1 OR OR b=2"])
+def test_query_errors(where):
+    with pytest.raises(QueryError):
+        parseQuery(where)
@@ -0,0 +1,85 @@
+import os
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from nexus.checkpoint import fingerprint
+from nexus.segment import Segment, SegmentError, writeSegment, nextSegmentPath, segmentPaths, sealedOffset
+
+
+OPS = [
+    ('N', 100, 'todo-1', {'task': 'Write "tests"\n', 'done': 0, 'score': 2.5}),
+    ('N', 90, 'todo-2', {'task': 'Ünïcode', 'done': 1, 'score': 1.0}),
+    ('I', 150, 'todo-1', {'done': 1}),
+    ('D', 160, 'todo-2', {'done': -3, 'big': 1 << 80}),
+    ('U', 170, 'todo-2', {}),
+    ('X', 200, 'todo-1', ['task', 'score']),
+    ('X', 210, 'todo-2', []),
+]
+
+
+def test_segment_round_trip():
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "a.000001.nxseg")
+        writeSegment(path, OPS)
+
+        with Segment(path) as seg:
+            assert list(seg.iterOps()) == OPS
+
+
+def test_segment_rejects_other_files():
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "a.000001.nxseg")
+        with open(path, "wb") as f:
+            f.write(b"N 0 1 foo=1\n")
+
+        with pytest.raises(SegmentError):
+            Segment(path)
+
+
+def test_segment_paths():
+    with TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, "a.nexus")
+        assert segmentPaths(filename) == []
+
+        first = nextSegmentPath(filename)
+        writeSegment(first, OPS)
+        second = nextSegmentPath(filename)
+        writeSegment(second, OPS)
+        writeSegment(os.path.join(tempdir, "b.000001.nxseg"), OPS)
+
+        assert segmentPaths(filename) == [first, second]
+
+
+def test_sealed_offset():
+    with TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, "a.nexus")
+        with open(filename, "w") as f:
+            f.write('N 100 todo-1 done=0\nN 200 todo-2 done=0\n')
+        writeSegment(nextSegmentPath(filename), OPS)
+        assert sealedOffset(filename) == 0
+
+        path = nextSegmentPath(filename)
+        writeSegment(path, OPS[:1], fingerprint(filename, 20))
+        with Segment(path) as seg:
+            assert seg.source["offset"] == 20
+        assert sealedOffset(filename) == 20
+        with open(filename, "a") as f:
+            f.write('N 300 todo-3 done=0\n')
+        assert sealedOffset(filename) == 20
+
+        # Once the text file is replaced nothing is skipped.
+        with open(filename, "w") as f:
+            f.write('N 300 todo-3 done=0\n')
+        assert sealedOffset(filename) == 0
+
+
+def test_segment_index_and_read_op():
+    with TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "a.000001.nxseg")
+        writeSegment(path, OPS)
+
+        with Segment(path) as seg:
+            index = list(seg.iterIndex())
+            assert [(ts, recordId) for _, ts, recordId in index] == [op[1:3] for op in OPS]
+            assert [seg.readOp(pos, ts) for pos, ts, _ in index] == OPS
@@ -0,0 +1,46 @@
+import pytest
+
+from nexus.file import NexusFile
+from nexus.store import RecordStore
+
+
+OPS = [
+    ('N', 1, 'todo-1', {'task': 'one', 'done': 0}),
+    ('N', 2, 'todo-2', {'task': 'two', 'done': 0}),
+    ('I', 3, 'todo-1', {'done': 1, 'count': 2}),
+    ('D', 4, 'todo-2', {'count': 1}),
+    ('U', 5, 'todo-2', {'task': 'deux'}),
+    ('X', 6, 'todo-1', ['task', 'missing']),
+    ('N', 7, 'todo-3', {'done': 0}),
+    ('X', 8, 'todo-3', []),
+]
+
+
+def test_store_matches_dict_records():
+    store = RecordStore()
+    records = {}
+    for op, _, recordId, data in OPS:
+        store.apply(op, recordId, data)
+        NexusFile.applyOperation(op, records, recordId, data)
+        assert store == records
+    assert store.toRecords() == records
+    assert [rec.id for rec in store.values()] == ['todo-1', 'todo-2']
+
+
+def test_store_shares_shapes():
+    store = RecordStore()
+    for n in range(100):
+        store.apply('N', f'todo-{n}', {'task': str(n), 'done': n % 2})
+    shapes = {store[f'todo-{n}']._shape for n in range(100)}
+    assert len(shapes) == 1
+    assert store['todo-5'].get('done') == 1
+    assert store['todo-5'].get('missing', 'x') == 'x'
+    assert 'task' in store['todo-5']
+
+
+def test_store_is_read_only():
+    store = RecordStore({'todo-1': {'task': 'one'}})
+    with pytest.raises(TypeError):
+        store['todo-2'] = {}
+    with pytest.raises(TypeError):
+        store['todo-1']['task'] = 'two'
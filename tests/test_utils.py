@@ -0,0 +1,76 @@
+import os
+import threading
+import uuid
+
+import pytest
+
+from nexus import utils
+
+
+def test_device_id_is_cached(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+    monkeypatch.setattr(utils, "_deviceId", None)
+    expected = str(uuid.uuid1(uuid.getnode(), 0))[24:]
+    assert utils.deviceId() == expected
+
+    path = tmp_path / "nexus" / "devices"
+    host = os.uname().nodename
+    assert path.read_text() == f"{host}\t{expected}\n"
+
+    # Later processes read it back instead of asking uuid again.
+    path.write_text(f"other-host\t111111111111\n{host}\t0123456789ab\n")
+    monkeypatch.setattr(utils, "_deviceId", None)
+    monkeypatch.setattr(uuid, "getnode", lambda: 1 / 0)
+    assert utils.deviceId() == "0123456789ab"
+    assert utils.deviceId() == "0123456789ab"
+
+
+def test_atomic_write(tmp_path, monkeypatch):
+    path = str(tmp_path / "file")
+    with utils.atomicWrite(path) as f:
+        f.write(b"one")
+    with utils.atomicWrite(path, "w", encoding="utf8", sync=True) as f:
+        f.write("two")
+    assert open(path).read() == "two"
+
+    with pytest.raises(ZeroDivisionError):
+        with utils.atomicWrite(path) as f:
+            f.write(b"three")
+            1 / 0
+    assert open(path).read() == "two"
+    assert os.listdir(tmp_path) == ["file"]
+
+    # A cache that loses the rename keeps the file it had.
+    def replace(src, dst):
+        raise PermissionError(dst)
+    monkeypatch.setattr(os, "replace", replace)
+    with utils.atomicWrite(path, cache=True) as f:
+        f.write(b"four")
+    with pytest.raises(PermissionError):
+        with utils.atomicWrite(path) as f:
+            f.write(b"four")
+    assert open(path).read() == "two"
+    assert os.listdir(tmp_path) == ["file"]
+
+
+def test_atomic_write_from_many_threads(tmp_path):
+    path = str(tmp_path / "file")
+    errors = []
+
+    def write(n):
+        try:
+            for _ in range(50):
+                with utils.atomicWrite(path) as f:
+                    f.write(str(n).encode() * 1000)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    data = open(path, "rb").read()
+    assert len(data) == 1000 and len(set(data)) == 1
+    assert os.listdir(tmp_path) == ["file"]